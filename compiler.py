@@ -0,0 +1,216 @@
+""" This file holds the workload compiler, which converts a text workload into a memory-mapped binary format. """
+from typing import Iterator, List, Optional, Tuple
+import datetime
+import argparse
+import struct
+import json
+import mmap
+import os
+
+# Layout of a compiled workload: [header][table names][epochs][statements][string blob]. All little-endian.
+_MAGIC, _VERSION = b'TWKL', 1
+_HEADER = struct.Struct('<4sHxxIIIQ')  # Magic, version, # of tables, # of epochs, # of statements, blob size.
+_TABLE_NAME_LENGTH = struct.Struct('<H')
+_EPOCH = struct.Struct('<dI')  # POSIX timestamp, index of the first statement in this epoch.
+_STATEMENT = struct.Struct('<QIHB')  # Blob offset, blob length, table id, statement kind.
+
+# Statement kinds, and the table id we assign to statements without a table (i.e. SELECTs).
+STATEMENT_INSERT, STATEMENT_SELECT = 0, 1
+_NO_TABLE = 0xFFFF
+
+# An epoch is every statement that shares a single workload timestamp: (timestamp, [(kind, table, statement), ...]).
+Epoch = Tuple[float, List[Tuple[int, Optional[str], str]]]
+
+
+def get_table_name(statement: str) -> str:
+    """
+    :param statement: INSERT statement of the form 'insert into [table] values (...);'.
+    :return: The name of the table being inserted into.
+    """
+    statement_split_by_into = statement.split("into")
+    statement_split_by_values = statement_split_by_into[1].split("values")
+
+    table_name = statement_split_by_values[0]
+    table_name = table_name.replace(' ', "")
+
+    return table_name
+
+
+def get_compiled_filename(filename: str) -> str:
+    return filename + '.compiled'
+
+
+def is_compiled_current(filename: str) -> bool:
+    """
+    :param filename: Location of the text workload.
+    :return: True if a compiled workload exists for this file and is newer than the text workload.
+    """
+    compiled_filename = get_compiled_filename(filename)
+    return os.path.exists(compiled_filename) and \
+        (not os.path.exists(filename) or os.path.getmtime(compiled_filename) >= os.path.getmtime(filename))
+
+
+def _parse_timestamp(timestamp: str) -> float:
+    return datetime.datetime.fromisoformat(timestamp.strip()).timestamp()
+
+
+def iterate_text_workload(filename: str) -> Iterator[Epoch]:
+    """
+    :param filename: Location of the text workload, where each line is of the form '[statement];[timestamp]'.
+    :return: An iterator of epochs, parsed directly from the text file.
+    """
+    current_timestamp, current_statements = None, []
+
+    with open(filename, 'r') as file_handle:
+        for line in file_handle:
+            record_values = line.strip().split(';')
+            statement = record_values[0] + ';'
+            timestamp = record_values[1]
+
+            if timestamp != current_timestamp:
+                if current_timestamp is not None:
+                    yield _parse_timestamp(current_timestamp), current_statements
+                current_timestamp, current_statements = timestamp, []
+
+            if "insert" in statement:
+                current_statements.append((STATEMENT_INSERT, get_table_name(statement), statement))
+            else:
+                current_statements.append((STATEMENT_SELECT, None, statement))
+
+    if current_timestamp is not None:
+        yield _parse_timestamp(current_timestamp), current_statements
+
+
+def compile_workload(filename: str) -> str:
+    """
+    :param filename: Location of the text workload to compile.
+    :return: Location of the compiled workload.
+    """
+    table_ids, epochs, statements = {}, [], []
+    blob_size = 0
+
+    compiled_filename = get_compiled_filename(filename)
+    with open(compiled_filename + '.tmp', 'wb') as compiled_file:
+        # Write a placeholder header, we will come back to this once we know our counts.
+        compiled_file.write(b'\0' * _HEADER.size)
+
+        # The string blob is written last, so we stage it in a separate file as we parse.
+        with open(compiled_filename + '.blob', 'wb+') as blob_file:
+            for timestamp, epoch_statements in iterate_text_workload(filename):
+                epochs.append(_EPOCH.pack(timestamp, len(statements)))
+
+                for kind, table_name, statement in epoch_statements:
+                    table_id = _NO_TABLE if table_name is None else table_ids.setdefault(table_name, len(table_ids))
+                    statement_bytes = statement.encode('utf-8')
+                    statements.append(_STATEMENT.pack(blob_size, len(statement_bytes), table_id, kind))
+                    blob_file.write(statement_bytes)
+                    blob_size += len(statement_bytes)
+
+            # Table names are indexed by their id.
+            for table_name in sorted(table_ids, key=table_ids.get):
+                table_name_bytes = table_name.encode('utf-8')
+                compiled_file.write(_TABLE_NAME_LENGTH.pack(len(table_name_bytes)) + table_name_bytes)
+            compiled_file.write(b''.join(epochs))
+            compiled_file.write(b''.join(statements))
+
+            blob_file.seek(0)
+            while True:
+                chunk = blob_file.read(1 << 20)
+                if not chunk:
+                    break
+                compiled_file.write(chunk)
+
+        compiled_file.seek(0)
+        compiled_file.write(_HEADER.pack(_MAGIC, _VERSION, len(table_ids), len(epochs), len(statements), blob_size))
+
+    os.remove(compiled_filename + '.blob')
+    os.replace(compiled_filename + '.tmp', compiled_filename)
+    return compiled_filename
+
+
+class CompiledWorkload:
+    """ Read-only view of a compiled workload. Statement text is decoded straight from the memory map. """
+
+    def __init__(self, compiled_filename: str):
+        self.file_handle = open(compiled_filename, 'rb')
+        self.memory_map = mmap.mmap(self.file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.table_count, self.epoch_count, self.statement_count, blob_size = \
+            _HEADER.unpack_from(self.memory_map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError(f'{compiled_filename} is not a compiled workload (or was compiled by another version).')
+
+        # Read our interned table names.
+        offset, self.table_names = _HEADER.size, []
+        for _ in range(self.table_count):
+            name_length, = _TABLE_NAME_LENGTH.unpack_from(self.memory_map, offset)
+            offset += _TABLE_NAME_LENGTH.size
+            self.table_names.append(str(self.memory_map[offset:offset + name_length], 'utf-8'))
+            offset += name_length
+
+        self.epoch_offset = offset
+        self.statement_offset = self.epoch_offset + self.epoch_count * _EPOCH.size
+        self.blob_offset = self.statement_offset + self.statement_count * _STATEMENT.size
+
+    def __iter__(self) -> Iterator[Epoch]:
+        memory_view, blob_view, statement_view = memoryview(self.memory_map), None, None
+        try:
+            blob_view = memory_view[self.blob_offset:]
+            table_names = {i: table_name for i, table_name in enumerate(self.table_names)}
+            table_names[_NO_TABLE] = None
+
+            for i in range(self.epoch_count):
+                timestamp, first_statement = _EPOCH.unpack_from(memory_view, self.epoch_offset + i * _EPOCH.size)
+                last_statement = self.statement_count if i + 1 == self.epoch_count else \
+                    _EPOCH.unpack_from(memory_view, self.epoch_offset + (i + 1) * _EPOCH.size)[1]
+
+                statement_view = memory_view[self.statement_offset + first_statement * _STATEMENT.size:
+                                             self.statement_offset + last_statement * _STATEMENT.size]
+                yield timestamp, [(kind, table_names[table_id], str(blob_view[offset:offset + length], 'utf-8'))
+                                  for offset, length, table_id, kind in _STATEMENT.iter_unpack(statement_view)]
+                statement_view.release()
+
+        finally:
+            # All views must be released before our memory map can be closed.
+            for view in (statement_view, blob_view, memory_view):
+                if view is not None:
+                    view.release()
+
+    def close(self) -> None:
+        self.memory_map.close()
+        self.file_handle.close()
+
+
+def iterate_workload(filename: str) -> Iterator[Epoch]:
+    """
+    :param filename: Location of the text workload. If an up-to-date compiled version exists, we read that instead.
+    :return: An iterator of epochs.
+    """
+    if not is_compiled_current(filename):
+        yield from iterate_text_workload(filename)
+        return
+
+    compiled_workload = CompiledWorkload(get_compiled_filename(filename))
+    try:
+        yield from compiled_workload
+    finally:
+        compiled_workload.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile a workload file into a memory-mapped binary format.')
+    parser.add_argument('database', type=str, choices=['postgres', 'mysql'], help='Database of the workload.')
+    parser.add_argument('concurrency', type=str, choices=['high', 'low'], help='Concurrency of the workload.')
+    parser.add_argument('--force', action='store_true', help='Compile even if the compiled workload is current.')
+    parser.add_argument('--config_path', type=str, default='config', help='Location of configuration files.')
+    args = parser.parse_args()
+
+    with open(args.config_path + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+    workload_filename = general_json[f'{args.concurrency}-concurrency-{args.database}-workload']
+
+    if args.force or not is_compiled_current(workload_filename):
+        print(f'[{datetime.datetime.now()}][compiler.py] Compiling {workload_filename}.')
+        compile_workload(workload_filename)
+    print(f'[{datetime.datetime.now()}][compiler.py] {get_compiled_filename(workload_filename)} is up to date.')
@@ -111,12 +111,51 @@ def get_postgres_pooled_connection(user: str, password: str, host: str, database
     return _postgres_connection_pool.getconn()
 
 
-def get_results_connection(results_file: str):
+async def get_mysql_async_connection(user: str, password: str, host: str, database: str):
+    """
+    :param user: Username to use for connection.
+    :param password: Password to use for connection.
+    :param host: Host URI associated with connection.
+    :param database: MySQL database to use upon connecting.
+    :return: An asyncio connection to some MySQL database.
+    """
+    import aiomysql  # Only required for the asyncio consumer engine.
+
+    return await aiomysql.connect(
+        user=user,
+        password=password,
+        host=host,
+        db=database,
+        autocommit=False
+    )
+
+
+async def get_postgres_async_connection(user: str, password: str, host: str, database: str):
+    """
+    :param user: Username to use for connection.
+    :param password: Password to use for connection.
+    :param host: Host URI associated with connection.
+    :param database: PostgreSQL database to use upon connecting.
+    :return: An asyncio connection to some PostgreSQL database. These are always in autocommit mode.
+    """
+    import aiopg  # Only required for the asyncio consumer engine.
+
+    return await aiopg.connect(
+        user=user,
+        password=password,
+        host=host,
+        database=database
+    )
+
+
+def get_results_connection(results_file: str, timeout: float = 60.0):
     """
     :param results_file: File to create / append to.
+    :param timeout: Seconds to wait for another writer (e.g. a parallel lane of orchestrator.py) to release our file.
     :return: A connection to some SQLite database.
     """
     return sqlite3.connect(
         results_file,
+        timeout=timeout,
         check_same_thread=False
     )
@@ -0,0 +1,441 @@
+""" This file holds the columnar exporter, which copies our SQLite results into typed NumPy column files. """
+from connect import get_results_connection
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import datetime
+import argparse
+import hashlib
+import json
+import os
+import re
+
+# Version of the manifest layout below. Bump this if the layout changes.
+_MANIFEST_VERSION = 1
+_MANIFEST_FILENAME = 'manifest.json'
+
+# Column kinds. Seconds and bytes are MySQL sys schema strings (e.g. '1.23 ms', '4.56 MiB') converted to numbers.
+# Empty columns have held nothing but NULLs so far. Text (i.e. free text, such as queries) is stored as strings.
+KIND_DATETIME, KIND_INTEGER, KIND_REAL, KIND_SECONDS, KIND_BYTES, KIND_CATEGORY, KIND_TEXT, KIND_EMPTY = \
+    'datetime', 'integer', 'real', 'seconds', 'bytes', 'category', 'text', 'empty'
+
+# Categories are held in our manifest, so only a few (short) values may be stored as categories.
+_MAX_CATEGORIES, _MAX_CATEGORY_LENGTH = 256, 64
+
+_SECONDS_PATTERN = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*(ps|ns|us|µs|ms|s|m|min|h|d|w)\s*$')
+_SECONDS_PER_UNIT = {'ps': 1e-12, 'ns': 1e-9, 'us': 1e-6, 'µs': 1e-6, 'ms': 1e-3, 's': 1.0, 'm': 60.0,
+                     'min': 60.0, 'h': 3600.0, 'd': 86400.0, 'w': 604800.0}
+_CLOCK_PATTERN = re.compile(r'^\s*(-?)(\d+):(\d{2}):(\d{2}(?:\.\d+)?)\s*$')
+_BYTES_PATTERN = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*(bytes|KiB|MiB|GiB|TiB|PiB|EiB)\s*$')
+_BYTES_PER_UNIT = {'bytes': 1, 'KiB': 1 << 10, 'MiB': 1 << 20, 'GiB': 1 << 30, 'TiB': 1 << 40, 'PiB': 1 << 50,
+                   'EiB': 1 << 60}
+
+
+def _parse_seconds(value) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    seconds_match = _SECONDS_PATTERN.match(str(value))
+    if seconds_match is not None:
+        return float(seconds_match.group(1)) * _SECONDS_PER_UNIT[seconds_match.group(2)]
+
+    # MySQL TIME values (e.g. wait ages) are given as HH:MM:SS.
+    clock_match = _CLOCK_PATTERN.match(str(value))
+    if clock_match is not None:
+        seconds = int(clock_match.group(2)) * 3600 + int(clock_match.group(3)) * 60 + float(clock_match.group(4))
+        return -seconds if clock_match.group(1) == '-' else seconds
+
+    return None
+
+
+def _parse_bytes(value) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    bytes_match = _BYTES_PATTERN.match(str(value))
+    if bytes_match is None:
+        return None
+    return float(bytes_match.group(1)) * _BYTES_PER_UNIT[bytes_match.group(2)]
+
+
+def _is_category(categories: List[str], values: List) -> bool:
+    """ :return: True if the given values (with the categories we already hold) are few and short enough to encode. """
+    present_values = {str(v) for v in values if v is not None}
+    return all(len(v) <= _MAX_CATEGORY_LENGTH for v in present_values) and \
+        len(present_values.union(categories)) <= _MAX_CATEGORIES
+
+
+def _infer_kind(declared_type: str, values: List) -> str:
+    """
+    :param declared_type: Type the column was declared with in SQLite.
+    :param values: Every value of the column that we are about to export.
+    :return: The kind of column file to store these values as.
+    """
+    present_values = [v for v in values if v is not None]
+    if 'DATE' in declared_type.upper():
+        return KIND_DATETIME
+    elif len(present_values) == 0:
+        return KIND_EMPTY
+    elif all(isinstance(v, int) for v in present_values):
+        return KIND_INTEGER
+    elif all(isinstance(v, (int, float)) for v in present_values):
+        return KIND_REAL
+    elif all(_parse_seconds(v) is not None for v in present_values):
+        return KIND_SECONDS
+    elif all(_parse_bytes(v) is not None for v in present_values):
+        return KIND_BYTES
+    else:
+        return KIND_CATEGORY if _is_category([], present_values) else KIND_TEXT
+
+
+def _get_widened_kind(column: Dict, kind: str, values: List) -> str:
+    """
+    :param column: Manifest entry of the column, holding the kind of every chunk exported so far.
+    :param kind: Kind inferred for the values we are about to export.
+    :param values: Values we are about to export.
+    :return: The narrowest kind that holds both our exported values and the given values.
+    """
+    if kind == KIND_EMPTY or (kind == column['kind'] and kind != KIND_CATEGORY):
+        return column['kind']
+    elif column['kind'] == KIND_EMPTY:
+        return kind
+    elif {column['kind'], kind} <= {KIND_INTEGER, KIND_REAL}:
+        return KIND_REAL
+
+    # Numbers are parsed as themselves, so numeric columns can be relabeled as seconds or bytes (and vice versa).
+    elif column['kind'] in (KIND_INTEGER, KIND_REAL) and kind in (KIND_SECONDS, KIND_BYTES):
+        return kind
+    elif column['kind'] in (KIND_SECONDS, KIND_BYTES) and kind in (KIND_INTEGER, KIND_REAL):
+        return column['kind']
+    elif column['kind'] == KIND_CATEGORY and kind != KIND_TEXT and _is_category(column['categories'], values):
+        return KIND_CATEGORY
+    else:
+        return KIND_TEXT
+
+
+def _to_strings(column: Dict, array: np.ndarray) -> np.ndarray:
+    """ :return: The given (exported) column array as text. Missing values become empty strings. """
+    if column['kind'] == KIND_CATEGORY:
+        return np.array(['' if c < 0 else column['categories'][c] for c in array], dtype=str)
+    return np.array(['' if v != v else str(v.item()) for v in array], dtype=str)
+
+
+def _rewrite_column(directory: str, table: Dict, column_name: str, convert) -> None:
+    """ Replace the given column of every exported chunk of a table with convert(column array). """
+    for chunk in table['chunks']:
+        chunk_filename = os.path.join(directory, chunk['path'])
+        if chunk['is_compressed']:
+            with np.load(chunk_filename + '.npz') as chunk_file:
+                chunk_columns = {k: chunk_file[k] for k in chunk_file.files}
+            if column_name in chunk_columns:
+                chunk_columns[column_name] = convert(chunk_columns[column_name])
+                np.savez_compressed(chunk_filename + '.tmp.npz', **chunk_columns)
+                os.replace(chunk_filename + '.tmp.npz', chunk_filename + '.npz')
+
+        elif os.path.exists(f'{chunk_filename}.{column_name}.npy'):
+            np.save(f'{chunk_filename}.{column_name}.tmp.npy', convert(np.load(f'{chunk_filename}.{column_name}.npy')))
+            os.replace(f'{chunk_filename}.{column_name}.tmp.npy', f'{chunk_filename}.{column_name}.npy')
+
+
+def _widen_column(directory: str, table: Dict, column_name: str, kind: str) -> None:
+    """ Change the kind of a column, converting the chunks already exported if their arrays no longer fit. """
+    column = table['columns'][column_name]
+    old_column = dict(column)
+    column['kind'] = kind
+    if kind == KIND_CATEGORY:
+        column.setdefault('categories', [])
+    elif kind == KIND_TEXT:
+        column.pop('categories', None)
+
+    if old_column['kind'] == KIND_EMPTY:
+        _rewrite_column(directory, table, column_name, lambda a: _to_array(column, [None for _ in a]))
+    elif kind == KIND_TEXT:
+        _rewrite_column(directory, table, column_name, lambda a: _to_strings(old_column, a))
+
+
+def _to_array(column: Dict, values: List) -> np.ndarray:
+    """
+    :param column: Manifest entry of the column. New categories are appended to this entry.
+    :param values: Values of the column for a single chunk.
+    :return: A typed array holding the given values. Missing values are NaN, NaT, -1 for categories, or empty strings
+             for text.
+    """
+    if column['kind'] == KIND_DATETIME:
+        return np.array([None if v is None else str(v) for v in values], dtype='datetime64[us]')
+
+    elif column['kind'] == KIND_INTEGER and all(isinstance(v, int) for v in values):
+        return np.array(values, dtype=np.int64)
+
+    elif column['kind'] in (KIND_INTEGER, KIND_REAL):
+        return np.array([v if isinstance(v, (int, float)) else np.nan for v in values], dtype=np.float64)
+
+    elif column['kind'] in (KIND_SECONDS, KIND_BYTES):
+        parse = _parse_seconds if column['kind'] == KIND_SECONDS else _parse_bytes
+        parsed_values = [None if v is None else parse(v) for v in values]
+        return np.array([np.nan if v is None else v for v in parsed_values], dtype=np.float64)
+
+    elif column['kind'] == KIND_EMPTY:
+        return np.full(len(values), np.nan, dtype=np.float64)
+
+    elif column['kind'] == KIND_TEXT:
+        return np.array(['' if v is None else str(v) for v in values], dtype=str)
+
+    # Categories are shared by every chunk of a table, so codes never change once they are written.
+    category_codes = {category: i for i, category in enumerate(column['categories'])}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        if value is None:
+            codes[i] = -1
+            continue
+
+        value = str(value)
+        if value not in category_codes:
+            category_codes[value] = len(column['categories'])
+            column['categories'].append(value)
+        codes[i] = category_codes[value]
+
+    return codes
+
+
+def _get_observation_runs(results_cur) -> Dict[str, str]:
+    """ :return: A map of measurement time to the start of the observation that took it, for all observers. """
+    parent_tables = [r[0] for r in results_cur.execute("""
+        SELECT name
+        FROM sqlite_master
+        WHERE type = 'table' AND name LIKE '%Parent';
+    """)]
+
+    observation_runs = {}
+    for parent_table in parent_tables:
+        observation_runs.update({str(r[1]): str(r[0]) for r in results_cur.execute(f"""
+            SELECT start_of_observation, measurement_time
+            FROM {parent_table};
+        """)})
+    return observation_runs
+
+
+def _get_row_digest(row: Sequence) -> str:
+    """ :return: A digest of a row (and its rowid), to tell whether the row our watermark points to has changed. """
+    return hashlib.sha1(repr(tuple(row)).encode('utf-8')).hexdigest()
+
+
+def _load_manifest(directory: str) -> Dict:
+    manifest_filename = os.path.join(directory, _MANIFEST_FILENAME)
+    if not os.path.exists(manifest_filename):
+        return {'version': _MANIFEST_VERSION, 'tables': {}}
+
+    with open(manifest_filename, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest['version'] != _MANIFEST_VERSION:
+        raise ValueError(f'Unsupported manifest version {manifest["version"]} in {directory}.')
+    return manifest
+
+
+def export_results(results_file: str, directory: str, chunk_rows: int = 1 << 20, is_compressed: bool = False) -> int:
+    """
+    Only the rows added since our last export are written, so this can be called after every run.
+
+    :param results_file: SQLite results database to export.
+    :param directory: Directory to write our column files and manifest to.
+    :param chunk_rows: Largest number of rows stored in a single chunk.
+    :param is_compressed: If true, each chunk is a single compressed .npz. Otherwise, each column of a chunk is an
+                          uncompressed .npy that can be memory-mapped.
+    :return: The number of rows exported.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = _load_manifest(directory)
+
+    results_conn = get_results_connection(results_file=results_file)
+    results_cur = results_conn.cursor()
+    table_names = [r[0] for r in results_cur.execute("""
+        SELECT name
+        FROM sqlite_master
+        WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+        ORDER BY name;
+    """).fetchall()]
+    observation_runs = None
+
+    exported_rows = 0
+    for table_name in table_names:
+        declared_columns = [(r[1], r[2]) for r in results_cur.execute(f'PRAGMA table_info({table_name});')]
+        column_names = [c[0] for c in declared_columns]
+        table = manifest['tables'].setdefault(table_name, {'last_rowid': 0, 'columns': {}, 'chunks': []})
+
+        # Our rows are never deleted one by one. If the last row we exported is gone (or has been replaced), our table
+        # was cleared (e.g. our results database was recreated), so every row in it is new.
+        if table['last_rowid'] > 0:
+            last_row = results_cur.execute(f"""
+                SELECT rowid, *
+                FROM {table_name}
+                WHERE rowid = ?;
+            """, [table['last_rowid']]).fetchone()
+            if last_row is None or _get_row_digest(last_row) != table.get('last_row_digest', _get_row_digest(last_row)):
+                print(f'[{datetime.datetime.now()}][exporter.py] {table_name} has been cleared since our last export. '
+                      f'Exporting all of its rows.')
+                table['last_rowid'] = 0
+
+        # Grab everything added since our last export.
+        rows = results_cur.execute(f"""
+            SELECT rowid, *
+            FROM {table_name}
+            WHERE rowid > ?
+            ORDER BY rowid;
+        """, [table['last_rowid']]).fetchall()
+        if len(rows) == 0:
+            continue
+
+        # Our chunks never span runs. Observation tables are assigned to runs through their parent table.
+        if 'start_of_run' in column_names:
+            table['run_column'] = 'start_of_run'
+            run_index = column_names.index('start_of_run') + 1
+            runs = [str(r[run_index]) for r in rows]
+        elif 'start_of_observation' in column_names:
+            table['run_column'] = 'start_of_observation'
+            run_index = column_names.index('start_of_observation') + 1
+            runs = [str(r[run_index]) for r in rows]
+        elif 'measurement_time' in column_names:
+            table['run_column'] = 'start_of_observation'
+            observation_runs = _get_observation_runs(results_cur) if observation_runs is None else observation_runs
+            run_index = column_names.index('measurement_time') + 1
+            runs = [observation_runs.get(str(r[run_index])) for r in rows]
+        else:
+            table['run_column'] = None
+            runs = [None for _ in rows]
+
+        # Kinds are widened (never narrowed) when new values do not fit them, so no value is ever dropped.
+        for i, (column_name, declared_type) in enumerate(declared_columns):
+            column_values = [r[i + 1] for r in rows]
+            column = table['columns'].setdefault(column_name, {'kind': KIND_EMPTY})
+            kind = _get_widened_kind(column, _infer_kind(declared_type, column_values), column_values)
+            if kind != column['kind']:
+                _widen_column(directory, table, column_name, kind)
+
+        os.makedirs(os.path.join(directory, table_name), exist_ok=True)
+        chunk_start = 0
+        while chunk_start < len(rows):
+            chunk_end = chunk_start + 1
+            while chunk_end < len(rows) and chunk_end - chunk_start < chunk_rows and \
+                    runs[chunk_end] == runs[chunk_start]:
+                chunk_end += 1
+
+            chunk_path = os.path.join(table_name, f'{len(table["chunks"]):06d}')
+            chunk_columns = {column_name: _to_array(table['columns'][column_name],
+                                                    [r[i + 1] for r in rows[chunk_start:chunk_end]])
+                             for i, column_name in enumerate(column_names)}
+            if is_compressed:
+                np.savez_compressed(os.path.join(directory, chunk_path + '.npz'), **chunk_columns)
+            else:
+                for column_name, column_values in chunk_columns.items():
+                    np.save(os.path.join(directory, f'{chunk_path}.{column_name}.npy'), column_values)
+
+            table['chunks'].append({
+                'path': chunk_path,
+                'is_compressed': is_compressed,
+                'run': runs[chunk_start],
+                'rows': chunk_end - chunk_start
+            })
+            chunk_start = chunk_end
+
+        table['last_rowid'], table['last_row_digest'] = rows[-1][0], _get_row_digest(rows[-1])
+        exported_rows += len(rows)
+
+    # The manifest is replaced last, so an interrupted export never references a partial chunk.
+    results_conn.close()
+    manifest['source'] = results_file
+    with open(os.path.join(directory, _MANIFEST_FILENAME + '.tmp'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(os.path.join(directory, _MANIFEST_FILENAME + '.tmp'), os.path.join(directory, _MANIFEST_FILENAME))
+
+    return exported_rows
+
+
+class ColumnarResults:
+    """ Read-only view of an exported results directory. Uncompressed chunks are memory-mapped, not read. """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.manifest = _load_manifest(directory)
+
+    def get_tables(self) -> List[str]:
+        return sorted(self.manifest['tables'])
+
+    def get_runs(self, table_name: str) -> List[str]:
+        """ :return: Every run held by the given table, in order of export. """
+        runs = []
+        for chunk in self.manifest['tables'][table_name]['chunks']:
+            if chunk['run'] not in runs:
+                runs.append(chunk['run'])
+        return runs
+
+    def get_categories(self, table_name: str, column_name: str) -> List[str]:
+        """ :return: The values of a category column, indexed by their code. """
+        return self.manifest['tables'][table_name]['columns'][column_name]['categories']
+
+    def iterate_chunks(self, table_name: str, run: str = None) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """
+        :param table_name: Table to read.
+        :param run: If specified, only chunks of this run are read.
+        :return: An iterator of (run, {column name: column array}) for each chunk of the table.
+        """
+        table = self.manifest['tables'][table_name]
+        for chunk in table['chunks']:
+            if run is not None and chunk['run'] != run:
+                continue
+
+            chunk_filename = os.path.join(self.directory, chunk['path'])
+            if chunk['is_compressed']:
+                with np.load(chunk_filename + '.npz') as chunk_file:
+                    yield chunk['run'], {column_name: chunk_file[column_name] for column_name in table['columns']}
+            else:
+                yield chunk['run'], {column_name: np.load(f'{chunk_filename}.{column_name}.npy', mmap_mode='r')
+                                     for column_name in table['columns']}
+
+    def load_table(self, table_name: str, run: str = None) -> Dict[str, np.ndarray]:
+        """
+        :param table_name: Table to read.
+        :param run: If specified, only rows of this run are read.
+        :return: A map of column name to column array. Single-chunk tables are returned without copying.
+        """
+        chunks = [c for _, c in self.iterate_chunks(table_name, run)]
+        if len(chunks) == 1:
+            return chunks[0]
+
+        columns = {}
+        for column_name, column in self.manifest['tables'][table_name]['columns'].items():
+            column_arrays = [c[column_name] for c in chunks]
+            if len(column_arrays) == 0:
+                columns[column_name] = np.empty(0)
+            elif column['kind'] == KIND_INTEGER and len({a.dtype for a in column_arrays}) > 1:
+                # Integer chunks with missing values are stored as floats.
+                columns[column_name] = np.concatenate([a.astype(np.float64) for a in column_arrays])
+            else:
+                columns[column_name] = np.concatenate(column_arrays)
+        return columns
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the SQLite results databases as columnar NumPy files.')
+
+    help_strings = {
+        "compress": 'Store each chunk as a compressed .npz instead of memory-mappable .npy files.',
+        "chunk_rows": 'Largest number of rows stored in a single chunk.',
+        "config_path": 'Location of configuration files.'
+    }
+    parser.add_argument('--compress', action='store_true', help=help_strings['compress'])
+    parser.add_argument('--chunk_rows', type=int, default=1 << 20, help=help_strings['chunk_rows'])
+    parser.add_argument('--config_path', type=str, default='config', help=help_strings['config_path'])
+    args = parser.parse_args()
+
+    with open(args.config_path + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+
+    for results_key in ['timing-db', 'observation-db']:
+        if not os.path.exists(general_json[results_key]):
+            continue
+
+        results_directory = os.path.join(general_json.get('columnar-path', 'results/columnar'),
+                                         os.path.splitext(os.path.basename(general_json[results_key]))[0])
+        exported_row_count = export_results(general_json[results_key], results_directory, args.chunk_rows,
+                                            args.compress)
+        print(f'[{datetime.datetime.now()}][exporter.py] Exported {exported_row_count} rows from '
+              f'{general_json[results_key]} to {results_directory}.')
@@ -0,0 +1,103 @@
+""" This file holds the log-bucketed latency histogram used to record transaction times. """
+from typing import Dict, Iterable, List, Tuple
+import math
+
+# Each power of two is split into 2^(_PRECISION_BITS - 1) sub-buckets, giving a relative error of < 1 / 64.
+_PRECISION_BITS = 7
+_SUB_BUCKET_COUNT = 1 << _PRECISION_BITS
+_HALF_SUB_BUCKET_COUNT = _SUB_BUCKET_COUNT >> 1
+
+# Values are recorded in microseconds.
+_UNITS_PER_SECOND = 1000000
+
+# The quantiles we report for every statement class.
+REPORTED_QUANTILES = (('p50', 0.50), ('p90', 0.90), ('p99', 0.99), ('p999', 0.999))
+
+
+def _get_bucket_index(value: int) -> int:
+    if value < _SUB_BUCKET_COUNT:
+        return value
+
+    shift = value.bit_length() - _PRECISION_BITS
+    return _SUB_BUCKET_COUNT + (shift - 1) * _HALF_SUB_BUCKET_COUNT + ((value >> shift) - _HALF_SUB_BUCKET_COUNT)
+
+
+def _get_bucket_bounds(index: int) -> Tuple[int, int]:
+    """ :return: The lowest and highest value (inclusive) that fall into the given bucket. """
+    if index < _SUB_BUCKET_COUNT:
+        return index, index
+
+    shift = (index - _SUB_BUCKET_COUNT) // _HALF_SUB_BUCKET_COUNT + 1
+    top = (index - _SUB_BUCKET_COUNT) % _HALF_SUB_BUCKET_COUNT + _HALF_SUB_BUCKET_COUNT
+    return top << shift, ((top + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """ Not thread-safe by design: each thread records into its own histogram, and these are merged at the end. """
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total_count = 0
+        self.total_sum = 0
+        self.maximum = 0
+
+    def record(self, seconds: float) -> None:
+        value = max(0, int(seconds * _UNITS_PER_SECOND))
+        index = _get_bucket_index(value)
+
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total_count += 1
+        self.total_sum += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += other.total_count
+        self.total_sum += other.total_sum
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    def get_mean(self) -> float:
+        return 0.0 if self.total_count == 0 else self.total_sum / self.total_count / _UNITS_PER_SECOND
+
+    def get_maximum(self) -> float:
+        return self.maximum / _UNITS_PER_SECOND
+
+    def get_quantile(self, quantile: float) -> float:
+        """
+        :param quantile: Quantile to compute, in the range [0, 1].
+        :return: The highest value (in seconds) equivalent to the bucket holding the given quantile.
+        """
+        if self.total_count == 0:
+            return 0.0
+
+        target, running_count = max(1, math.ceil(quantile * self.total_count)), 0
+        for index in sorted(self.counts):
+            running_count += self.counts[index]
+            if running_count >= target:
+                return min(_get_bucket_bounds(index)[1], self.maximum) / _UNITS_PER_SECOND
+
+        return self.get_maximum()
+
+    def get_summary(self) -> Dict[str, float]:
+        summary = {'count': self.total_count, 'mean': self.get_mean()}
+        summary.update({name: self.get_quantile(quantile) for name, quantile in REPORTED_QUANTILES})
+        summary['max'] = self.get_maximum()
+        return summary
+
+    def get_buckets(self) -> List[Tuple[float, float, int]]:
+        """ :return: A list of (lower bound in seconds, upper bound in seconds, count), ordered by bound. """
+        buckets = []
+        for index in sorted(self.counts):
+            lower_bound, upper_bound = _get_bucket_bounds(index)
+            buckets.append((lower_bound / _UNITS_PER_SECOND, upper_bound / _UNITS_PER_SECOND, self.counts[index]))
+        return buckets
+
+    @staticmethod
+    def merge_all(histograms: Iterable['LatencyHistogram']) -> 'LatencyHistogram':
+        merged_histogram = LatencyHistogram()
+        for histogram in histograms:
+            merged_histogram.merge(histogram)
+        return merged_histogram
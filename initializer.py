@@ -1,9 +1,136 @@
 """ This file is for pre-experiment setup and running the DDLs and metadata inserts on both PostgreSQL and MySQL. """
-from connect import get_mysql_new_connection, get_postgres_new_connection
+from connect import get_mysql_new_connection, get_postgres_new_connection, get_results_connection
 
+from typing import Dict, List, Optional
 import argparse
 import json
 import datetime
+import time
+import io
+import re
+
+# Every line of our metadata files is a single-row INSERT of the form 'insert into [table] values (...);'.
+_METADATA_PATTERN = re.compile(r"^\s*insert\s+into\s+(\w+)\s+values\s*\((.*)\)\s*;\s*$", re.IGNORECASE)
+_VALUE_PATTERN = re.compile(r"\s*(?:'((?:[^']|'')*)'|([^,']*?))\s*(?:,|$)")
+
+
+def read_metadata(metadata_file: str) -> Dict[str, List[str]]:
+    """ :return: The rows (as written between the parentheses of each INSERT) per table, in order of appearance. """
+    table_rows = {}
+    with open(metadata_file) as insert_metadata_file:
+        for statement in insert_metadata_file:
+            if statement.isspace():
+                continue
+
+            match = _METADATA_PATTERN.match(statement)
+            if match is None:
+                raise ValueError(f'Could not parse metadata statement for bulk loading: {statement.strip()}')
+            table_rows.setdefault(match.group(1), []).append(match.group(2))
+
+    return table_rows
+
+
+def _parse_row(row: str) -> List[Optional[str]]:
+    """ :return: The values of a row of SQL literals (quoted strings, numbers, or NULL) as text, with NULL as None. """
+    values, position = [], 0
+    while position < len(row):
+        match = _VALUE_PATTERN.match(row, position)
+        if match is None or match.end() == position:
+            raise ValueError(f'Could not parse metadata row for bulk loading: {row}')
+        elif match.group(1) is not None:
+            values.append(match.group(1).replace("''", "'"))
+        else:
+            values.append(None if match.group(2).upper() == 'NULL' else match.group(2))
+        position = match.end()
+
+    return values
+
+
+def _get_copy_line(row: str) -> str:
+    """ :return: The row in the text format of Postgres' COPY (tab-separated, with backslash escapes). """
+    escaped_values = []
+    for value in _parse_row(row):
+        if value is None:
+            escaped_values.append('\\N')
+        else:
+            escaped_values.append(value.replace('\\', '\\\\').replace('\t', '\\t')
+                                  .replace('\n', '\\n').replace('\r', '\\r'))
+
+    return '\t'.join(escaped_values) + '\n'
+
+
+def _bulk_load_postgres(postgres_conn, table_rows: Dict[str, List[str]]) -> Dict[str, float]:
+    """ Load every table with COPY in a single transaction. :return: The load time of each table, in seconds. """
+    load_times = {}
+    postgres_conn.autocommit = False
+    postgres_cur = postgres_conn.cursor()
+
+    # Our foreign keys are not deferrable, so we skip their (trigger-based) checks instead. Superuser is required.
+    postgres_cur.execute('SET LOCAL session_replication_role = replica;')
+    for table_name, rows in table_rows.items():
+        start_of_load = time.perf_counter()
+        postgres_cur.copy_expert(f'COPY {table_name} FROM STDIN;', io.StringIO(''.join(map(_get_copy_line, rows))))
+        load_times[table_name] = time.perf_counter() - start_of_load
+
+    start_of_commit = time.perf_counter()
+    postgres_conn.commit()
+    load_times['COMMIT'] = time.perf_counter() - start_of_commit
+
+    postgres_cur.close()
+    postgres_conn.autocommit = True
+    return load_times
+
+
+def _bulk_load_mysql(mysql_conn, table_rows: Dict[str, List[str]], batch_size: int) -> Dict[str, float]:
+    """ Load every table with multi-row INSERTs in a single transaction. :return: The load time of each table. """
+    load_times = {}
+    mysql_cur = mysql_conn.cursor()
+
+    # Our rows are already ordered by foreign key, so we skip the checks of each row.
+    mysql_cur.execute('SET SESSION foreign_key_checks = 0;')
+    mysql_cur.execute('SET SESSION unique_checks = 0;')
+    mysql_conn.start_transaction()
+    for table_name, rows in table_rows.items():
+        start_of_load = time.perf_counter()
+        for i in range(0, len(rows), batch_size):
+            mysql_cur.execute(f'INSERT INTO {table_name} VALUES (' + '),('.join(rows[i:i + batch_size]) + ');')
+        load_times[table_name] = time.perf_counter() - start_of_load
+
+    start_of_commit = time.perf_counter()
+    mysql_conn.commit()
+    load_times['COMMIT'] = time.perf_counter() - start_of_commit
+
+    mysql_cur.execute('SET SESSION foreign_key_checks = 1;')
+    mysql_cur.execute('SET SESSION unique_checks = 1;')
+    mysql_cur.close()
+    return load_times
+
+
+def _record_load_times(start_of_load: datetime.datetime, database: str, concurrency: str,
+                       table_rows: Dict[str, List[str]], load_times: Dict[str, float], general_json: Dict) -> None:
+    """ Report the time taken to load each table of our metadata, and log this to our timing database. """
+    for table_name, load_time in load_times.items():
+        print(f'[{datetime.datetime.now()}][initializer.py] Loaded {len(table_rows.get(table_name, []))} rows into '
+              f'{table_name} in {load_time} seconds.')
+    print(f'[{datetime.datetime.now()}][initializer.py] Total Metadata Load Time (s): {sum(load_times.values())}.')
+
+    results_conn = get_results_connection(results_file=general_json['timing-db'])
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS MetadataLoadTime (
+            start_of_load DATETIME NOT NULL,
+            database TEXT NOT NULL,
+            concurrency TEXT NOT NULL,
+            table_name TEXT NOT NULL, -- The final commit is logged as its own 'table', COMMIT. --
+            row_count INTEGER NOT NULL,
+            load_time REAL NOT NULL -- Measured in seconds. --
+        );
+    """)
+    results_conn.executemany("""
+        INSERT INTO MetadataLoadTime
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [[start_of_load, database, concurrency, k, len(table_rows.get(k, [])), v] for k, v in load_times.items()])
+    results_conn.commit()
+    results_conn.close()
 
 
 def initialize_postgres(config_directory: str, concurrency: str) -> None:
@@ -42,8 +169,14 @@ def initialize_postgres(config_directory: str, concurrency: str) -> None:
                 if not statement.isspace() and statement != '':
                     postgres_cur_2.execute(statement)
 
-        # Insert the metadata.
-        if concurrency != "none":
+        # Insert the metadata, either in bulk or one statement at a time.
+        if concurrency != "none" and general_json.get('metadata-load', 'bulk') == 'bulk':
+            start_of_load = datetime.datetime.now()
+            table_rows = read_metadata(general_json[f'{concurrency}-concurrency-metadata'])
+            load_times = _bulk_load_postgres(postgres_conn_2, table_rows)
+            _record_load_times(start_of_load, 'postgres', concurrency, table_rows, load_times, general_json)
+
+        elif concurrency != "none":
             with open(general_json[f'{concurrency}-concurrency-metadata']) as insert_metadata_file:
                 statement = insert_metadata_file.readline()
                 while statement:
@@ -89,8 +222,15 @@ def initialize_mysql(config_directory: str, concurrency: str) -> None:
                 if not statement.isspace():
                     mysql_cur_2.execute(statement)
 
-        # Insert the metadata.
-        if concurrency != "none":
+        # Insert the metadata, either in bulk or one statement at a time.
+        if concurrency != "none" and general_json.get('metadata-load', 'bulk') == 'bulk':
+            mysql_conn_2.commit()
+            start_of_load = datetime.datetime.now()
+            table_rows = read_metadata(general_json[f'{concurrency}-concurrency-metadata'])
+            load_times = _bulk_load_mysql(mysql_conn_2, table_rows, general_json.get('metadata-batch-size', 1000))
+            _record_load_times(start_of_load, 'mysql', concurrency, table_rows, load_times, general_json)
+
+        elif concurrency != "none":
             with open(general_json[f'{concurrency}-concurrency-metadata']) as insert_metadata_file:
                 statement = insert_metadata_file.readline()
                 while statement:
@@ -26,7 +26,15 @@ fi
 
 # Start the experiments.
 if [[ $@ == *-x* ]]; then
+    # If the runner hosts its own observer, we only need to wait for the runner.
+    observer_hosting=$(sed -n '/"observer-hosting"/p' config/general.json | cut -d '"' -f 4)
+
     observer() {
+        if [[ ${observer_hosting} == "runner" ]]; then
+            wait $1
+            return
+        fi
+
         runner_spawn_date=$(date +"%Y-%m-%d %T.%N")
         echo "[${runner_spawn_date::-3}][launcher.sh] Runner spawned w/ PID $1."
 
@@ -44,12 +52,17 @@ if [[ $@ == *-x* ]]; then
         wait ${observer_pid}
     }
     runner() {
+        if [[ ${observer_hosting} == "runner" ]]; then
+            python3 runner.py ${database_opt} $1 $2 $3 $4 --observe
+            return
+        fi
+
         sleep 0.5 # Wait for observer to run first...
         python3 runner.py ${database_opt} $1 $2 $3 $4
     }
     restarter() {
-        python3 destructor.py ${database_opt}
-        python3 initializer.py ${database_opt} $1
+        # Rebuilds our database, or restores it from a snapshot (see "reset-mode").
+        python3 resetter.py ${database_opt} $1
     }
 
     # Get our experiment parameters.
@@ -64,6 +77,9 @@ if [[ $@ == *-x* ]]; then
         concurrency=$(echo ${concurrency%\"})
         concurrency=$(echo ${concurrency#\"})
 
+        # Compile our workload once, instead of re-parsing the text file for every run.
+        python3 compiler.py ${database_opt} ${concurrency}
+
         for workload in "${testing_workload[@]}"; do
             workload=$(echo ${workload%\"})
             workload=$(echo ${workload#\"})
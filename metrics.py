@@ -0,0 +1,154 @@
+""" This file holds the live metrics endpoint, which exposes the progress of a running benchmark to Prometheus. """
+from histogram import LatencyHistogram, REPORTED_QUANTILES
+
+from typing import Callable, Dict, Iterable, Optional
+import http.server
+import collections
+import datetime
+import threading
+import time
+
+
+class LiveMetrics:
+    """ Shared by every consumer of a run, so (unlike _ConsumerStatistics) every update is made under a lock. """
+
+    def __init__(self, abort_classes: Iterable[str], window_seconds: float = 10.0, labels: Dict = None,
+                 get_queue_depth: Callable[[], int] = None):
+        """
+        :param abort_classes: Classes of abort to report, even if these have never been seen.
+        :param window_seconds: Length of the trailing window our rates and latency quantiles are computed over.
+        :param labels: Labels (e.g. database, isolation, MPL) describing the run, reported with our run info metric.
+        :param get_queue_depth: Callable returning the current depth of our statement set queue.
+        """
+        self.lock = threading.Lock()
+        self.labels = labels or {}
+        self.get_queue_depth = get_queue_depth
+
+        # Keep track of our totals since the start of the run.
+        self.commits = {'insert': 0, 'select': 0}
+        self.aborts = {abort_class: 0 for abort_class in abort_classes}
+        self.latency_sums = {'insert': 0.0, 'select': 0.0}
+        self.in_flight = 0
+
+        # Our trailing window is split into one-second buckets of [start time, commits, aborts, histograms].
+        self.window_seconds = window_seconds
+        self.windows = collections.deque()
+        self.start_of_metrics = time.monotonic()
+
+    def _get_window(self, now: float) -> list:
+        """ Must be called while holding our lock. Returns the bucket for the current second, evicting old ones. """
+        if len(self.windows) == 0 or now - self.windows[-1][0] >= 1.0:
+            self.windows.append([now, 0, 0, {'insert': LatencyHistogram(), 'select': LatencyHistogram()}])
+        while now - self.windows[0][0] > self.window_seconds:
+            self.windows.popleft()
+        return self.windows[-1]
+
+    def begin_transaction(self) -> None:
+        with self.lock:
+            self.in_flight += 1
+
+    def record_abort(self, abort_class: str) -> None:
+        with self.lock:
+            self.aborts[abort_class] += 1
+            self._get_window(time.monotonic())[2] += 1
+
+    def end_transaction(self, statement_class: str, transaction_time: Optional[float]) -> None:
+        """ :param transaction_time: Time (including retries) of the committed transaction, or None if abandoned. """
+        with self.lock:
+            self.in_flight -= 1
+            if transaction_time is None:
+                return
+
+            self.commits[statement_class] += 1
+            self.latency_sums[statement_class] += transaction_time
+            window = self._get_window(time.monotonic())
+            window[1] += 1
+            window[3][statement_class].record(transaction_time)
+
+    def render(self) -> str:
+        """ :return: Our metrics in the Prometheus text exposition format (version 0.0.4). """
+        with self.lock:
+            now = time.monotonic()
+            self._get_window(now)
+            window_length = max(min(now - self.start_of_metrics, self.window_seconds), 1e-9)
+            window_commits = sum(w[1] for w in self.windows)
+            window_aborts = sum(w[2] for w in self.windows)
+            window_histograms = {statement_class: LatencyHistogram.merge_all(w[3][statement_class]
+                                                                             for w in self.windows)
+                                 for statement_class in self.commits}
+            commits, aborts, latency_sums = dict(self.commits), dict(self.aborts), dict(self.latency_sums)
+            in_flight = self.in_flight
+
+        lines = []
+
+        def add_metric(name: str, metric_type: str, description: str, samples: Iterable) -> None:
+            lines.append(f'# HELP tippers_{name} {description}')
+            lines.append(f'# TYPE tippers_{name} {metric_type}')
+            for suffix, labels, value in samples:
+                label_string = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'tippers_{name}{suffix}' + (f'{{{label_string}}}' if label_string else '') + f' {value}')
+
+        add_metric('run_info', 'gauge', 'Describes the run currently being simulated.', [('', self.labels, 1)])
+        add_metric('commits_total', 'counter', 'Transactions committed since the start of the run.',
+                   [('', {'statement_class': k}, v) for k, v in commits.items()])
+        add_metric('aborts_total', 'counter', 'Transaction attempts aborted since the start of the run.',
+                   [('', {'abort_class': k}, v) for k, v in aborts.items()])
+        add_metric('commits_per_second', 'gauge', f'Commits per second over the last {self.window_seconds} seconds.',
+                   [('', {}, window_commits / window_length)])
+        add_metric('aborts_per_second', 'gauge', f'Aborts per second over the last {self.window_seconds} seconds.',
+                   [('', {}, window_aborts / window_length)])
+        add_metric('in_flight_transactions', 'gauge', 'Transactions dispatched to a consumer but not yet finished.',
+                   [('', {}, in_flight)])
+        if self.get_queue_depth is not None:
+            add_metric('queue_depth', 'gauge', 'Statement sets waiting in our queue for a consumer.',
+                       [('', {}, self.get_queue_depth())])
+
+        # Quantiles are over our trailing window, while the sum and count are over the entire run (as is convention).
+        latency_samples = []
+        for statement_class, histogram in window_histograms.items():
+            labels = {'statement_class': statement_class}
+            latency_samples += [('', {**labels, 'quantile': q}, histogram.get_quantile(q))
+                                for _, q in REPORTED_QUANTILES]
+            latency_samples += [('_sum', labels, latency_sums[statement_class]),
+                                ('_count', labels, commits[statement_class])]
+        add_metric('transaction_latency_seconds', 'summary', 'Transaction times (including retries), with quantiles '
+                   f'over the last {self.window_seconds} seconds.', latency_samples)
+
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+
+        body = self.server.live_metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass  # Scrapes would otherwise drown out the simulator's own output.
+
+
+class MetricsServer:
+    """ Serves our live metrics over HTTP from a background thread. Only bound to localhost by default. """
+
+    def __init__(self, live_metrics: LiveMetrics, port: int, host: str = '127.0.0.1'):
+        self.server = http.server.ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.live_metrics = live_metrics
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True, name='metrics-server')
+
+    def start(self) -> None:
+        self.server_thread.start()
+        host, port = self.server.server_address[:2]
+        print(f'[{datetime.datetime.now()}][metrics.py] Serving live metrics at http://{host}:{port}/metrics.')
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
@@ -0,0 +1,37 @@
+""" This file holds the statement normalizer, which splits a literal SQL statement into a template and parameters. """
+from typing import List, Tuple
+import decimal
+import re
+
+# Typed literals (e.g. interval '1 day') are part of the statement's shape, so these are left in the template.
+_LITERAL_PATTERN = re.compile(r"""
+      (?P<typed>\b(?:interval|date|time|timestamp)\s+'(?:[^']|'')*')
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<identifier>"(?:[^"]|"")*"|`[^`]*`)
+    | (?P<number>(?<![\w.$])\d+(?:\.\d+)?(?![\w.]))
+""", re.VERBOSE | re.IGNORECASE)
+
+# Placeholder styles: MySQL uses '?', Postgres uses '$1', '$2', ...
+PLACEHOLDER_QMARK, PLACEHOLDER_NUMERIC = 'qmark', 'numeric'
+
+
+def normalize_statement(statement: str, placeholder_style: str) -> Tuple[str, List]:
+    """
+    :param statement: Fully literal SQL statement.
+    :param placeholder_style: Either PLACEHOLDER_QMARK or PLACEHOLDER_NUMERIC.
+    :return: The statement with its string and numeric literals replaced by placeholders, and the literal values.
+    """
+    parameters = []
+
+    def _replace_literal(match: re.Match) -> str:
+        if match.lastgroup == 'string':
+            parameters.append(match.group()[1:-1].replace("''", "'"))
+        elif match.lastgroup == 'number':
+            parameters.append(int(match.group()) if '.' not in match.group() else decimal.Decimal(match.group()))
+        else:
+            return match.group()
+
+        return '?' if placeholder_style == PLACEHOLDER_QMARK else f'${len(parameters)}'
+
+    template = _LITERAL_PATTERN.sub(_replace_literal, statement.strip().rstrip(';'))
+    return template, parameters
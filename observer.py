@@ -1,21 +1,124 @@
 """ This file holds the task to observe and monitor MySQL and Postgres performance. """
 from connect import get_mysql_new_connection, get_postgres_new_connection, get_results_connection
 
+from typing import Dict, List, Optional, Sequence
 import argparse
 import abc
 import json
 import datetime
+import collections
 import threading
 import time
-import random
 
 
 class _Observer(abc.ABC):
     starting_timestamp = 0
 
-    @staticmethod
-    def get_timestamp() -> datetime:
-        return datetime.datetime.now()
+    # Cumulative counters from our last sample, used to compute per-interval rates. Keyed by counter group.
+    previous_counters = None
+
+    # Wall time of each query in the current sample, and the total cost (queries + SQLite write) of every sample.
+    observer_name = None
+    query_times = None
+    sample_costs = None
+    sampling_period = None
+
+    # If we share a clock with our runner, this is a (wall time, monotonic time) pair taken at the same instant.
+    clock_origin = None
+    sampling_thread, stop_event = None, None
+
+    def get_timestamp(self) -> datetime.datetime:
+        """ Timestamps on a shared clock are derived from its monotonic time, so these never jump. """
+        if self.clock_origin is None:
+            return datetime.datetime.now()
+
+        return self.clock_origin[0] + datetime.timedelta(seconds=time.monotonic() - self.clock_origin[1])
+
+    def get_rates(self, key, counters: Sequence, sample_time: float) -> Optional[List]:
+        """
+        :param key: Identifies the group of counters (e.g. a relation name), across samples.
+        :param counters: Cumulative counter values of this sample.
+        :param sample_time: Monotonic time of this sample.
+        :return: The length of the interval since our last sample of this group, followed by the per-second rate of
+                 each counter over this interval. None if this is the first sample of this group.
+        """
+        if self.previous_counters is None:
+            self.previous_counters = {}
+
+        previous_sample = self.previous_counters.get(key)
+        self.previous_counters[key] = (sample_time, counters)
+        if previous_sample is None or sample_time <= previous_sample[0]:
+            return None
+
+        interval = sample_time - previous_sample[0]
+        return [interval] + [None if c is None or p is None else (c - p) / interval
+                             for c, p in zip(counters, previous_sample[1])]
+
+    def create_overhead_table(self) -> None:
+        self.results_cur.execute("""
+            CREATE TABLE IF NOT EXISTS ObserverOverhead (
+                measurement_time DATETIME,
+                observer TEXT,
+                operation TEXT, -- Name of a query against the database, or 'sqlite_write' for our own logging. --
+                wall_time REAL, -- Measured in seconds. --
+                sampling_period REAL -- Time between samples when this sample was taken, in seconds. --
+            );
+        """)
+
+    def timed_fetch(self, query_name: str, cursor, query: str, is_single_row: bool = False):
+        """
+        :param query_name: Name to record the wall time of this query under.
+        :param cursor: Cursor to the database under observation.
+        :param query: Query to execute.
+        :param is_single_row: If true, we fetch a single row. Otherwise, we fetch all rows.
+        :return: The results of the query.
+        """
+        if self.query_times is None:
+            self.query_times = []
+
+        start_of_query = time.perf_counter()
+        cursor.execute(query)
+        results = cursor.fetchone() if is_single_row else cursor.fetchall()
+        self.query_times.append((query_name, time.perf_counter() - start_of_query))
+        return results
+
+    def log_overhead(self, sample_timestamp: datetime.datetime, write_time: float) -> None:
+        """
+        :param sample_timestamp: Measurement time of the sample.
+        :param write_time: Wall time spent writing the sample to SQLite.
+        """
+        operation_times = (self.query_times or []) + [('sqlite_write', write_time)]
+        self.query_times = []
+        self.results_cur.executemany("""
+            INSERT INTO ObserverOverhead
+            VALUES (?, ?, ?, ?, ?)
+        """, [[sample_timestamp, self.observer_name, o, t, self.sampling_period] for o, t in operation_times])
+
+        if self.sample_costs is None:
+            self.sample_costs = []
+        self.sample_costs.append(sum(t for _, t in operation_times))
+
+    def print_overhead(self) -> None:
+        if self.sample_costs is not None and len(self.sample_costs) > 0:
+            print(f"[{datetime.datetime.now()}][observer.py] Average sample took "
+                  f"{sum(self.sample_costs) / len(self.sample_costs):.6f}s (max {max(self.sample_costs):.6f}s) "
+                  f"over {len(self.sample_costs)} samples.")
+
+    def get_adapted_period(self, base_period: float, overhead_fraction: float) -> float:
+        """
+        :param base_period: Time between samples that was asked for, in seconds.
+        :param overhead_fraction: Largest fraction of our sampling period that a single sample may cost.
+        :return: The time between samples that keeps the cost of our last sample under the given fraction.
+        """
+        target_period = self.sample_costs[-1] / overhead_fraction
+
+        # We back off immediately (with some headroom), but only return to our base period gradually.
+        if target_period > self.sampling_period:
+            return max(base_period, 1.5 * target_period)
+        elif 2.0 * target_period < self.sampling_period:
+            return max(base_period, 1.5 * target_period, self.sampling_period / 2.0)
+        else:
+            return self.sampling_period
 
     @abc.abstractmethod
     def log_action(self) -> None:
@@ -34,10 +137,39 @@ class _Observer(abc.ABC):
         except:
             pass
 
-    def begin_logging(self, is_oneshot: str, frequency: str) -> None:
+    def sample_periodically(self, period: float, stop_event: threading.Event, overhead_fraction: float = 0.0,
+                            is_sampling_immediately: bool = False) -> None:
+        """
+        :param period: Time between samples, in seconds.
+        :param stop_event: Event that ends our sampling.
+        :param overhead_fraction: If > 0, we lengthen our period whenever a sample costs more than this fraction of it.
+        :param is_sampling_immediately: If true, our first sample is taken now instead of one period from now.
+        """
+        start_of_sampling, tick = time.monotonic(), 0 if is_sampling_immediately else 1
+        self.sampling_period = period
+
+        # Our ticks are fixed to our start time, so a slow sample does not push back every sample after it.
+        while not stop_event.wait(max(0.0, start_of_sampling + tick * self.sampling_period - time.monotonic())):
+            sample_count = len(self.sample_costs or [])
+            self.log_thread_wrapper()
+
+            if overhead_fraction > 0 and len(self.sample_costs or []) > sample_count:
+                adapted_period = self.get_adapted_period(period, overhead_fraction)
+                if adapted_period != self.sampling_period:
+                    print(f"[{datetime.datetime.now()}][observer.py] Sampling period changed from "
+                          f"{self.sampling_period:.3f}s to {adapted_period:.3f}s.")
+                    self.sampling_period = adapted_period
+                    start_of_sampling, tick = time.monotonic(), 1
+                    continue
+
+            # If a sample took longer than our period, we skip the ticks we have missed.
+            tick = max(tick + 1, int((time.monotonic() - start_of_sampling) / self.sampling_period) + 1)
+
+    def begin_logging(self, is_oneshot: str, frequency: str, overhead_fraction: float = 0.0) -> None:
         """
         :param is_oneshot: Flag which determines if we sample once or multiple times.
-        :param frequency: Frequency of sampling, measured in actions / minute.
+        :param frequency: Time between samples, measured in minutes (i.e. 0.05 samples every 3 seconds).
+        :param overhead_fraction: If > 0, the largest fraction of the time between samples that a sample may cost.
         """
         self.starting_timestamp = self.get_timestamp()
 
@@ -46,23 +178,145 @@ class _Observer(abc.ABC):
             print(f"[{datetime.datetime.now()}][observer.py] Logging has been performed.")
 
         else:
-            logging_thread = threading.Timer(int(float(frequency) * 60.0), self.log_thread_wrapper)
-            logging_thread.start()
-            input("[observer.py] Press enter to stop logging: ")
+            self.start_sampling(float(frequency) * 60.0, overhead_fraction)
+            try:
+                input("[observer.py] Press enter to stop logging: ")
+            finally:
+                self.stop_sampling()
             print(f"[{datetime.datetime.now()}][observer.py] Logging has been stopped.")
 
+    def start_sampling(self, period: float, overhead_fraction: float = 0.0, is_sampling_immediately: bool = False):
+        """ Start sampling on a background thread. See sample_periodically. """
+        self.stop_event = threading.Event()
+        self.sampling_thread = threading.Thread(target=self.sample_periodically, daemon=True, args=(
+            period, self.stop_event, overhead_fraction, is_sampling_immediately
+        ))
+        self.sampling_thread.start()
+
+    def stop_sampling(self) -> None:
+        self.stop_event.set()
+        self.sampling_thread.join()
+
+    def log_run(self, run_metadata: Dict, first_dispatch: datetime.datetime, last_commit: datetime.datetime) -> None:
+        """
+        :param run_metadata: Database, workload, concurrency, isolation, and MPL of the run we have observed.
+        :param first_dispatch: Time our runner handed its first statement set to its consumers.
+        :param last_commit: Time of the last commit of our runner.
+        """
+        self.results_cur.execute("""
+            CREATE TABLE IF NOT EXISTS ObservationRun (
+                start_of_observation DATETIME, -- Joins with the start_of_observation of each parent table. --
+                observer TEXT,
+                database TEXT,
+                workload TEXT,
+                concurrency TEXT,
+                isolation TEXT,
+                multiprogramming INTEGER,
+                first_dispatch DATETIME,
+                last_commit DATETIME,
+                run_seconds REAL
+            );
+        """)
+        self.results_cur.execute("""
+            INSERT INTO ObservationRun
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [self.starting_timestamp, self.observer_name, run_metadata['database'], run_metadata['workload'],
+              run_metadata['concurrency'], run_metadata['isolation'], run_metadata['multiprogramming'],
+              first_dispatch, last_commit, (last_commit - first_dispatch).total_seconds()])
+
+
+# noinspection SqlResolve
+class _PostgresLockSampler(_Observer):
+    """ Samples the lock wait graph at a high frequency. What we find is logged by the owning _PostgresObserver. """
+    observer_name = 'postgres-locks'
+
+    def __init__(self, user: str, password: str, host: str, database: str) -> None:
+        """
+        :param user: Username to use for PostgreSQL connection.
+        :param password: Password to use for PostgreSQL connection.
+        :param host: Host URI associated with PostgreSQL connection.
+        :param database: PostgreSQL database to use upon connecting.
+        """
+        # We use our own connection, so our samples are not held up by the samples of our owner.
+        self.postgres_conn = get_postgres_new_connection(user, password, host, database)
+        self.postgres_conn.autocommit = True
+        self.postgres_cur = self.postgres_conn.cursor()
+        self.working_database = database
+
+        # Postgres 14 records when each lock wait began. Before this, we use the start of the waiting query.
+        self.postgres_cur.execute("""
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_name = 'pg_locks' AND column_name = 'waitstart';
+        """)
+        self.wait_start_column = 'COALESCE(LK.waitstart, WA.query_start)' \
+            if self.postgres_cur.fetchone() is not None else 'WA.query_start'
+
+        # Waits are kept open while they persist across samples, and are handed to our owner once they end.
+        self.open_waits = {}
+        self.finished_waits = collections.deque()
+        self.finished_overheads = collections.deque()
+
+    def log_action(self) -> None:
+        # Perform a sample. pg_blocking_pids is only evaluated for backends that are waiting on a lock.
+        on_lock_results = self.timed_fetch('lock_waits', self.postgres_cur, f"""
+            SELECT WA.pid, WA.xact_start, BA.pid, LK.locktype, LK.mode, COALESCE(CL.relname, ''),
+                   {self.wait_start_column}, EXTRACT(EPOCH FROM (clock_timestamp() - {self.wait_start_column})),
+                   WA.query, BA.xact_start, BA.query
+            FROM pg_stat_activity AS WA
+            CROSS JOIN LATERAL UNNEST(pg_blocking_pids(WA.pid)) AS BP(pid)
+            INNER JOIN pg_stat_activity AS BA
+            ON BA.pid = BP.pid
+            INNER JOIN pg_locks AS LK
+            ON LK.pid = WA.pid AND NOT LK.granted
+            LEFT JOIN pg_class AS CL
+            ON CL.oid = LK.relation
+            WHERE WA.datname = '{self.working_database}' AND WA.wait_event_type = 'Lock';
+        """)
+        sample_timestamp = self.get_timestamp()
+
+        # A wait is identified by its waiting transaction, its blocker, and the lock being waited on.
+        seen_waits = set()
+        for r in on_lock_results:
+            wait_key = (r[0], str(r[1]), r[2], r[3], r[4], r[5])
+            seen_waits.add(wait_key)
+            if wait_key in self.open_waits:
+                open_wait = self.open_waits[wait_key]
+                open_wait[3], open_wait[12], open_wait[13] = float(r[7]), sample_timestamp, open_wait[13] + 1
+            else:
+                self.open_waits[wait_key] = [sample_timestamp, r[5], r[6], float(r[7]), r[3], r[4], r[0], r[1], r[8],
+                                             r[2], r[9], r[10], sample_timestamp, 1]
+        for wait_key in [k for k in self.open_waits if k not in seen_waits]:
+            self.finished_waits.append(self.open_waits.pop(wait_key))
+
+        self.finished_overheads.extend([sample_timestamp, self.observer_name, o, t, self.sampling_period]
+                                       for o, t in self.query_times)
+        if self.sample_costs is None:
+            self.sample_costs = []
+        self.sample_costs.append(sum(t for _, t in self.query_times))
+        self.query_times = []
+
+    def end_logging(self) -> None:
+        self.postgres_conn.close()
+        while len(self.open_waits) > 0:
+            self.finished_waits.append(self.open_waits.pop(next(iter(self.open_waits))))
+
 
 # noinspection SqlResolve
 class _PostgresObserver(_Observer):
     """ https://www.datadoghq.com/blog/postgresql-monitoring/ """
+    observer_name = 'postgres'
 
-    def __init__(self, results_file: str, user: str, password: str, host: str, database: str) -> None:
+    def __init__(self, results_file: str, user: str, password: str, host: str, database: str,
+                 is_collecting_statements: bool = False, lock_sample_interval: float = 0.0) -> None:
         """
         :param results_file: File to log result tuples to (SQLite).
         :param user: Username to use for PostgreSQL connection.
         :param password: Password to use for PostgreSQL connection.
         :param host: Host URI associated with PostgreSQL connection.
         :param database: PostgreSQL database to use upon connecting.
+        :param is_collecting_statements: If true, we also log per-statement deltas from pg_stat_statements.
+        :param lock_sample_interval: If > 0, the time (in seconds) between samples of the lock wait graph.
         """
         # Establish our Postgres connection. Pass any errors up to the factory method.
         self.postgres_conn = get_postgres_new_connection(user, password, host, database)
@@ -84,6 +338,7 @@ class _PostgresObserver(_Observer):
                 measurement_time DATETIME PRIMARY KEY
             );
         """)
+        self.create_overhead_table()
         self.results_cur.execute("""
             CREATE TABLE IF NOT EXISTS PostgresStatisticsOnDatabase (
                 measurement_time DATETIME,
@@ -122,10 +377,173 @@ class _PostgresObserver(_Observer):
                 FOREIGN KEY(measurement_time) REFERENCES PostgresResultsParent(measurement_time)
             );
         """)
+        self.results_cur.execute("""
+            CREATE TABLE IF NOT EXISTS PostgresRatesOnDatabase (
+                measurement_time DATETIME,
+                interval_seconds REAL, -- Time since the previous sample. All rates below are per second. --
+                temp_bytes REAL,
+                tup_fetched REAL,
+                tup_returned REAL,
+                transactions_committed REAL,
+                transactions_aborted REAL,
+                deadlocks REAL,
+                checkpoints_requested REAL,
+                checkpoints_scheduled REAL,
+                buffers_written_checkpoint REAL,
+                buffers_written_background REAL,
+                buffers_written_backends REAL,
+                shared_buffer_blocks_hit REAL,
+                shared_buffer_blocks_read REAL,
+                FOREIGN KEY(measurement_time) REFERENCES PostgresResultsParent(measurement_time)
+            );
+        """)
+        self.results_cur.execute("""
+            CREATE TABLE IF NOT EXISTS PostgresRatesOnTable (
+                measurement_time DATETIME,
+                relation_name TEXT,
+                interval_seconds REAL, -- Time since the previous sample. All rates below are per second. --
+                sequential_scans REAL,
+                tuples_fetched_from_seq REAL,
+                index_scans REAL,
+                tuples_fetched_from_idx REAL,
+                tuples_inserted REAL,
+                shared_buffer_blocks_hit REAL,
+                shared_buffer_blocks_read REAL,
+                shared_buffer_idx_blocks_hit REAL,
+                shared_buffer_idx_blocks_read REAL,
+                FOREIGN KEY(measurement_time) REFERENCES PostgresResultsParent(measurement_time)
+            );
+        """)
+
+        # Lock waits are sampled separately, as these need a much higher frequency than our other statistics.
+        self.lock_sampler, self.lock_sample_interval = None, lock_sample_interval
+        if lock_sample_interval > 0:
+            self.lock_sampler = _PostgresLockSampler(user, password, host, database)
+            self.results_cur.execute("""
+                CREATE TABLE IF NOT EXISTS PostgresStatisticsOnLock (
+                    measurement_time DATETIME, -- The first sample this wait was seen in. --
+                    relation_name TEXT,
+                    wait_start DATETIME,
+                    wait_age REAL, -- Measured in seconds, as of the last sample this wait was seen in. --
+                    lock_type TEXT,
+                    lock_mode TEXT,
+                    waiting_pid INTEGER,
+                    waiting_transaction_start DATETIME,
+                    waiting_query TEXT,
+                    blocking_pid INTEGER,
+                    blocking_transaction_start DATETIME,
+                    blocking_query TEXT,
+                    last_seen DATETIME,
+                    samples_seen INTEGER
+                );
+            """)
+
+        # Per-statement collection is optional, as pg_stat_statements must be preloaded by the server.
+        self.statement_time_column = None
+        self.previous_statements, self.logged_statement_texts = None, set()
+        if is_collecting_statements:
+            self.statement_time_column = self._get_statement_time_column()
+        if self.statement_time_column is not None:
+            self.results_cur.execute("""
+                CREATE TABLE IF NOT EXISTS PostgresStatementText (
+                    query_id INTEGER PRIMARY KEY,
+                    query_text TEXT -- Normalized by Postgres, i.e. constants are replaced with $1, $2, ... --
+                );
+            """)
+            self.results_cur.execute("""
+                CREATE TABLE IF NOT EXISTS PostgresStatementDeltas (
+                    measurement_time DATETIME,
+                    query_id INTEGER, -- All columns below are changes since our previous sample. --
+                    calls INTEGER,
+                    total_exec_time REAL, -- Measured in milliseconds. --
+                    mean_exec_time REAL, -- Measured in milliseconds, over the calls of this interval only. --
+                    shared_buffer_blocks_hit INTEGER,
+                    shared_buffer_blocks_read INTEGER,
+                    rows INTEGER,
+                    FOREIGN KEY(measurement_time) REFERENCES PostgresStatisticsParent(measurement_time),
+                    FOREIGN KEY(query_id) REFERENCES PostgresStatementText(query_id)
+                );
+            """)
+            self.logged_statement_texts = {r[0] for r in self.results_cur.execute("""
+                SELECT query_id
+                FROM PostgresStatementText;
+            """)}
+
+    def _get_statement_time_column(self) -> Optional[str]:
+        """ :return: The name of the total execution time column of pg_stat_statements, or None if unavailable. """
+        try:
+            self.postgres_cur.execute("CREATE EXTENSION IF NOT EXISTS pg_stat_statements;")
+            self.postgres_cur.execute("SELECT 1 FROM pg_stat_statements(false) LIMIT 1;")
+            self.postgres_cur.fetchall()
+        except Exception as e:
+            print(f'[{datetime.datetime.now()}][observer.py] pg_stat_statements is not available: ' + str(e))
+            return None
+
+        # Postgres 13 split total_time into planning and execution time.
+        self.postgres_cur.execute("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'pg_stat_statements' AND column_name IN ('total_exec_time', 'total_time');
+        """)
+        time_columns = [r[0] for r in self.postgres_cur.fetchall()]
+        return 'total_exec_time' if 'total_exec_time' in time_columns else 'total_time'
+
+    def _get_statement_deltas(self, on_statement_results: Sequence[Sequence]) -> List[List]:
+        """
+        :param on_statement_results: Cumulative (query id, calls, total time, blocks hit, blocks read, rows) rows.
+        :return: The (query id, calls, total time, mean time, blocks hit, blocks read, rows) changes of every
+                 statement that has been called since our last sample.
+        """
+        current_statements = {r[0]: r[1:] for r in on_statement_results}
+        previous_statements, self.previous_statements = self.previous_statements, current_statements
+        if previous_statements is None:
+            return []  # Our first sample is only a baseline.
+
+        statement_deltas = []
+        for query_id, counters in current_statements.items():
+            previous_counters = previous_statements.get(query_id, (0, 0.0, 0, 0, 0))
+            if counters[0] < previous_counters[0]:  # This entry was evicted or reset since our last sample.
+                previous_counters = (0, 0.0, 0, 0, 0)
+            if counters[0] == previous_counters[0]:
+                continue
+
+            calls, total_time = counters[0] - previous_counters[0], float(counters[1] - previous_counters[1])
+            statement_deltas.append([query_id, calls, total_time, total_time / calls] +
+                                    [c - p for c, p in zip(counters[2:], previous_counters[2:])])
+        return statement_deltas
+
+    def _log_lock_waits(self) -> None:
+        """ Log every lock wait that has ended (and the cost of sampling these) since our last call. """
+        finished_waits = [self.lock_sampler.finished_waits.popleft() for _ in
+                          range(len(self.lock_sampler.finished_waits))]
+        if len(finished_waits) > 0:
+            self.results_cur.executemany("""
+                INSERT INTO PostgresStatisticsOnLock
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, finished_waits)
+
+        finished_overheads = [self.lock_sampler.finished_overheads.popleft() for _ in
+                              range(len(self.lock_sampler.finished_overheads))]
+        if len(finished_overheads) > 0:
+            self.results_cur.executemany("""
+                INSERT INTO ObserverOverhead
+                VALUES (?, ?, ?, ?, ?)
+            """, finished_overheads)
+
+    def start_sampling(self, period: float, overhead_fraction: float = 0.0, is_sampling_immediately: bool = False):
+        if self.lock_sampler is not None:
+            self.lock_sampler.clock_origin = self.clock_origin
+            self.lock_sampler.start_sampling(self.lock_sample_interval, 0.0, is_sampling_immediately)
+        super().start_sampling(period, overhead_fraction, is_sampling_immediately)
+
+    def stop_sampling(self) -> None:
+        super().stop_sampling()
+        if self.lock_sampler is not None:
+            self.lock_sampler.stop_sampling()
 
     def log_action(self) -> None:
         # Perform a sample.
-        self.postgres_cur.execute(f"""
+        on_database_results = self.timed_fetch('database', self.postgres_cur, f"""
             SELECT ST.temp_bytes, ST.tup_fetched, ST.tup_returned, ST.xact_commit, ST. xact_rollback, ST.deadlocks,
                    LK.lock_count, BW.checkpoints_req, BW.checkpoints_timed, BW.buffers_checkpoint, BW.buffers_clean,
                    BW.buffers_backend, ST.blks_hit, ST.blks_read
@@ -140,9 +558,8 @@ class _PostgresObserver(_Observer):
             WHERE ST.datname = '{self.working_database}'
             ORDER BY ST.stats_reset DESC,
                      BW.stats_reset;
-        """)
-        on_database_results = self.postgres_cur.fetchone()
-        self.postgres_cur.execute(f"""
+        """, is_single_row=True)
+        on_tables_results = self.timed_fetch('tables', self.postgres_cur, f"""
             SELECT ST.relname, ST.seq_scan, ST.seq_tup_read, COALESCE(ST.idx_scan, 0), COALESCE(ST.idx_tup_fetch, 0), 
                    ST.n_tup_ins, ST.n_live_tup, ST.n_dead_tup, IO.heap_blks_hit, IO.heap_blks_read,
                    COALESCE(IO.idx_blks_hit, 0), COALESCE(IO.idx_blks_read, 0)
@@ -150,10 +567,30 @@ class _PostgresObserver(_Observer):
             INNER JOIN pg_statio_user_tables AS IO
             ON ST.relid = IO.relid;
         """)
-        on_tables_results = self.postgres_cur.fetchall()
+        on_statement_results, on_statement_texts = [], []
+        if self.statement_time_column is not None:
+            on_statement_results = self.timed_fetch('statements', self.postgres_cur, f"""
+                SELECT SS.queryid, SUM(SS.calls)::BIGINT, SUM(SS.{self.statement_time_column})::FLOAT8,
+                       SUM(SS.shared_blks_hit)::BIGINT, SUM(SS.shared_blks_read)::BIGINT, SUM(SS.rows)::BIGINT
+                FROM pg_stat_statements(false) AS SS
+                INNER JOIN pg_database AS DB
+                ON SS.dbid = DB.oid
+                WHERE DB.datname = '{self.working_database}' AND SS.queryid IS NOT NULL
+                GROUP BY SS.queryid;
+            """)
+
+            # Query texts are only fetched (and stored) for statements we have not seen before.
+            new_query_ids = [r[0] for r in on_statement_results if r[0] not in self.logged_statement_texts]
+            if len(new_query_ids) > 0:
+                on_statement_texts = self.timed_fetch('statement_texts', self.postgres_cur, f"""
+                    SELECT DISTINCT ON (SS.queryid) SS.queryid, SS.query
+                    FROM pg_stat_statements AS SS
+                    WHERE SS.queryid IN ({','.join(str(q) for q in new_query_ids)});
+                """)
 
         # ... and log the sample.
-        sample_timestamp = self.get_timestamp()
+        sample_timestamp, sample_time = self.get_timestamp(), time.monotonic()
+        start_of_write = time.perf_counter()
         self.results_cur.execute("""
             INSERT INTO PostgresStatisticsParent
             VALUES (?, ?)
@@ -167,8 +604,49 @@ class _PostgresObserver(_Observer):
             VALUES ({','.join('?' for _ in range(len(on_tables_results[0]) + 1))})
         """, list(map(lambda a: [sample_timestamp] + list(a), on_tables_results)))
 
+        # Log the rate of each cumulative counter since our last sample (lock, live, and dead counts are not).
+        on_database_rates = self.get_rates('database', [on_database_results[i] for i in
+                                                        [0, 1, 2, 3, 4, 5, 7, 8, 9, 10, 11, 12, 13]], sample_time)
+        if on_database_rates is not None:
+            self.results_cur.execute(f"""
+                INSERT INTO PostgresRatesOnDatabase
+                VALUES ({','.join('?' for _ in range(len(on_database_rates) + 1))})
+            """, [sample_timestamp] + on_database_rates)
+        on_tables_rates = []
+        for on_table_result in on_tables_results:
+            on_table_rates = self.get_rates(on_table_result[0], [on_table_result[i] for i in
+                                                                 [1, 2, 3, 4, 5, 8, 9, 10, 11]], sample_time)
+            if on_table_rates is not None:
+                on_tables_rates.append([sample_timestamp, on_table_result[0]] + on_table_rates)
+        if len(on_tables_rates) > 0:
+            self.results_cur.executemany(f"""
+                INSERT INTO PostgresRatesOnTable
+                VALUES ({','.join('?' for _ in range(len(on_tables_rates[0])))})
+            """, on_tables_rates)
+
+        # Log the per-statement changes since our last sample, for only the statements that have been called.
+        if len(on_statement_texts) > 0:
+            self.results_cur.executemany("""
+                INSERT OR IGNORE INTO PostgresStatementText
+                VALUES (?, ?)
+            """, on_statement_texts)
+            self.logged_statement_texts.update(r[0] for r in on_statement_texts)
+        statement_deltas = self._get_statement_deltas(on_statement_results)
+        if len(statement_deltas) > 0:
+            self.results_cur.executemany("""
+                INSERT INTO PostgresStatementDeltas
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [[sample_timestamp] + d for d in statement_deltas])
+        if self.lock_sampler is not None:
+            self._log_lock_waits()
+        self.log_overhead(sample_timestamp, time.perf_counter() - start_of_write)
+
     def end_logging(self) -> None:
         self.postgres_conn.close()
+        self.print_overhead()
+        if self.lock_sampler is not None:
+            self.lock_sampler.end_logging()
+            self._log_lock_waits()
 
         self.results_cur.execute('commit')
         self.results_conn.commit()
@@ -178,6 +656,8 @@ class _PostgresObserver(_Observer):
 # noinspection SqlResolve
 class _MySQLObserver(_Observer):
     """ https://www.datadoghq.com/blog/collecting-mysql-statistics-and-metrics/ """
+    observer_name = 'mysql-sys'
+    source_schema = 'sys'  # Schema our MySQL connection uses, which holds the views (or tables) we sample.
 
     def __init__(self, results_file: str, user: str, password: str, host: str, schema: str) -> None:
         """
@@ -187,7 +667,7 @@ class _MySQLObserver(_Observer):
         :param host: Host URI associated with connection.
         """
         # Establish our MySQL connection. Pass any errors up to the factory method.
-        self.mysql_conn = get_mysql_new_connection(user, password, host, 'sys')
+        self.mysql_conn = get_mysql_new_connection(user, password, host, self.source_schema)
         self.mysql_cur = self.mysql_conn.cursor()
         self.working_host = host
         self.working_schema = schema
@@ -205,6 +685,39 @@ class _MySQLObserver(_Observer):
                 measurement_time DATETIME PRIMARY KEY
             );
         """)
+        self.create_overhead_table()
+        self._create_sample_tables()
+        self.results_cur.execute("""
+            CREATE TABLE IF NOT EXISTS MySQLRatesOnHost (
+                measurement_time DATETIME,
+                interval_seconds REAL, -- Time since the previous sample. All rates below are per second. --
+                statements REAL,
+                statement_rows_sent REAL,
+                statement_rows_examined REAL,
+                statement_rows_affected REAL,
+                table_scans REAL,
+                file_ios REAL,
+                FOREIGN KEY(measurement_time) REFERENCES MySQLStatisticsParent(measurement_time)
+            );
+        """)
+        self.results_cur.execute("""
+            CREATE TABLE IF NOT EXISTS MySQLRatesOnTable (
+                measurement_time DATETIME,
+                relation_name TEXT,
+                interval_seconds REAL, -- Time since the previous sample. All rates below are per second. --
+                rows_fetched REAL,
+                rows_inserted REAL,
+                rows_updated REAL,
+                rows_deleted REAL,
+                io_read_requests REAL,
+                io_write_requests REAL,
+                io_misc_requests REAL,
+                FOREIGN KEY(measurement_time) REFERENCES MySQLStatisticsParent(measurement_time)
+            );
+        """)
+
+    def _create_sample_tables(self) -> None:
+        """ Create the tables our samples are logged to. Our parent, overhead, and rate tables are shared. """
         self.results_cur.execute("""
             CREATE TABLE IF NOT EXISTS MySQLStatisticsOnHost (
                 measurement_time DATETIME,
@@ -279,9 +792,33 @@ class _MySQLObserver(_Observer):
             );
         """)
 
+    def _log_rates(self, sample_timestamp: datetime.datetime, sample_time: float, on_host_counters: Sequence,
+                   on_table_counters: Sequence[Sequence]) -> None:
+        """
+        :param on_host_counters: Statements, rows sent, rows examined, rows affected, table scans, and file IOs.
+        :param on_table_counters: Per table: name, rows fetched, inserted, updated, deleted, and IO read, write, and
+                                  misc requests.
+        """
+        on_host_rates = self.get_rates('host', on_host_counters, sample_time)
+        if on_host_rates is not None:
+            self.results_cur.execute(f"""
+                INSERT INTO MySQLRatesOnHost
+                VALUES ({','.join('?' for _ in range(len(on_host_rates) + 1))})
+            """, [sample_timestamp] + on_host_rates)
+        on_table_rates = []
+        for table_counters in on_table_counters:
+            table_rates = self.get_rates(table_counters[0], table_counters[1:], sample_time)
+            if table_rates is not None:
+                on_table_rates.append([sample_timestamp, table_counters[0]] + table_rates)
+        if len(on_table_rates) > 0:
+            self.results_cur.executemany(f"""
+                INSERT INTO MySQLRatesOnTable
+                VALUES ({','.join('?' for _ in range(len(on_table_rates[0])))})
+            """, on_table_rates)
+
     def log_action(self) -> None:
         # Perform a sample.
-        self.mysql_cur.execute(f"""
+        on_host_results = self.timed_fetch('host', self.mysql_cur, f"""
             SELECT CAST(HS.statements AS SIGNED), HS.statement_latency, HS.statement_avg_latency, SL.lock_latency, 
                    CAST(SL.rows_sent AS SIGNED), CAST(SL.rows_examined AS SIGNED), CAST(SL.rows_affected AS SIGNED), 
                    CAST(HS.table_scans AS SIGNED), CAST(HS.file_ios AS SIGNED), HS.file_io_latency, HS.current_memory,
@@ -290,9 +827,8 @@ class _MySQLObserver(_Observer):
             INNER JOIN host_summary_by_statement_latency AS SL
             ON HS.host = SL.host
             WHERE HS.host = '{self.working_host}';
-        """)
-        on_host_results = self.mysql_cur.fetchone()
-        self.mysql_cur.execute(f"""
+        """, is_single_row=True)
+        on_table_results = self.timed_fetch('table', self.mysql_cur, f"""
             SELECT TS.table_name, TS.total_latency, TS.rows_fetched, TS.fetch_latency, TS.rows_inserted, 
                    TS.rows_updated, TS.rows_deleted, CAST(TS.io_read_requests AS SIGNED), TS.io_read, 
                    TS.io_read_latency, CAST(TS.io_write_requests AS SIGNED), TS.io_write, TS.io_write_latency, 
@@ -300,24 +836,22 @@ class _MySQLObserver(_Observer):
             FROM schema_table_statistics AS TS
             WHERE TS.table_schema = '{self.working_schema}';
         """)
-        on_table_results = self.mysql_cur.fetchall()
-        self.mysql_cur.execute(f"""
+        on_index_results = self.timed_fetch('index', self.mysql_cur, f"""
             SELECT XS.table_name, XS.index_name, XS.rows_selected, XS.select_latency, XS.rows_inserted,
                    XS.insert_latency, XS.rows_updated, XS.update_latency, XS.rows_deleted, XS.delete_latency
             FROM schema_index_statistics AS XS
             WHERE XS.table_schema = '{self.working_schema}';
         """)
-        on_index_results = self.mysql_cur.fetchall()
-        self.mysql_cur.execute("""
+        on_lock_results = self.timed_fetch('lock', self.mysql_cur, """
             SELECT LW.wait_started, LW.wait_age, LW.locked_type, LW.waiting_trx_started, LW.waiting_trx_age,
                    LW.waiting_trx_rows_locked, LW.waiting_trx_rows_modified, LW.blocking_trx_started,
                    LW.blocking_trx_age, LW.waiting_query, LW.blocking_query
             FROM innodb_lock_waits AS LW;
         """)
-        on_lock_results = self.mysql_cur.fetchall()
 
         # ... and log the sample.
-        sample_timestamp = self.get_timestamp()
+        sample_timestamp, sample_time = self.get_timestamp(), time.monotonic()
+        start_of_write = time.perf_counter()
         self.results_cur.execute("""
             INSERT INTO MySQLStatisticsParent
             VALUES (?, ?)
@@ -341,58 +875,229 @@ class _MySQLObserver(_Observer):
              VALUES ({','.join('?' for _ in range(len(on_lock_results[0]) + 1))})
          """, list(map(lambda a: [sample_timestamp] + list(a), on_lock_results)))
 
+        # Log the rate of each cumulative counter since our last sample (latencies are formatted, so these are not).
+        self._log_rates(sample_timestamp, sample_time, [on_host_results[i] for i in [0, 4, 5, 6, 7, 8]],
+                        [[r[i] for i in [0, 2, 4, 5, 6, 7, 10, 13]] for r in on_table_results])
+        self.log_overhead(sample_timestamp, time.perf_counter() - start_of_write)
+
     def end_logging(self) -> None:
         self.mysql_conn.close()
+        self.print_overhead()
 
         self.results_cur.execute('commit')
         self.results_conn.commit()
         self.results_conn.close()
 
 
-class _TimingObserver(_Observer):
-    def __init__(self, results_file: str) -> None:
-        # Establish our results file connection.
-        self.results_conn = get_results_connection(results_file=results_file)
-        self.results_conn.isolation_level = None
-        self.results_cur = self.results_conn.cursor()
-        self.results_cur.execute("begin")
+# noinspection SqlResolve
+class _MySQLPerformanceSchemaObserver(_MySQLObserver):
+    """ Reads the performance_schema summary tables behind the sys views, and keeps their raw picosecond timers. """
+    observer_name = 'mysql-performance_schema'
 
-        # Create our table.
+    source_schema = 'performance_schema'
+
+    def _create_sample_tables(self) -> None:
+        """ Our sys-view tables are never used here. All latencies are in picoseconds, and all sizes are in bytes. """
+        self.results_cur.execute("""
+            CREATE TABLE IF NOT EXISTS MySQLPerformanceOnHost (
+                measurement_time DATETIME,
+                statements INTEGER,
+                statement_latency INTEGER,
+                statement_lock_latency INTEGER,
+                statement_rows_sent INTEGER,
+                statement_rows_examined INTEGER,
+                statement_rows_affected INTEGER,
+                table_scans INTEGER, -- SELECTs that performed a full scan of their first table. --
+                file_ios INTEGER,
+                file_io_latency INTEGER,
+                current_memory INTEGER,
+                total_memory_allocated INTEGER,
+                FOREIGN KEY(measurement_time) REFERENCES MySQLStatisticsParent(measurement_time)
+            );
+        """)
+        self.results_cur.execute("""
+            CREATE TABLE IF NOT EXISTS MySQLPerformanceOnTable (
+                measurement_time DATETIME,
+                relation_name TEXT,
+                total_latency INTEGER,
+                rows_fetched INTEGER,
+                fetch_latency INTEGER,
+                rows_inserted INTEGER,
+                insert_latency INTEGER,
+                rows_updated INTEGER,
+                update_latency INTEGER,
+                rows_deleted INTEGER,
+                delete_latency INTEGER,
+                io_read_requests INTEGER,
+                io_read INTEGER,
+                io_read_latency INTEGER,
+                io_write_requests INTEGER,
+                io_write INTEGER,
+                io_write_latency INTEGER,
+                io_misc_requests INTEGER,
+                io_misc_latency INTEGER,
+                FOREIGN KEY(measurement_time) REFERENCES MySQLStatisticsParent(measurement_time)
+            );
+        """)
         self.results_cur.execute("""
-            CREATE TABLE IF NOT EXISTS TimingStatistics (
-                start_of_transaction DATETIME NOT NULL,
-                end_of_transaction DATETIME NOT NULL
+            CREATE TABLE IF NOT EXISTS MySQLPerformanceOnIndex (
+                measurement_time DATETIME,
+                relation_name TEXT,
+                index_name TEXT,
+                rows_selected INTEGER,
+                select_latency INTEGER,
+                rows_inserted INTEGER,
+                insert_latency INTEGER,
+                rows_updated INTEGER,
+                update_latency INTEGER,
+                rows_deleted INTEGER,
+                delete_latency INTEGER,
+                FOREIGN KEY(measurement_time) REFERENCES MySQLStatisticsParent(measurement_time)
+            );
+        """)
+        self.results_cur.execute("""
+            CREATE TABLE IF NOT EXISTS MySQLPerformanceOnLock (
+                measurement_time DATETIME,
+                relation_name TEXT,
+                lock_type TEXT,
+                lock_mode TEXT,
+                waiting_transaction_id INTEGER,
+                waiting_thread_id INTEGER,
+                blocking_transaction_id INTEGER,
+                blocking_thread_id INTEGER,
+                FOREIGN KEY(measurement_time) REFERENCES MySQLStatisticsParent(measurement_time)
             );
         """)
 
-        # Create a lock for logging (ugh).
-        self.log_lock = threading.Lock()
-        self.is_alive = True
+    def log_action(self) -> None:
+        # Perform a sample. Each query reads a single summary table, without the formatting of the sys views.
+        on_host_results = self.timed_fetch('host', self.mysql_cur, f"""
+            SELECT CAST(SUM(ST.COUNT_STAR) AS SIGNED), CAST(SUM(ST.SUM_TIMER_WAIT) AS SIGNED),
+                   CAST(SUM(ST.SUM_LOCK_TIME) AS SIGNED), CAST(SUM(ST.SUM_ROWS_SENT) AS SIGNED),
+                   CAST(SUM(ST.SUM_ROWS_EXAMINED) AS SIGNED), CAST(SUM(ST.SUM_ROWS_AFFECTED) AS SIGNED),
+                   CAST(SUM(ST.SUM_SELECT_SCAN) AS SIGNED), (
+                       SELECT CAST(SUM(FW.COUNT_STAR) AS SIGNED)
+                       FROM performance_schema.events_waits_summary_by_host_by_event_name AS FW
+                       WHERE FW.HOST = '{self.working_host}' AND FW.EVENT_NAME LIKE 'wait/io/file/%'
+                   ), (
+                       SELECT CAST(SUM(FW.SUM_TIMER_WAIT) AS SIGNED)
+                       FROM performance_schema.events_waits_summary_by_host_by_event_name AS FW
+                       WHERE FW.HOST = '{self.working_host}' AND FW.EVENT_NAME LIKE 'wait/io/file/%'
+                   ), (
+                       SELECT CAST(SUM(MM.CURRENT_NUMBER_OF_BYTES_USED) AS SIGNED)
+                       FROM performance_schema.memory_summary_by_host_by_event_name AS MM
+                       WHERE MM.HOST = '{self.working_host}'
+                   ), (
+                       SELECT CAST(SUM(MM.SUM_NUMBER_OF_BYTES_ALLOC) AS SIGNED)
+                       FROM performance_schema.memory_summary_by_host_by_event_name AS MM
+                       WHERE MM.HOST = '{self.working_host}'
+                   )
+            FROM performance_schema.events_statements_summary_by_host_by_event_name AS ST
+            WHERE ST.HOST = '{self.working_host}';
+        """, is_single_row=True)
+        on_table_results = self.timed_fetch('table', self.mysql_cur, f"""
+            SELECT TW.OBJECT_NAME, TW.SUM_TIMER_WAIT, TW.COUNT_FETCH, TW.SUM_TIMER_FETCH, TW.COUNT_INSERT,
+                   TW.SUM_TIMER_INSERT, TW.COUNT_UPDATE, TW.SUM_TIMER_UPDATE, TW.COUNT_DELETE, TW.SUM_TIMER_DELETE
+            FROM performance_schema.table_io_waits_summary_by_table AS TW
+            WHERE TW.OBJECT_SCHEMA = '{self.working_schema}';
+        """)
+        on_file_results = self.timed_fetch('file', self.mysql_cur, f"""
+            SELECT FS.FILE_NAME, FS.COUNT_READ, FS.SUM_NUMBER_OF_BYTES_READ, FS.SUM_TIMER_READ, FS.COUNT_WRITE,
+                   FS.SUM_NUMBER_OF_BYTES_WRITE, FS.SUM_TIMER_WRITE, FS.COUNT_MISC, FS.SUM_TIMER_MISC
+            FROM performance_schema.file_summary_by_instance AS FS
+            WHERE FS.FILE_NAME LIKE '%/{self.working_schema}/%';
+        """)
+        on_index_results = self.timed_fetch('index', self.mysql_cur, f"""
+            SELECT XW.OBJECT_NAME, XW.INDEX_NAME, XW.COUNT_FETCH, XW.SUM_TIMER_FETCH, XW.COUNT_INSERT,
+                   XW.SUM_TIMER_INSERT, XW.COUNT_UPDATE, XW.SUM_TIMER_UPDATE, XW.COUNT_DELETE, XW.SUM_TIMER_DELETE
+            FROM performance_schema.table_io_waits_summary_by_index_usage AS XW
+            WHERE XW.OBJECT_SCHEMA = '{self.working_schema}' AND XW.INDEX_NAME IS NOT NULL;
+        """)
+        on_lock_results = self.timed_fetch('lock', self.mysql_cur, """
+            SELECT DL.OBJECT_NAME, DL.LOCK_TYPE, DL.LOCK_MODE, LW.REQUESTING_ENGINE_TRANSACTION_ID,
+                   LW.REQUESTING_THREAD_ID, LW.BLOCKING_ENGINE_TRANSACTION_ID, LW.BLOCKING_THREAD_ID
+            FROM performance_schema.data_lock_waits AS LW
+            INNER JOIN performance_schema.data_locks AS DL
+            ON LW.REQUESTING_ENGINE_LOCK_ID = DL.ENGINE_LOCK_ID;
+        """)
 
-    def log_action(self) -> None:  # Ignoring...
-        pass
+        # Attach the file IO of each table (i.e. [schema]/[table].ibd) to our table rows, in Python instead of MySQL.
+        on_file_by_table = {}
+        for on_file_result in on_file_results:
+            table_name = on_file_result[0].replace('\\', '/').split('/')[-1].split('.')[0]
+            on_file_by_table[table_name] = [a + b for a, b in zip(on_file_by_table.get(table_name, [0] * 8),
+                                                                  on_file_result[1:])]
+        on_table_results = [list(r) + on_file_by_table.get(r[0], [0] * 8) for r in on_table_results]
 
-    def record_observation(self, start_of_transaction: str, end_of_transaction: str) -> None:
-        if self.is_alive:
-            self.log_lock.acquire()
-            self.results_cur.execute(f"""
-                INSERT INTO TimingStatistics
-                VALUES ("{start_of_transaction}", "{end_of_transaction}");
-            """)
-            self.log_lock.release()
+        # ... and log the sample.
+        sample_timestamp, sample_time = self.get_timestamp(), time.monotonic()
+        start_of_write = time.perf_counter()
+        self.results_cur.execute("""
+            INSERT INTO MySQLStatisticsParent
+            VALUES (?, ?)
+        """, [self.starting_timestamp, sample_timestamp])
+        self.results_cur.execute(f"""
+            INSERT INTO MySQLPerformanceOnHost
+            VALUES ({','.join('?' for _ in range(len(on_host_results) + 1))})
+        """, [sample_timestamp] + list(on_host_results))
+        if len(on_table_results) > 0:
+            self.results_cur.executemany(f"""
+                INSERT INTO MySQLPerformanceOnTable
+                VALUES ({','.join('?' for _ in range(len(on_table_results[0]) + 1))})
+            """, list(map(lambda a: [sample_timestamp] + a, on_table_results)))
+        if len(on_index_results) > 0:
+            self.results_cur.executemany(f"""
+                INSERT INTO MySQLPerformanceOnIndex
+                VALUES ({','.join('?' for _ in range(len(on_index_results[0]) + 1))})
+            """, list(map(lambda a: [sample_timestamp] + list(a), on_index_results)))
+        if len(on_lock_results) > 0:
+            self.results_cur.executemany(f"""
+                INSERT INTO MySQLPerformanceOnLock
+                VALUES ({','.join('?' for _ in range(len(on_lock_results[0]) + 1))})
+            """, list(map(lambda a: [sample_timestamp] + list(a), on_lock_results)))
 
-    def end_logging(self) -> None:
-        self.log_lock.acquire()
-        try:  # This operation MUST succeed.
-            self.results_cur.execute('commit')
-            self.results_conn.commit()
-        except Exception:
-            time.sleep(random.random())
-            self.results_cur.execute('commit')
-            self.results_conn.commit()
-        self.results_conn.close()
-        self.is_alive = False
-        self.log_lock.release()
+        # Log the rate of each cumulative counter since our last sample.
+        self._log_rates(sample_timestamp, sample_time, [on_host_results[i] for i in [0, 3, 4, 5, 6, 7]],
+                        [[r[i] for i in [0, 2, 4, 6, 8, 10, 13, 16]] for r in on_table_results])
+        self.log_overhead(sample_timestamp, time.perf_counter() - start_of_write)
+
+
+class HostedObserver:
+    """ Hosts an observer on a background thread of our runner, so its samples cover exactly one run. """
+
+    def __init__(self, observer: _Observer, frequency: str, overhead_fraction: float, run_metadata: Dict) -> None:
+        """
+        :param observer: Observer to host, from observer_factory.
+        :param frequency: Time between samples, measured in minutes.
+        :param overhead_fraction: If > 0, the largest fraction of the time between samples that a sample may cost.
+        :param run_metadata: Database, workload, concurrency, isolation, and MPL of the run, logged with our samples.
+        """
+        self.observer = observer
+        self.period = float(frequency) * 60.0
+        self.overhead_fraction = overhead_fraction
+        self.run_metadata = run_metadata
+
+    def on_first_dispatch(self) -> None:
+        """ Called by our producer before it hands over its first statement set. Our first sample is taken now. """
+        self.observer.clock_origin = (datetime.datetime.now(), time.monotonic())
+        self.observer.starting_timestamp = self.observer.get_timestamp()
+        self.observer.start_sampling(self.period, self.overhead_fraction, is_sampling_immediately=True)
+
+    def on_last_commit(self, last_commit_time: float) -> None:
+        """
+        Called once every consumer has finished. Our last sample is taken now, which closes our observation window.
+
+        :param last_commit_time: Monotonic time of the last commit.
+        """
+        if self.observer.clock_origin is None:
+            return  # Nothing was dispatched, so there is nothing to observe.
+
+        self.observer.stop_sampling()
+        self.observer.log_thread_wrapper()
+        clock_wall_time, clock_monotonic_time = self.observer.clock_origin
+        self.observer.log_run(self.run_metadata, clock_wall_time,
+                              clock_wall_time + datetime.timedelta(seconds=last_commit_time - clock_monotonic_time))
+        self.observer.end_logging()
 
 
 def observer_factory(config_directory: str, observer_option: str, results_file: str) -> _Observer:
@@ -402,6 +1107,9 @@ def observer_factory(config_directory: str, observer_option: str, results_file:
     :param results_file: Location of the results database to log to.
     :return: A _Database instance, dependent on the database_option.
     """
+    with open(config_directory + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+
     if observer_option == 'postgres':
         with open(config_directory + '/postgres.json', 'r') as postgres_config_file:
             postgres_json = json.load(postgres_config_file)
@@ -412,7 +1120,9 @@ def observer_factory(config_directory: str, observer_option: str, results_file:
                 user=postgres_json['user'],
                 password=postgres_json['password'],
                 host=postgres_json['host'],
-                database=postgres_json['database']
+                database=postgres_json['database'],
+                is_collecting_statements=general_json.get('postgres-statement-statistics', False),
+                lock_sample_interval=general_json.get('postgres-lock-sample-interval', 0.25)
             )
         except Exception as e:
             print(f'[{datetime.datetime.now()}][observer.py] Error in creating a PostgreSQL observer: ' + str(e))
@@ -423,7 +1133,11 @@ def observer_factory(config_directory: str, observer_option: str, results_file:
             mysql_json = json.load(mysql_config_file)
 
         try:
-            return _MySQLObserver(
+            mysql_observer_class = {
+                'sys': _MySQLObserver,
+                'performance_schema': _MySQLPerformanceSchemaObserver
+            }[general_json.get('mysql-observation-source', 'sys')]
+            return mysql_observer_class(
                 results_file=results_file,
                 user=mysql_json['username'],
                 password=mysql_json['password'],
@@ -435,7 +1149,7 @@ def observer_factory(config_directory: str, observer_option: str, results_file:
             exit(1)
 
     else:
-        return _TimingObserver(results_file=results_file)
+        raise ValueError(f'Unknown observer option {observer_option}.')
 
 
 if __name__ == '__main__':
@@ -456,7 +1170,8 @@ if __name__ == '__main__':
     observer = observer_factory(args.config_path, args.database, general_json['observation-db'])
 
     try:  # Ignore errors that occur here.
-        observer.begin_logging(args.oneshot, general_json['observation-frequency'])
+        observer.begin_logging(args.oneshot, general_json['observation-frequency'],
+                               general_json.get('observation-overhead-fraction', 0))
     except:
         pass
 
@@ -0,0 +1,382 @@
+""" This file runs our experiment matrix (as launcher.sh does), resuming from a ledger of the cells already run. """
+from connect import get_results_connection
+from compiler import compile_workload, is_compiled_current
+from resetter import reset_database
+from runner import run_experiment
+from observer import observer_factory
+
+from typing import Dict, Iterator, List, Tuple
+import multiprocessing
+import threading
+import datetime
+import signal
+import time
+import os
+import argparse
+import json
+import csv
+
+# A cell of our experiment matrix, of the form (database, concurrency, workload, isolation, MPL).
+Cell = Tuple[str, str, str, str, int]
+
+# Our lanes are threads, so our processes are spawned (not forked) to avoid inheriting the locks held by other lanes.
+_process_context = multiprocessing.get_context('spawn')
+
+# Seconds we wait for a stopped (or killed) process to exit, before giving up on it.
+_EXIT_TIMEOUT = 60.0
+
+# Columns of our summary file, one row per attempted cell.
+SUMMARY_COLUMNS = ['index', 'database', 'workload', 'concurrency', 'multiprogramming', 'isolation', 'status',
+                   'start_of_cell', 'end_of_cell', 'reset_time', 'run_time', 'insert_transactions',
+                   'insert_mean_latency', 'insert_p99_latency', 'select_transactions', 'select_mean_latency',
+                   'select_p99_latency', 'throughput', 'throughput_method']
+
+
+def get_cells(general_json: Dict, database: str) -> Iterator[Tuple[Cell, bool]]:
+    """ :return: Each cell of a database's matrix (in the order of launcher.sh), and whether the cell needs a reset. """
+    for concurrency in general_json['testing-concurrency']:
+        for workload in general_json['testing-workload']:
+            for mpl in general_json['testing-mpl']:
+                if workload == 'c':
+                    # For COMPLETE workloads, test all isolation levels.
+                    for isolation in ['ru', 'rc', 'rr', 's']:
+                        yield (database, concurrency, workload, isolation, mpl), True
+                else:
+                    # INSERT-only and QUERY-only workloads run at read committed. QUERY-only requires no reset.
+                    yield (database, concurrency, workload, 'rc', mpl), workload == 'i'
+
+
+class _RunLedger:
+    """ Persistent record of every cell we have attempted. Shared by each of our lanes, so access is locked. """
+
+    def __init__(self, results_file: str):
+        self.results_file = results_file
+        self.lock = threading.Lock()
+
+        results_conn = get_results_connection(results_file=self.results_file)
+        results_conn.execute("""
+            CREATE TABLE IF NOT EXISTS ExperimentLedger (
+                database TEXT NOT NULL,
+                concurrency TEXT NOT NULL,
+                workload TEXT NOT NULL,
+                isolation TEXT NOT NULL,
+                multiprogramming INTEGER NOT NULL,
+                status TEXT NOT NULL, -- One of: complete, failed, timeout, unseeded. --
+                start_of_cell DATETIME NOT NULL,
+                end_of_cell DATETIME NOT NULL
+            );
+        """)
+        results_conn.commit()
+        results_conn.close()
+
+    def clear(self) -> None:
+        with self.lock:
+            results_conn = get_results_connection(results_file=self.results_file)
+            results_conn.execute(""" DELETE FROM ExperimentLedger; """)
+            results_conn.commit()
+            results_conn.close()
+
+    def is_complete(self, cell: Cell) -> bool:
+        with self.lock:
+            results_conn = get_results_connection(results_file=self.results_file)
+            is_complete = results_conn.execute("""
+                SELECT 1
+                FROM ExperimentLedger
+                WHERE database = ? AND concurrency = ? AND workload = ? AND isolation = ? AND multiprogramming = ? AND
+                      status = 'complete';
+            """, list(cell)).fetchone() is not None
+            results_conn.close()
+            return is_complete
+
+    def record(self, cell: Cell, status: str, start_of_cell: datetime.datetime,
+               end_of_cell: datetime.datetime) -> None:
+        with self.lock:
+            results_conn = get_results_connection(results_file=self.results_file)
+            results_conn.execute("""
+                INSERT INTO ExperimentLedger
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, list(cell) + [status, start_of_cell, end_of_cell])
+            results_conn.commit()
+            results_conn.close()
+
+    def write_summary(self, summary_file: str) -> None:
+        """ Join each attempted cell with the reset times and latencies logged (by our cells) during that attempt. """
+        with self.lock:
+            results_conn = get_results_connection(results_file=self.results_file)
+            ledger_rows = results_conn.execute("""
+                SELECT database, workload, concurrency, multiprogramming, isolation, status, start_of_cell, end_of_cell
+                FROM ExperimentLedger
+                ORDER BY start_of_cell;
+            """).fetchall()
+            results_conn.close()
+
+            summary_rows = []
+            for i, ledger_row in enumerate(ledger_rows):
+                cell_results = get_cell_results(self.results_file, ledger_row[0], ledger_row[6], ledger_row[7])
+                summary_rows.append([i + 1] + list(ledger_row) + [cell_results[k] for k in SUMMARY_COLUMNS[9:]])
+
+        with open(summary_file, 'w', newline='') as summary_csv_file:
+            summary_writer = csv.writer(summary_csv_file)
+            summary_writer.writerow(SUMMARY_COLUMNS)
+            summary_writer.writerows(summary_rows)
+
+
+def get_cell_results(results_file: str, database: str, start_of_cell, end_of_cell) -> Dict:
+    """
+    :param results_file: Location of our timing database.
+    :param database: Database our cell was run on. Lanes run in parallel, so our window alone is not enough.
+    :param start_of_cell: Time our cell was started (as a datetime or as its string in our timing database).
+    :param end_of_cell: Time our cell finished.
+    :return: The reset time, run time, transactions and latencies (per statement class), and throughput of our cell
+             (with how it was measured: steady-state or wall-clock).
+    """
+    start_of_cell, end_of_cell = str(start_of_cell), str(end_of_cell)
+    results_conn = get_results_connection(results_file=results_file)
+    tables = {r[0] for r in results_conn.execute(""" SELECT name FROM sqlite_master WHERE type = 'table'; """)}
+
+    reset_time, latencies, steady_throughput = 0.0, {}, None
+    if 'ResetTime' in tables:
+        reset_time = results_conn.execute("""
+            SELECT COALESCE(SUM(reset_time), 0.0)
+            FROM ResetTime
+            WHERE database = ? AND start_of_reset BETWEEN ? AND ?;
+        """, [database, start_of_cell, end_of_cell]).fetchone()[0]
+    if 'LatencySummary' in tables:
+        latencies = {r[0]: r[1:] for r in results_conn.execute("""
+            SELECT statement_class, transactions, mean_latency, p99_latency
+            FROM LatencySummary
+            WHERE is_mysql = ? AND start_of_run BETWEEN ? AND ?;
+        """, [database == 'mysql', start_of_cell, end_of_cell])}
+    if 'SteadyStateSummary' in tables:
+        steady_throughput = (results_conn.execute("""
+            SELECT steady_throughput
+            FROM SteadyStateSummary
+            WHERE is_mysql = ? AND start_of_run BETWEEN ? AND ?;
+        """, [database == 'mysql', start_of_cell, end_of_cell]).fetchone() or [None])[0]
+    results_conn.close()
+
+    # Our run time is the time of our cell, less the time spent resetting our database.
+    run_time = (datetime.datetime.fromisoformat(end_of_cell) -
+                datetime.datetime.fromisoformat(start_of_cell)).total_seconds() - reset_time
+    cell_results = {'reset_time': reset_time, 'run_time': run_time}
+    for statement_class in ['insert', 'select']:
+        transactions, mean_latency, p99_latency = latencies.get(statement_class, (0, None, None))
+        cell_results[f'{statement_class}_transactions'] = transactions
+        cell_results[f'{statement_class}_mean_latency'] = mean_latency
+        cell_results[f'{statement_class}_p99_latency'] = p99_latency
+
+    # Our steady-state throughput excludes our warm-up (and the time to spawn and connect our consumers), so it is
+    # preferred. Cells that could not track their throughput fall back to their wall-clock throughput.
+    if steady_throughput is not None:
+        cell_results['throughput'], cell_results['throughput_method'] = steady_throughput, 'steady-state'
+    else:
+        transactions = cell_results['insert_transactions'] + cell_results['select_transactions']
+        cell_results['throughput'] = transactions / run_time if run_time > 0 else None
+        cell_results['throughput_method'] = 'wall-clock'
+    return cell_results
+
+
+def get_observation_file(general_json: Dict, database: str, is_parallel: bool) -> str:
+    """ :return: Observation database of a lane. Parallel lanes each get their own, as SQLite allows one writer. """
+    observation_file = general_json['observation-db']
+    if not is_parallel:
+        return observation_file
+    stem, extension = os.path.splitext(observation_file)
+    return f'{stem}-{database}{extension}'
+
+
+def _run_in_group(target, *args) -> None:
+    """ Entry point for each of our processes, which leads its own process group (see _start_in_group). """
+    os.setpgid(0, 0)
+    target(*args)
+
+
+def _start_in_group(target, *args) -> multiprocessing.Process:
+    """ :return: A started process, in its own process group. Any processes it spawns can then be killed with it. """
+    process = _process_context.Process(target=_run_in_group, args=(target,) + args)
+    process.start()
+    try:  # Both our process and its parent set its group, so either may win the race to do so.
+        os.setpgid(process.pid, process.pid)
+    except OSError:
+        pass
+    return process
+
+
+def _observe_cell(config_path: str, database: str, observation_file: str, stop_event) -> None:
+    """ Entry point for an observer's process, which samples (as observer.py does) until our stop event is set. """
+    with open(config_path + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+
+    observer = observer_factory(config_path, database, observation_file)
+    observer.starting_timestamp = observer.get_timestamp()
+    observer.start_sampling(float(general_json['observation-frequency']) * 60.0,
+                            general_json.get('observation-overhead-fraction', 0))
+    stop_event.wait()
+    observer.stop_sampling()
+    observer.end_logging()
+
+
+def _run_cell(config_path: str, cell: Cell, observation_file: str, is_observing: bool) -> None:
+    """ Entry point for a cell's process, which runs a single experiment. """
+    database, concurrency, workload, isolation, mpl = cell
+    run_experiment(config_path, database, workload, concurrency, isolation, mpl, is_observing=is_observing,
+                   observation_file=observation_file)
+
+
+def _join_by(process: multiprocessing.Process, deadline: float) -> bool:
+    """
+    :return: True if our process finished before the given (monotonic) deadline. Otherwise, it is killed along with
+             its process group, so that the consumer processes of a cell do not outlive it (and hold connections open).
+    """
+    process.join(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+    if not process.is_alive():
+        return True
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        process.kill()  # Our process has not yet set its own group, so it has not spawned anything.
+    process.join(_EXIT_TIMEOUT)
+    if process.is_alive():
+        print(f'[{datetime.datetime.now()}][orchestrator.py] Process {process.pid} could not be killed.')
+    return False
+
+
+def run_cell(config_path: str, cell: Cell, is_resetting: bool, cell_timeout: float = 0,
+             observation_file: str = None) -> Tuple[str, datetime.datetime, datetime.datetime]:
+    """
+    Each cell runs in its own process, so a failing (or hanging) cell cannot take its caller down with it. As in
+    launcher.sh, our observer is hosted by the runner or by its own process (see "observer-hosting"), and is only
+    started once our database has been reset.
+
+    :param config_path: Location of configuration files.
+    :param cell: Cell to run.
+    :param is_resetting: If true, our database is reset before the cell is run.
+    :param cell_timeout: Seconds after which our cell (including its reset) is killed. Disabled if <= 0.
+    :param observation_file: Observation database to log to. Defaults to the observation-db in general.json.
+    :return: The status of our cell (complete, failed, or timeout), and the times it started and finished.
+    """
+    with open(config_path + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+    database, concurrency = cell[0], cell[1]
+    observation_file = observation_file or general_json['observation-db']
+    is_hosting_observer = general_json.get('observer-hosting', 'process') == 'runner'
+
+    print(f'[{datetime.datetime.now()}][orchestrator.py] Starting cell {cell}.')
+    start_of_cell = datetime.datetime.now()
+    deadline = time.monotonic() + cell_timeout if cell_timeout > 0 else None
+
+    status = 'complete'
+    if is_resetting:
+        reset_process = _start_in_group(reset_database, config_path, database, concurrency)
+        if not _join_by(reset_process, deadline):
+            status = 'timeout'
+        elif reset_process.exitcode != 0:
+            status = 'failed'
+
+    if status == 'complete':
+        observer_process, stop_event = None, _process_context.Event()
+        if not is_hosting_observer:
+            observer_process = _start_in_group(_observe_cell, config_path, database, observation_file, stop_event)
+
+        cell_process = _start_in_group(_run_cell, config_path, cell, observation_file, is_hosting_observer)
+        if not _join_by(cell_process, deadline):
+            status = 'timeout'
+        elif cell_process.exitcode != 0:
+            status = 'failed'
+
+        # Our observer is stopped (and commits its samples) only once our runner has finished.
+        if observer_process is not None:
+            stop_event.set()
+            _join_by(observer_process, time.monotonic() + _EXIT_TIMEOUT)
+    end_of_cell = datetime.datetime.now()
+
+    print(f'[{datetime.datetime.now()}][orchestrator.py] Cell {cell} has finished w/ status {status}.')
+    return status, start_of_cell, end_of_cell
+
+
+def _run_lane(cells: List[Tuple[Cell, bool]], ledger: _RunLedger, config_path: str, general_json: Dict,
+              cell_timeout: float, summary_file: str, observation_file: str) -> None:
+    """ Run the cells of a single database in order, skipping those our ledger has already completed. """
+    seeded_concurrency = None  # Concurrency our database holds the INSERT-only load of (as left by this lane).
+
+    for i, (cell, is_resetting) in enumerate(cells):
+        database, concurrency, workload, isolation, mpl = cell
+        if ledger.is_complete(cell):
+            print(f'[{datetime.datetime.now()}][orchestrator.py] Skipping completed cell {cell}.')
+            continue
+
+        # Compile our workload once, instead of re-parsing the text file for every run.
+        workload_filename = general_json[f'{concurrency}-concurrency-{database}-workload']
+        if not is_compiled_current(workload_filename):
+            compile_workload(workload_filename)
+
+        # QUERY-only cells query the state left by the INSERT-only cell before them (as in launcher.sh). If we skipped
+        # that cell (or it failed), it is run again first. A QUERY-only cell we cannot seed is not run at all.
+        if workload == 'q' and seeded_concurrency != concurrency:
+            seed_cell = next((c for c, _ in reversed(cells[:i]) if c[1] == concurrency and c[2] == 'i'), None)
+            if seed_cell is not None:
+                print(f'[{datetime.datetime.now()}][orchestrator.py] Seeding cell {cell} w/ cell {seed_cell}.')
+                status, start_of_cell, end_of_cell = run_cell(config_path, seed_cell, True, cell_timeout,
+                                                              observation_file)
+                seeded_concurrency = concurrency if status == 'complete' else None
+                ledger.record(seed_cell, status, start_of_cell, end_of_cell)
+
+            if seeded_concurrency != concurrency:
+                print(f'[{datetime.datetime.now()}][orchestrator.py] Cell {cell} could not be seeded. Skipping.')
+                start_of_cell = end_of_cell = datetime.datetime.now()
+                ledger.record(cell, 'unseeded', start_of_cell, end_of_cell)
+                ledger.write_summary(summary_file)
+                continue
+
+        status, start_of_cell, end_of_cell = run_cell(config_path, cell, is_resetting, cell_timeout,
+                                                      observation_file)
+        if workload == 'i':
+            seeded_concurrency = concurrency if status == 'complete' else None
+        elif workload != 'q':
+            seeded_concurrency = None  # COMPLETE cells leave their own (non-INSERT-only) state behind.
+        ledger.record(cell, status, start_of_cell, end_of_cell)
+        ledger.write_summary(summary_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the experiment matrix of the tipper\'s benchmark.')
+
+    help_strings = {
+        "databases": 'Which databases to run the matrix on. Each database is its own lane.',
+        "config_path": 'Location of configuration files.',
+        "serial": 'Run our lanes one after the other, instead of in parallel.',
+        "restart": 'Clear our ledger, and run every cell from scratch.',
+        "cell_timeout": 'Seconds after which a cell is killed (and logged as a timeout). Disabled if <= 0.'
+    }
+    parser.add_argument('databases', type=str, nargs='+', choices=['postgres', 'mysql'],
+                        help=help_strings['databases'])
+    parser.add_argument('--config_path', type=str, default='config', help=help_strings['config_path'])
+    parser.add_argument('--serial', action='store_true', help=help_strings['serial'])
+    parser.add_argument('--restart', action='store_true', help=help_strings['restart'])
+    parser.add_argument('--cell_timeout', type=float, default=0, help=help_strings['cell_timeout'])
+    c_args = parser.parse_args()
+
+    with open(c_args.config_path + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+    summary_path = general_json.get('summary-path', 'results/summary.csv')
+    run_ledger = _RunLedger(general_json['timing-db'])
+    if c_args.restart:
+        run_ledger.clear()
+
+    # MySQL and Postgres are separate instances, so their lanes can run at the same time.
+    lanes, databases = [], list(dict.fromkeys(c_args.databases))
+    for database in databases:
+        observation_path = get_observation_file(general_json, database, len(databases) > 1 and not c_args.serial)
+        lanes.append(threading.Thread(target=_run_lane, name=f'{database}-lane', args=(
+            list(get_cells(general_json, database)), run_ledger, c_args.config_path, general_json,
+            c_args.cell_timeout, summary_path, observation_path
+        )))
+    for lane in lanes:
+        lane.start()
+        if c_args.serial:
+            lane.join()
+    [lane.join() for lane in lanes]
+
+    run_ledger.write_summary(summary_path)
+    print(f'[{datetime.datetime.now()}][orchestrator.py] Experiments are finished! Summary written to {summary_path}.')
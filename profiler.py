@@ -0,0 +1,108 @@
+""" This file holds the client resource sampler, which profiles our own (simulator) process while it runs. """
+from typing import Dict, Optional
+import threading
+import resource
+import time
+import os
+
+
+def _get_rss() -> int:
+    """ :return: The resident set size of our process in bytes, or its peak if the current size is unavailable. """
+    try:
+        with open('/proc/self/statm', 'r') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _get_thread_cpu_time(thread: threading.Thread) -> Optional[float]:
+    """ :return: The CPU time (in seconds) consumed by the given thread, or None if this is unavailable. """
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (AttributeError, OSError, TypeError):
+        return None  # Not supported by this platform, or the thread has exited.
+
+
+class ResourceSampler(threading.Thread):
+    """ Periodically samples the CPU, memory, and scheduling of our process, until stopped. """
+
+    def __init__(self, interval: float, probe_interval: float = 0.001, probe_count: int = 3):
+        """
+        :param interval: Time between samples, in seconds.
+        :param probe_interval: Length of each sleep used to estimate how long threads wait to reacquire the GIL.
+        :param probe_count: Sleeps made per sample. These are kept few, as each competes with the threads we measure.
+        """
+        # Of (seconds since the start of sampling, process CPU time, RSS, voluntary context switches, involuntary
+        # context switches, mean GIL wait estimate since the last sample).
+        self.samples = []
+
+        # Of thread name to (first sample time, first CPU time, last sample time, last CPU time).
+        self.thread_times = {}
+
+        self.interval, self.probe_interval, self.probe_count = interval, probe_interval, probe_count
+        self.stop_event = threading.Event()
+        super().__init__(daemon=True, name='resource-sampler')
+
+    def _take_sample(self, elapsed_time: float, gil_wait: float) -> None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.samples.append((elapsed_time, usage.ru_utime + usage.ru_stime, _get_rss(), usage.ru_nvcsw,
+                             usage.ru_nivcsw, gil_wait))
+
+        for thread in threading.enumerate():
+            thread_cpu_time = _get_thread_cpu_time(thread)
+            if thread_cpu_time is not None:
+                first_time, first_cpu_time = self.thread_times.get(thread.name, (elapsed_time, thread_cpu_time))[:2]
+                self.thread_times[thread.name] = (first_time, first_cpu_time, elapsed_time, thread_cpu_time)
+
+    def run(self) -> None:
+        start_of_sampling = time.monotonic()
+        next_sample_time = start_of_sampling + self.interval
+        self._take_sample(0.0, 0.0)
+
+        is_stopping = False
+        while not is_stopping:
+            # A sleeping thread must reacquire the GIL before it can run again, so the time beyond a few short
+            # requested sleeps estimates how long runnable threads wait on the GIL. We then wait out our interval.
+            gil_wait = 0.0
+            for _ in range(self.probe_count):
+                start_of_probe = time.perf_counter()
+                time.sleep(self.probe_interval)
+                gil_wait += max(0.0, time.perf_counter() - start_of_probe - self.probe_interval)
+            is_stopping = self.stop_event.wait(max(0.0, next_sample_time - time.monotonic()))
+
+            self._take_sample(time.monotonic() - start_of_sampling, gil_wait / max(self.probe_count, 1))
+            next_sample_time = max(next_sample_time + self.interval, time.monotonic())
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
+
+    def get_thread_utilizations(self) -> Dict[str, float]:
+        """ :return: Cores used by each thread, by its CPU time over the samples it was alive for. """
+        return {name: (t[3] - t[1]) / max(t[2] - t[0], self.interval) for name, t in self.thread_times.items()}
+
+    def get_summary(self, cpu_threshold: float, gil_wait_threshold: float) -> Dict:
+        """
+        :param cpu_threshold: Cores (of our process, or of any single thread) above which we are client-bound.
+        :param gil_wait_threshold: Mean GIL wait (in seconds) above which we are client-bound.
+        :return: Utilization, memory, and scheduling statistics over every sample, and whether we were client-bound.
+        """
+        first_sample, last_sample = self.samples[0], self.samples[-1]
+        elapsed_time = max(last_sample[0] - first_sample[0], 1e-9)
+
+        thread_utilizations = self.get_thread_utilizations()
+        busiest_thread = max(thread_utilizations, key=thread_utilizations.get, default=None)
+
+        gil_waits = [s[5] for s in self.samples[1:]]
+        summary = {
+            'cpu_utilization': (last_sample[1] - first_sample[1]) / elapsed_time,
+            'busiest_thread': busiest_thread,
+            'busiest_thread_utilization': thread_utilizations.get(busiest_thread, 0.0),
+            'max_rss': max(s[2] for s in self.samples),
+            'voluntary_context_switches': last_sample[3] - first_sample[3],
+            'involuntary_context_switches': last_sample[4] - first_sample[4],
+            'mean_gil_wait': sum(gil_waits) / len(gil_waits) if len(gil_waits) > 0 else 0.0
+        }
+        summary['is_client_bound'] = summary['cpu_utilization'] >= cpu_threshold or \
+            summary['busiest_thread_utilization'] >= cpu_threshold or summary['mean_gil_wait'] >= gil_wait_threshold
+        return summary
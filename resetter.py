@@ -0,0 +1,208 @@
+""" This file resets the seeded database between experiments, restoring it from a snapshot instead of rebuilding it. """
+from connect import get_mysql_new_connection, get_postgres_new_connection, get_results_connection
+from initializer import initialize_mysql, initialize_postgres, read_metadata
+from destructor import teardown_mysql, teardown_postgres
+
+from typing import Dict, List
+import datetime
+import argparse
+import json
+import time
+import re
+
+
+def _get_partial_drop_tables(general_json: Dict) -> List[str]:
+    """ :return: The tables written to by our workloads, i.e. those truncated by our partial drop DDL. """
+    with open(general_json['partial-drop-ddl']) as partial_drop_ddl_file:
+        return re.findall(r'truncate\s+table\s+(\w+)', partial_drop_ddl_file.read(), re.IGNORECASE)
+
+
+def _terminate_postgres_backends(postgres_cur, database: str) -> None:
+    """ Kick off every other user of the given database (including ourselves, from a previous run). """
+    postgres_cur.execute(f"""
+        SELECT pg_terminate_backend(pid)
+        FROM pg_stat_activity
+        WHERE datname = '{database}' AND pid <> pg_backend_pid();
+    """)
+
+
+def reset_postgres(config_directory: str, concurrency: str, reset_mode: str = 'snapshot',
+                   is_rebuilding_snapshot: bool = False) -> str:
+    """
+    :param config_directory: Location of configuration files.
+    :param concurrency: Concurrency to seed our database for.
+    :param reset_mode: Use 'rebuild' to drop and re-initialize our database instead of restoring it from a snapshot.
+    :param is_rebuilding_snapshot: If true, our snapshot is rebuilt (e.g. because the DDL or metadata has changed).
+    :return: How our database was reset (rebuild, snapshot, or template).
+    """
+    with open(config_directory + '/postgres.json', 'r') as postgres_config_file:
+        postgres_json = json.load(postgres_config_file)
+
+    if reset_mode == 'rebuild':
+        teardown_postgres(config_directory)
+        initialize_postgres(config_directory, concurrency)
+        return 'rebuild'
+
+    try:
+        postgres_conn = get_postgres_new_connection(
+            user=postgres_json['user'],
+            password=postgres_json['password'],
+            host=postgres_json['host']
+        )
+        postgres_conn.autocommit = True
+        postgres_cur = postgres_conn.cursor()
+
+        # Our snapshot is a (never connected to) copy of our freshly seeded database, used as a template.
+        snapshot_database = f"{postgres_json['database']}_snapshot_{concurrency}"
+        if is_rebuilding_snapshot:
+            postgres_cur.execute(f""" DROP DATABASE IF EXISTS {snapshot_database}; """)
+        postgres_cur.execute(f""" SELECT 1 FROM pg_database WHERE datname = '{snapshot_database}'; """)
+        is_snapshot_present = postgres_cur.fetchone() is not None
+
+        if not is_snapshot_present:
+            # Build our seeded database once, and take our snapshot of it.
+            teardown_postgres(config_directory)
+            initialize_postgres(config_directory, concurrency)
+            _terminate_postgres_backends(postgres_cur, postgres_json['database'])
+            postgres_cur.execute(f""" CREATE DATABASE {snapshot_database} TEMPLATE {postgres_json['database']}; """)
+            print(f'[{datetime.datetime.now()}][resetter.py] Snapshot {snapshot_database} has been built.')
+
+        else:
+            # Restore our database by copying the snapshot, which is a file-level copy (no DDL or INSERTs are run).
+            _terminate_postgres_backends(postgres_cur, postgres_json['database'])
+            postgres_cur.execute(f""" DROP DATABASE IF EXISTS {postgres_json['database']}; """)
+            postgres_cur.execute(f""" CREATE DATABASE {postgres_json['database']} TEMPLATE {snapshot_database}; """)
+
+        postgres_cur.close()
+        postgres_conn.close()
+        return 'template' if is_snapshot_present else 'snapshot'
+
+    except Exception as e:
+        print(f'[{datetime.datetime.now()}][resetter.py] Error in resetting Postgres: ' + str(e))
+        exit(1)
+
+
+def reset_mysql(config_directory: str, concurrency: str, reset_mode: str = 'snapshot',
+                is_rebuilding_snapshot: bool = False) -> str:
+    """
+    :param config_directory: Location of configuration files.
+    :param concurrency: Concurrency to seed our database for.
+    :param reset_mode: Use 'rebuild' to drop and re-initialize our database instead of truncating it.
+    :param is_rebuilding_snapshot: If true, our database is always rebuilt (e.g. because the DDL has changed).
+    :return: How our database was reset (rebuild or truncate).
+    """
+    with open(config_directory + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+    with open(config_directory + '/mysql.json', 'r') as mysql_config_file:
+        mysql_json = json.load(mysql_config_file)
+
+    try:
+        mysql_conn = get_mysql_new_connection(
+            user=mysql_json['username'],
+            password=mysql_json['password'],
+            host=mysql_json['host'],
+        )
+        mysql_cur = mysql_conn.cursor()
+        mysql_cur.execute(f"""
+            SELECT 1
+            FROM information_schema.SCHEMATA
+            WHERE SCHEMA_NAME = '{mysql_json['database']}';
+        """)
+        is_database_present = len(mysql_cur.fetchall()) > 0
+
+        # Our workloads never modify the metadata, so our database is our snapshot if it holds the metadata of this
+        # concurrency (i.e. the row count of every metadata table matches our metadata file).
+        is_seeded = is_database_present and reset_mode != 'rebuild' and not is_rebuilding_snapshot
+        if is_seeded:
+            table_rows = read_metadata(general_json[f'{concurrency}-concurrency-metadata'])
+            for table_name, rows in table_rows.items():
+                try:
+                    mysql_cur.execute(f""" SELECT COUNT(*) FROM {mysql_json['database']}.{table_name}; """)
+                    is_seeded = is_seeded and mysql_cur.fetchone()[0] == len(rows)
+                except Exception as e:
+                    print(f'[{datetime.datetime.now()}][resetter.py] Could not verify {table_name}: {e}')
+                    is_seeded = False
+
+        if is_seeded:
+            # Only empty the tables our workloads write to.
+            mysql_cur.execute('SET SESSION foreign_key_checks = 0;')
+            for table_name in _get_partial_drop_tables(general_json):
+                mysql_cur.execute(f""" TRUNCATE TABLE {mysql_json['database']}.{table_name}; """)
+            mysql_cur.execute('SET SESSION foreign_key_checks = 1;')
+
+        mysql_cur.close()
+        mysql_conn.close()
+
+    except Exception as e:
+        print(f'[{datetime.datetime.now()}][resetter.py] Error in resetting MySQL: ' + str(e))
+        exit(1)
+
+    if not is_seeded:
+        if is_database_present:
+            teardown_mysql(config_directory)
+        initialize_mysql(config_directory, concurrency)
+
+    return 'truncate' if is_seeded else 'rebuild'
+
+
+def _record_reset_time(start_of_reset: datetime.datetime, database: str, concurrency: str, reset_method: str,
+                       reset_time: float, general_json: Dict) -> None:
+    """ Report the time taken to reset our database, and log this to our timing database. """
+    print(f'[{datetime.datetime.now()}][resetter.py] Reset Method: {reset_method}, Reset Time (s): {reset_time}.')
+
+    results_conn = get_results_connection(results_file=general_json['timing-db'])
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS ResetTime (
+            start_of_reset DATETIME NOT NULL,
+            database TEXT NOT NULL,
+            concurrency TEXT NOT NULL,
+            reset_method TEXT NOT NULL, -- One of: rebuild, snapshot (built), template, truncate. --
+            reset_time REAL NOT NULL -- Measured in seconds. --
+        );
+    """)
+    results_conn.execute("""
+        INSERT INTO ResetTime
+        VALUES (?, ?, ?, ?, ?)
+    """, [start_of_reset, database, concurrency, reset_method, reset_time])
+    results_conn.commit()
+    results_conn.close()
+
+
+def reset_database(config_directory: str, database: str, concurrency: str, reset_mode: str = None,
+                   is_rebuilding_snapshot: bool = False) -> float:
+    """
+    :param config_directory: Location of configuration files.
+    :param database: Database to reset (postgres or mysql).
+    :param concurrency: Concurrency to seed our database for.
+    :param reset_mode: If specified, overrides the reset mode in general.json.
+    :param is_rebuilding_snapshot: If true, our snapshot is rebuilt before it is restored.
+    :return: The time taken to reset our database, in seconds. This is also logged to our timing database.
+    """
+    with open(config_directory + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+    reset_mode = reset_mode or general_json.get('reset-mode', 'rebuild')
+
+    start_of_reset, start_time = datetime.datetime.now(), time.perf_counter()
+    if database == 'postgres':
+        reset_method = reset_postgres(config_directory, concurrency, reset_mode, is_rebuilding_snapshot)
+    else:
+        reset_method = reset_mysql(config_directory, concurrency, reset_mode, is_rebuilding_snapshot)
+
+    reset_time = time.perf_counter() - start_time
+    _record_reset_time(start_of_reset, database, concurrency, reset_method, reset_time, general_json)
+    return reset_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reset the seeded database between experiments.')
+    parser.add_argument('database', type=str, choices=['postgres', 'mysql'], help='Database to reset.')
+    parser.add_argument('concurrency', type=str, choices=['low', 'high'], help='Concurrency to seed the database for.')
+    parser.add_argument('--config_path', type=str, default='config', help='Location of configuration files.')
+    parser.add_argument('--reset_mode', type=str, choices=['snapshot', 'rebuild'],
+                        help='Overrides the reset mode in general.json.')
+    parser.add_argument('--rebuild_snapshot', action='store_true', help='Rebuild the snapshot before restoring it.')
+    args = parser.parse_args()
+
+    reset_database(args.config_path, args.database, args.concurrency, args.reset_mode, args.rebuild_snapshot)
+    print(f"[{datetime.datetime.now()}][resetter.py] Database {args.database} has been reset "
+          f"w/ concurrency {args.concurrency}.")
@@ -1,5 +1,6 @@
 """ This file is the Python entry point to launch an experiment and observer. """
-from simulator import insert_only_workload, query_only_workload, complete_workload
+from simulator import insert_only_workload, query_only_workload, complete_workload, get_simulator_options
+from observer import observer_factory, HostedObserver
 
 from typing import Callable, Dict
 import datetime
@@ -31,9 +32,10 @@ class _GenericWorkloadFactory(abc.ABC):
 
 
 class _PostgresWorkloadFactory(_GenericWorkloadFactory):
-    def __init__(self, postgres_json, concurrency: str):
+    def __init__(self, postgres_json, concurrency: str, run_listener: HostedObserver = None):
         self.postgres_json = postgres_json
         self.concurrency = concurrency
+        self.run_listener = run_listener
 
     def _generate_workload_arguments(self, isolation: str, mpl: int, _general_json: Dict[str, str]):
         return {
@@ -45,6 +47,8 @@ class _PostgresWorkloadFactory(_GenericWorkloadFactory):
             'isolation': {'ru': 1, 'rc': 1, 'rr': 2, 's': 3}[isolation],
             'multiprogramming': mpl,
             'is_mysql': False,
+            'run_listener': self.run_listener,
+            **get_simulator_options(_general_json)
         }
 
     def _insert_only_workload(self, isolation: str, mpl: int, _general_json: Dict[str, str], config_path: str):
@@ -58,9 +62,10 @@ class _PostgresWorkloadFactory(_GenericWorkloadFactory):
 
 
 class _MySQLWorkloadFactory(_GenericWorkloadFactory):
-    def __init__(self, mysql_json, concurrency: str):
+    def __init__(self, mysql_json, concurrency: str, run_listener: HostedObserver = None):
         self.mysql_json = mysql_json
         self.concurrency = concurrency
+        self.run_listener = run_listener
 
     def _generate_workload_arguments(self, isolation: str, mpl: int, _general_json: Dict[str, str]):
         return {
@@ -77,6 +82,8 @@ class _MySQLWorkloadFactory(_GenericWorkloadFactory):
             }[isolation],
             'multiprogramming': mpl,
             'is_mysql': True,
+            'run_listener': self.run_listener,
+            **get_simulator_options(_general_json)
         }
 
     def _insert_only_workload(self, isolation: str, mpl: int, _general_json: Dict[str, str], config_path):
@@ -89,6 +96,66 @@ class _MySQLWorkloadFactory(_GenericWorkloadFactory):
         complete_workload(**self._generate_workload_arguments(isolation, mpl, _general_json))
 
 
+def run_experiment(config_path: str, database: str, workload: str, concurrency: str, isolation: str,
+                   multiprogramming: int, is_observing: bool = False, consumer_engine: str = None,
+                   observation_file: str = None) -> None:
+    """
+    :param config_path: Location of configuration files.
+    :param database: Which database to run our experiment on (postgres or mysql).
+    :param workload: Which workload to run. i=insert-only, q=query-only, c=complete.
+    :param concurrency: Type of concurrency experiment to run (high or low).
+    :param isolation: Isolation level to run (ru, rc, rr, or s).
+    :param multiprogramming: Multiprogramming level to run.
+    :param is_observing: If true, we host the observer ourselves (from the first dispatch to the last commit).
+    :param consumer_engine: If specified, overrides the consumer engine in general.json.
+    :param observation_file: If specified, overrides the observation database in general.json.
+    """
+    with open(config_path + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+
+    # If we host our own observer, its samples are aligned to our run (instead of to the launcher's observer process).
+    hosted_observer = None
+    if is_observing:
+        hosted_observer = HostedObserver(
+            observer_factory(config_path, database, observation_file or general_json['observation-db']),
+            general_json['observation-frequency'],
+            general_json.get('observation-overhead-fraction', 0),
+            {
+                'database': database,
+                'workload': workload,
+                'concurrency': concurrency,
+                'isolation': isolation,
+                'multiprogramming': multiprogramming
+            }
+        )
+
+    # Create an experiment instance.
+    if database == 'postgres':
+        with open(config_path + '/postgres.json', 'r') as postgres_config_file:
+            runner = _PostgresWorkloadFactory(
+                json.load(postgres_config_file),
+                concurrency,
+                hosted_observer
+            )(workload)
+
+    else:
+        with open(config_path + '/mysql.json', 'r') as mysql_config_file:
+            runner = _MySQLWorkloadFactory(
+                json.load(mysql_config_file),
+                concurrency,
+                hosted_observer
+            )(workload)
+
+    # Run our workload. Each experiment is a function of MPL.
+    if consumer_engine is not None:
+        general_json['consumer-engine'] = consumer_engine
+    print(f"[{datetime.datetime.now()}][runner.py] Workload ({workload}), "
+          f"Concurrency ({concurrency}), "
+          f"MPL ({multiprogramming}), "
+          f"Isolation ({isolation})")
+    runner(isolation, multiprogramming, general_json, config_path)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run experiments on the tipper\'s benchmark.')
 
@@ -98,7 +165,10 @@ if __name__ == '__main__':
         "concurrency": 'Type of concurrency experiment to run.',
         "isolation": "Isolation level to run.",
         "multiprogramming": 'Multiprogramming level to run.',
-        "config_path": 'Location of configuration files.'
+        "config_path": 'Location of configuration files.',
+        "consumer_engine": 'Overrides the consumer engine in general.json. asyncio multiplexes all connections '
+                           'on a single event loop.',
+        "observe": 'Host the observer on a background thread, sampling from the first dispatch to the last commit.'
     }
     parser.add_argument('database', type=str, choices=['postgres', 'mysql'], help=help_strings['database'])
     parser.add_argument('workload', type=str, choices=['i', 'q', 'c'], help=help_strings['workload'])
@@ -106,28 +176,10 @@ if __name__ == '__main__':
     parser.add_argument('isolation', type=str, choices=['ru', 'rc', 'rr', 's'], help=help_strings['isolation'])
     parser.add_argument('multiprogramming', type=int, help=help_strings['multiprogramming'])
     parser.add_argument('--config_path', type=str, default='config', help=help_strings['config_path'])
+    parser.add_argument('--consumer_engine', type=str, choices=['thread', 'asyncio'],
+                        help=help_strings['consumer_engine'])
+    parser.add_argument('--observe', action='store_true', help=help_strings['observe'])
     c_args = parser.parse_args()
 
-    # Create an experiment instance.
-    if c_args.database == 'postgres':
-        with open(c_args.config_path + '/postgres.json', 'r') as postgres_config_file:
-            runner = _PostgresWorkloadFactory(
-                json.load(postgres_config_file),
-                c_args.concurrency
-            )(c_args.workload)
-
-    else:
-        with open(c_args.config_path + '/mysql.json', 'r') as mysql_config_file:
-            runner = _MySQLWorkloadFactory(
-                json.load(mysql_config_file),
-                c_args.concurrency
-            )(c_args.workload)
-
-    # Run our workload. Each experiment is a function of MPL.
-    with open(c_args.config_path + '/general.json', 'r') as general_config_file:
-        general_json = json.load(general_config_file)
-    print(f"[{datetime.datetime.now()}][runner.py] Workload ({c_args.workload}), "
-          f"Concurrency ({c_args.concurrency}), "
-          f"MPL ({c_args.multiprogramming}), "
-          f"Isolation ({c_args.isolation})")
-    runner(c_args.isolation, c_args.multiprogramming, general_json, c_args.config_path)
+    run_experiment(c_args.config_path, c_args.database, c_args.workload, c_args.concurrency, c_args.isolation,
+                   c_args.multiprogramming, c_args.observe, c_args.consumer_engine)
@@ -0,0 +1,219 @@
+""" This file searches MPL for the saturation point (knee) of a database, instead of running a fixed list of MPLs. """
+from orchestrator import run_cell, get_cell_results
+from compiler import compile_workload, is_compiled_current
+from connect import get_results_connection
+
+from typing import Dict, Optional
+import datetime
+import argparse
+import json
+import math
+import csv
+
+
+def _get_mean_latency(cell_results: Dict) -> Optional[float]:
+    """ :return: The mean latency of our cell over every statement class, or None if nothing was committed. """
+    transactions, total_latency = 0, 0.0
+    for statement_class in ['insert', 'select']:
+        if cell_results[f'{statement_class}_transactions'] > 0:
+            transactions += cell_results[f'{statement_class}_transactions']
+            total_latency += cell_results[f'{statement_class}_transactions'] * \
+                cell_results[f'{statement_class}_mean_latency']
+
+    return total_latency / transactions if transactions > 0 else None
+
+
+class _KneeSearch:
+    """ Doubles MPL until our throughput stops paying for it, and then bisects between the last two MPLs. """
+
+    def __init__(self, config_path: str, database: str, workload: str, concurrency: str, isolation: str,
+                 general_json: Dict, cell_timeout: float = 0):
+        self.config_path = config_path
+        self.database, self.workload = database, workload
+        self.concurrency, self.isolation = concurrency, isolation
+        self.cell_timeout = cell_timeout
+        self.results_file = general_json['timing-db']
+
+        self.min_mpl = general_json.get('knee-min-mpl', 1)
+        self.max_mpl = general_json.get('knee-max-mpl', 256)
+        self.gain_threshold = general_json.get('knee-gain-threshold', 0.1)
+        self.latency_factor = general_json.get('knee-latency-factor', 10)
+        self.resolution = general_json.get('knee-resolution', 0.1)
+        self.run_budget = general_json.get('knee-run-budget', 10)
+
+        # QUERY-only workloads query the state left by an INSERT-only run. We seed at the MPL launcher.sh does.
+        self.seed_mpl = general_json.get('testing-mpl', [self.min_mpl])[-1]
+        self.is_seeded = False
+
+        self.curve = {}  # Of MPL to the results of its cell.
+
+        # Why our search stopped. One of: knee (bracketed and refined), max-mpl (still scaling at our maximum MPL),
+        # budget (spent before the knee was bracketed or refined), or failed (our lowest MPL could not be run, or our
+        # database could not be seeded).
+        self.stop_reason = None
+
+    def _seed(self) -> bool:
+        """ Reset our database and run the INSERT-only workload on it once. :return: True if this was successful. """
+        seed_cell = (self.database, self.concurrency, 'i', 'rc', self.seed_mpl)
+        print(f'[{datetime.datetime.now()}][searcher.py] Seeding our database w/ cell {seed_cell}.')
+        self.is_seeded = run_cell(self.config_path, seed_cell, True, self.cell_timeout)[0] == 'complete'
+        return self.is_seeded
+
+    def _measure(self, mpl: int) -> Optional[Dict]:
+        """ :return: The results of a cell at the given MPL (run only once), or None if our budget has been spent. """
+        if mpl in self.curve:
+            return self.curve[mpl]
+        elif len(self.curve) >= self.run_budget:
+            print(f'[{datetime.datetime.now()}][searcher.py] Run budget of {self.run_budget} has been spent.')
+            return None
+
+        # QUERY-only workloads do not modify our (seeded) database, so they are never reset.
+        cell = (self.database, self.concurrency, self.workload, self.isolation, mpl)
+        status, start_of_cell, end_of_cell = run_cell(self.config_path, cell, self.workload != 'q', self.cell_timeout)
+        cell_results = get_cell_results(self.results_file, self.database, start_of_cell, end_of_cell)
+        cell_results['status'] = status
+        cell_results['mean_latency'] = _get_mean_latency(cell_results)
+
+        self.curve[mpl] = cell_results
+        if cell_results['throughput_method'] != 'steady-state':
+            print(f'[{datetime.datetime.now()}][searcher.py] No steady-state throughput was tracked for MPL {mpl}. '
+                  f'Its wall-clock throughput (which includes connection setup and warm-up) is used instead.')
+        print(f'[{datetime.datetime.now()}][searcher.py] MPL: {mpl}, Status: {status}, '
+              f'Throughput (tx/s): {cell_results["throughput"]}, Mean Latency (s): {cell_results["mean_latency"]}.')
+        return cell_results
+
+    def _is_worth(self, lower_mpl: int, upper_mpl: int) -> bool:
+        """ :return: True if moving from the lower to the upper MPL gains enough throughput, at a sane latency. """
+        lower_results, upper_results = self.curve[lower_mpl], self.curve[upper_mpl]
+        if upper_results['status'] != 'complete' or not upper_results['throughput'] or \
+                upper_results['mean_latency'] is None:
+            return False
+
+        # Latency is compared against our lowest MPL, which is the closest we have to an uncontended latency.
+        base_latency = self.curve[min(self.curve)]['mean_latency']
+        if base_latency is not None and upper_results['mean_latency'] > self.latency_factor * base_latency:
+            return False
+
+        # Gains are normalized per doubling of MPL, so coarse and fine steps are held to the same threshold.
+        gain = upper_results['throughput'] / lower_results['throughput'] - 1
+        return gain / math.log2(upper_mpl / lower_mpl) >= self.gain_threshold
+
+    def search(self) -> Optional[int]:
+        """ :return: The highest MPL that was still worth moving to, or None if our lowest MPL could not be run. """
+        if self.workload == 'q' and not self.is_seeded and not self._seed():
+            print(f'[{datetime.datetime.now()}][searcher.py] Our database could not be seeded.')
+            self.stop_reason = 'failed'
+            return None
+
+        lower_results = self._measure(self.min_mpl)
+        if lower_results is None or lower_results['status'] != 'complete' or not lower_results['throughput']:
+            self.stop_reason = 'failed'
+            return None
+
+        # Coarse: double our MPL until a doubling no longer pays for itself (or we reach our maximum MPL).
+        lower_mpl, upper_mpl = self.min_mpl, None
+        self.stop_reason = 'max-mpl'
+        while lower_mpl < self.max_mpl:
+            next_mpl = min(lower_mpl * 2, self.max_mpl)
+            if self._measure(next_mpl) is None:
+                self.stop_reason = 'budget'
+                break
+            elif not self._is_worth(lower_mpl, next_mpl):
+                upper_mpl, self.stop_reason = next_mpl, 'knee'
+                break
+            lower_mpl = next_mpl
+
+        # Refine: bisect between the last MPL that was worth it and the first that was not.
+        while upper_mpl is not None and upper_mpl - lower_mpl > max(1, int(self.resolution * lower_mpl)):
+            middle_mpl = (lower_mpl + upper_mpl) // 2
+            if self._measure(middle_mpl) is None:
+                self.stop_reason = 'budget'
+                break
+            elif self._is_worth(lower_mpl, middle_mpl):
+                lower_mpl = middle_mpl
+            else:
+                upper_mpl = middle_mpl
+
+        return lower_mpl
+
+    def record(self, start_of_search: datetime.datetime, chosen_mpl: Optional[int], curve_file: str) -> None:
+        """ Report our throughput / latency curve, and log this to our timing database and to a CSV file. """
+        curve_rows = [[mpl, r['status'], r['throughput'], r['throughput_method'], r['mean_latency'],
+                       r['insert_p99_latency'], r['select_p99_latency'], mpl == chosen_mpl, self.stop_reason]
+                      for mpl, r in sorted(self.curve.items())]
+        for curve_row in curve_rows:
+            print(f'[{datetime.datetime.now()}][searcher.py] ' +
+                  ', '.join(f'{k}={v}' for k, v in zip(['MPL', 'Status', 'Throughput', 'Throughput Method',
+                                                         'Mean Latency', 'INSERT p99', 'SELECT p99', 'Chosen'],
+                                                        curve_row)))
+        print(f'[{datetime.datetime.now()}][searcher.py] Optimal MPL: {chosen_mpl}, Runs: {len(self.curve)}, '
+              f'Stop Reason: {self.stop_reason}.')
+
+        results_conn = get_results_connection(results_file=self.results_file)
+        results_conn.execute("""
+            CREATE TABLE IF NOT EXISTS KneeSearch (
+                start_of_search DATETIME NOT NULL,
+                database TEXT NOT NULL,
+                workload TEXT NOT NULL,
+                concurrency TEXT NOT NULL,
+                isolation TEXT NOT NULL,
+                multiprogramming INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                throughput REAL, -- Measured in transactions per second. --
+                throughput_method TEXT NOT NULL, -- One of: steady-state, wall-clock. --
+                mean_latency REAL,
+                insert_p99_latency REAL,
+                select_p99_latency REAL,
+                is_chosen INTEGER NOT NULL,
+                stop_reason TEXT NOT NULL -- One of: knee, max-mpl, budget, failed. --
+            );
+        """)
+        results_conn.executemany("""
+            INSERT INTO KneeSearch
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [[start_of_search, self.database, self.workload, self.concurrency, self.isolation] + r
+              for r in curve_rows])
+        results_conn.commit()
+        results_conn.close()
+
+        with open(curve_file, 'w', newline='') as curve_csv_file:
+            curve_writer = csv.writer(curve_csv_file)
+            curve_writer.writerow(['multiprogramming', 'status', 'throughput', 'throughput_method', 'mean_latency',
+                                   'insert_p99_latency', 'select_p99_latency', 'is_chosen', 'stop_reason'])
+            curve_writer.writerows(curve_rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search for the MPL at which a database saturates.')
+
+    help_strings = {
+        "database": 'Which database to run experiments on.',
+        "workload": "Which workload to run. i=insert-only, q=query-only, c=complete.",
+        "concurrency": 'Type of concurrency experiment to run.',
+        "isolation": "Isolation level to run.",
+        "config_path": 'Location of configuration files.',
+        "cell_timeout": 'Seconds after which a cell is killed (and treated as saturated). Disabled if <= 0.',
+        "curve_path": 'Location of the CSV file to write our throughput / latency curve to.'
+    }
+    parser.add_argument('database', type=str, choices=['postgres', 'mysql'], help=help_strings['database'])
+    parser.add_argument('workload', type=str, choices=['i', 'q', 'c'], help=help_strings['workload'])
+    parser.add_argument('concurrency', type=str, choices=['high', 'low'], help=help_strings['concurrency'])
+    parser.add_argument('isolation', type=str, choices=['ru', 'rc', 'rr', 's'], help=help_strings['isolation'])
+    parser.add_argument('--config_path', type=str, default='config', help=help_strings['config_path'])
+    parser.add_argument('--cell_timeout', type=float, default=0, help=help_strings['cell_timeout'])
+    parser.add_argument('--curve_path', type=str, help=help_strings['curve_path'])
+    c_args = parser.parse_args()
+
+    with open(c_args.config_path + '/general.json', 'r') as general_config_file:
+        general_json = json.load(general_config_file)
+
+    # Compile our workload once, instead of re-parsing the text file for every run.
+    workload_filename = general_json[f'{c_args.concurrency}-concurrency-{c_args.database}-workload']
+    if not is_compiled_current(workload_filename):
+        compile_workload(workload_filename)
+
+    knee_search = _KneeSearch(c_args.config_path, c_args.database, c_args.workload, c_args.concurrency,
+                              c_args.isolation, general_json, c_args.cell_timeout)
+    start_of_search = datetime.datetime.now()
+    knee_search.record(start_of_search, knee_search.search(), c_args.curve_path or
+                       f'results/knee-{c_args.database}-{c_args.workload}-{c_args.concurrency}-{c_args.isolation}.csv')
@@ -1,9 +1,21 @@
 """ This file holds the simulator code, which will execute the transactions. """
-from connect import get_mysql_new_connection, get_postgres_new_connection
-
-from typing import Dict
+from connect import get_mysql_new_connection, get_postgres_new_connection, get_results_connection
+from connect import get_mysql_async_connection, get_postgres_async_connection
+from compiler import iterate_workload, is_compiled_current, STATEMENT_INSERT
+from histogram import LatencyHistogram
+from metrics import LiveMetrics, MetricsServer
+from normalizer import normalize_statement, PLACEHOLDER_QMARK, PLACEHOLDER_NUMERIC
+from profiler import ResourceSampler
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import concurrent.futures
+import collections
+import zlib
+import math
 import datetime
+import asyncio
 import random
+import multiprocessing
 import threading
 import time
 import argparse
@@ -14,209 +26,712 @@ import abc
 # Queue of statement sets. Submitted by the workload consumers.
 _statement_set_queue = None
 
+# Live metrics shared by every consumer of this process, if our metrics endpoint is enabled.
+_live_metrics = None
+
+# Notified whenever a consumer of this process takes a statement set, if our producer bounds the queue itself.
+_statement_set_taken = None
+
+
+class _AffinityDispatcher:
+    """ Gives each consumer its own queue of statement sets, routed by key. Idle consumers steal from the others. """
+
+    class _ConsumerView:
+        def __init__(self, dispatcher: '_AffinityDispatcher', consumer_index: int):
+            self.dispatcher = dispatcher
+            self.consumer_index = consumer_index
+
+        def get(self):
+            return self.dispatcher.get(self.consumer_index)
+
+    def __init__(self, consumer_count: int, capacity: int):
+        self.queues = [collections.deque() for _ in range(consumer_count)]
+        self.condition = threading.Condition()
+        self.capacity = capacity
+        self.size = 0
+        self.is_closed = False
+        self.steals = 0
+
+    def put(self, statement_set, key=None) -> None:
+        with self.condition:
+            # We treat the number 0 as our poison pill here. Consumers will only stop once every queue is empty.
+            if statement_set == 0:
+                self.is_closed = True
+                self.condition.notify_all()
+                return
+
+            while 0 < self.capacity <= self.size:
+                self.condition.wait()
+
+            self.queues[zlib.crc32(str(key).encode('utf-8')) % len(self.queues)].append(statement_set)
+            self.size += 1
+            self.condition.notify_all()
+
+    def get(self, consumer_index: int):
+        with self.condition:
+            while True:
+                if len(self.queues[consumer_index]) > 0:
+                    statement_set = self.queues[consumer_index].popleft()
+
+                elif self.size > 0:
+                    # Our own queue has run dry. Steal the oldest set of the longest queue.
+                    statement_set = max(self.queues, key=len).popleft()
+                    self.steals += 1
+
+                elif self.is_closed:
+                    return 0
+
+                else:
+                    self.condition.wait()
+                    continue
+
+                self.size -= 1
+                self.condition.notify_all()
+                return statement_set
+
+    def qsize(self) -> int:
+        return self.size
+
+    def get_view(self, consumer_index: int) -> '_AffinityDispatcher._ConsumerView':
+        return _AffinityDispatcher._ConsumerView(self, consumer_index)
+
+
+def _build_multi_row_inserts(statement_set: List[str], batch_size: int) -> List[str]:
+    """
+    :param statement_set: Single-row INSERT statements of the form 'insert into [table] values (...);'.
+    :param batch_size: Maximum number of rows to place in a single INSERT.
+    :return: Multi-row INSERT statements of the form 'insert into [table] values (...),(...);'.
+    """
+    multi_row_statements, current_prefix, current_rows = [], None, []
+
+    for statement in statement_set:
+        prefix, row = statement.split('values', 1)
+        row = row.strip().rstrip(';')
+
+        # Flush our batch if we have reached our batch size or we are inserting into a different table.
+        if prefix != current_prefix or len(current_rows) == batch_size:
+            if current_rows:
+                multi_row_statements.append(current_prefix + 'values ' + ','.join(current_rows) + ';')
+            current_prefix, current_rows = prefix, []
+
+        current_rows.append(row)
+
+    if current_rows:
+        multi_row_statements.append(current_prefix + 'values ' + ','.join(current_rows) + ';')
 
-class _MySQLConsumerThread(threading.Thread):
+    return multi_row_statements
+
+
+def _get_statements(statement_set: List[str], is_select: bool, batch_size: int) -> List[str]:
+    """ If batching is enabled, our single-row INSERTs are rewritten into multi-row INSERTs. """
+    if is_select or batch_size <= 1:
+        return statement_set
+
+    return _build_multi_row_inserts(statement_set, batch_size)
+
+
+# Classes of transaction aborts. Anything we cannot classify is treated as a bug, and is only retried a few times.
+ABORT_CLASSES = ['deadlock', 'lock_timeout', 'serialization', 'other']
+
+
+def _classify_mysql_error(error: Exception) -> str:
+    error_code = getattr(error, 'errno', None)
+    if error_code is None and len(error.args) > 0 and isinstance(error.args[0], int):
+        error_code = error.args[0]  # aiomysql errors hold their code as their first argument.
+
+    return {1213: 'deadlock', 1205: 'lock_timeout'}.get(error_code, 'other')
+
+
+def _classify_postgres_error(error: Exception) -> str:
+    return {'40P01': 'deadlock', '55P03': 'lock_timeout', '40001': 'serialization'} \
+        .get(getattr(error, 'pgcode', None), 'other')
+
+
+def _get_backoff(attempt: int, **kwargs) -> float:
+    """ Capped exponential backoff with (full) jitter, for the given retry attempt. """
+    return random.uniform(0, min(kwargs.get('retry_backoff_cap', 1.0),
+                                 kwargs.get('retry_backoff_base', 0.005) * 2 ** attempt))
+
+
+class _ConsumerStatistics:
+    """ Statistics of a single consumer. These are never shared between consumers, so no locking is required. """
+
+    def __init__(self):
+        # Keep track of our transaction times (including retries), per statement class.
+        self.histograms = {'insert': LatencyHistogram(), 'select': LatencyHistogram()}
+
+        # Keep track of our aborts, and the time wasted on these (failed attempt + backoff), per abort class.
+        self.aborts = {abort_class: 0 for abort_class in ABORT_CLASSES}
+        self.wasted_time = {abort_class: 0.0 for abort_class in ABORT_CLASSES}
+        self.useful_time = 0.0
+        self.abandoned = 0
+
+        # Keep track of how long we wait on our producer, and when (in monotonic time) we last committed.
+        self.idle_time = 0.0
+        self.last_commit_time = 0.0
+
+    def record_abort(self, abort_class: str, wasted_time: float) -> None:
+        self.aborts[abort_class] += 1
+        self.wasted_time[abort_class] += wasted_time
+
+    def merge(self, other: '_ConsumerStatistics') -> '_ConsumerStatistics':
+        for statement_class, histogram in other.histograms.items():
+            self.histograms[statement_class].merge(histogram)
+        for abort_class in ABORT_CLASSES:
+            self.aborts[abort_class] += other.aborts[abort_class]
+            self.wasted_time[abort_class] += other.wasted_time[abort_class]
+        self.useful_time += other.useful_time
+        self.abandoned += other.abandoned
+        self.idle_time += other.idle_time
+        self.last_commit_time = max(self.last_commit_time, other.last_commit_time)
+        return self
+
+    @staticmethod
+    def merge_all(statistics: Iterable['_ConsumerStatistics']) -> '_ConsumerStatistics':
+        merged_statistics = _ConsumerStatistics()
+        for s in statistics:
+            merged_statistics.merge(s)
+        return merged_statistics
+
+
+class _AbstractConsumerThread(threading.Thread, abc.ABC):
     def __init__(self, **kwargs):
-        self.conn = get_mysql_new_connection(
-            user=kwargs['username'],
-            password=kwargs['password'],
-            host=kwargs['hostname'],
-            database=kwargs['database']
-        )
-        self.conn.autocommit = False
+        self.conn = self._get_connection(**kwargs)
+
+        self.statistics = _ConsumerStatistics()
 
-        # Keep track of our average transaction time.
-        self.insert_average, self.select_average = 0, 0
-        self.insert_total, self.select_total = 0, 0
+        # Prepared statements are per-connection, so we keep a cache of these per-thread (keyed by template).
+        self.prepared_statements = {}
 
         self.kwargs = kwargs
         super().__init__(daemon=True)
 
-    def _update_averages(self, new_delta: float, is_select: bool):
-        if is_select:
-            self.select_average = ((self.select_average * self.select_total) + new_delta) / (self.select_total + 1)
-            self.select_total += 1
-        else:
-            self.insert_average = ((self.insert_average * self.insert_total) + new_delta) / (self.insert_total + 1)
-            self.insert_total += 1
+    @abc.abstractmethod
+    def _get_connection(self, **kwargs):
+        """ Open and configure a new connection to our database. """
+        pass
+
+    @abc.abstractmethod
+    def _begin_transaction(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _execute_prepared(self, statement: str):
+        """ Run the statement as a server-side prepared statement (preparing it on first use). Returns the cursor. """
+        pass
+
+    @abc.abstractmethod
+    def _classify_error(self, error: Exception) -> str:
+        """ Map a driver error to one of our ABORT_CLASSES. """
+        pass
 
     def run(self) -> None:
-        global _statement_set_queue
+        global _statement_set_queue, _live_metrics, _statement_set_taken
+        live_metrics, statement_set_taken = _live_metrics, _statement_set_taken
+
+        # Under affinity dispatch, we read from our own queue (stealing from others when it runs dry).
+        statement_set_queue = _statement_set_queue
+        if isinstance(_statement_set_queue, _AffinityDispatcher):
+            statement_set_queue = _statement_set_queue.get_view(self.kwargs['consumer_index'])
 
         while True:
-            statement_set = _statement_set_queue.get()
-            _statement_set_queue.task_done()
+            start_of_get = time.perf_counter()
+            statement_set = statement_set_queue.get()
+            self.statistics.idle_time += time.perf_counter() - start_of_get
+            if statement_set_taken is not None:
+                with statement_set_taken:
+                    statement_set_taken.notify()
 
             # We treat the number 0 as our poison pill here.
             if statement_set == 0:
                 break
+            if live_metrics is not None:
+                live_metrics.begin_transaction()
 
             # Begin the transaction.
-            start_of_transaction = datetime.datetime.now()
+            start_of_transaction = time.perf_counter()
             is_select = "select" in statement_set[0]
+            statements = _get_statements(statement_set, is_select, self.kwargs.get('batch_size', 0))
 
+            attempt, is_committed = 0, False
             while True:
-                self.conn.start_transaction(isolation_level=self.kwargs['isolation'])
-                cur = self.conn.cursor()
+                start_of_attempt = time.perf_counter()
+                self._begin_transaction()
+
+                # Prepared statements are run on the cursors held by _execute_prepared, so no cursor is opened here.
+                is_prepared = self.kwargs.get('prepared_statements', False)
+                cur = None if is_prepared else self.conn.cursor()
 
                 try:
-                    for statement in statement_set:
-                        cur.execute(statement)
+                    for statement in statements:
+                        if is_prepared:
+                            cur = self._execute_prepared(statement)
+                        else:
+                            cur.execute(statement)
                         if is_select:
                             cur.fetchall()
 
+                    # We have finished our transaction. Commit our work (this may also abort under SERIALIZABLE).
+                    self.conn.commit()
+                    is_committed = True
                     break
 
-                except:
-                    # If we have an error, wait before retrying.
+                except Exception as e:
+                    abort_class = self._classify_error(e)
                     self.conn.rollback()
-                    time.sleep(random.random())
 
-            # We have finished our transaction. Commit our work.
-            self.conn.commit()
-            end_of_transaction = datetime.datetime.now()
-            self._update_averages((end_of_transaction - start_of_transaction).total_seconds(), is_select)
+                    # If we have an error, wait before retrying. Errors we cannot classify are eventually given up on.
+                    is_abandoned = abort_class == 'other' and attempt >= self.kwargs.get('retry_limit_on_error', 5)
+                    if not is_abandoned:
+                        time.sleep(_get_backoff(attempt, **self.kwargs))
+                    self.statistics.record_abort(abort_class, time.perf_counter() - start_of_attempt)
+                    if live_metrics is not None:
+                        live_metrics.record_abort(abort_class)
+
+                    if is_abandoned:
+                        print(f'[{datetime.datetime.now()}][simulator.py] Abandoning statement set after '
+                              f'{attempt + 1} attempts: {e}')
+                        self.statistics.abandoned += 1
+                        break
+                    attempt += 1
+
+            if is_committed:
+                end_of_transaction = time.perf_counter()
+                self.statistics.last_commit_time = time.monotonic()
+                self.statistics.useful_time += end_of_transaction - start_of_attempt
+                self.statistics.histograms['select' if is_select else 'insert'] \
+                    .record(end_of_transaction - start_of_transaction)
+            if live_metrics is not None:
+                live_metrics.end_transaction('select' if is_select else 'insert',
+                                             time.perf_counter() - start_of_transaction if is_committed else None)
+
+
+class _MySQLConsumerThread(_AbstractConsumerThread):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
 
-        print(
-            f'[{datetime.datetime.now()}][simulator.py] '
-            f'INSERT Average Time (s): {self.insert_average}, '
-            f'SELECT Average Time (s): {self.select_average}.'
+    def _get_connection(self, **kwargs):
+        conn = get_mysql_new_connection(
+            user=kwargs['username'],
+            password=kwargs['password'],
+            host=kwargs['hostname'],
+            database=kwargs['database']
         )
+        conn.autocommit = False
+        return conn
 
+    def _begin_transaction(self) -> None:
+        self.conn.start_transaction(isolation_level=self.kwargs['isolation'])
 
-class _PostgresConsumerThread(threading.Thread):
+    def _execute_prepared(self, statement: str):
+        # A prepared cursor only holds the last statement it prepared, so we keep one cursor per template.
+        template, parameters = normalize_statement(statement, PLACEHOLDER_QMARK)
+        if template not in self.prepared_statements:
+            self.prepared_statements[template] = self.conn.cursor(prepared=True)
+
+        cur = self.prepared_statements[template]
+        cur.execute(template, parameters)
+        return cur
+
+    def _classify_error(self, error: Exception) -> str:
+        return _classify_mysql_error(error)
+
+
+class _PostgresConsumerThread(_AbstractConsumerThread):
     def __init__(self, **kwargs):
-        self.conn = get_postgres_new_connection(
+        super().__init__(**kwargs)
+        self.prepared_cur = None  # A single cursor is reused for every PREPARE and EXECUTE.
+
+    def _get_connection(self, **kwargs):
+        conn = get_postgres_new_connection(
             user=kwargs['username'],
             password=kwargs['password'],
             host=kwargs['hostname'],
             database=kwargs['database']
         )
-        self.conn.autocommit = False
-        self.conn.isolation_level = kwargs['isolation']
+        conn.autocommit = False
+        conn.isolation_level = kwargs['isolation']
+        return conn
+
+    def _begin_transaction(self) -> None:
+        pass  # psycopg2 implicitly begins a transaction on our first statement.
+
+    def _execute_prepared(self, statement: str):
+        template, parameters = normalize_statement(statement, PLACEHOLDER_NUMERIC)
+        if self.prepared_cur is None:
+            self.prepared_cur = self.conn.cursor()
+        cur = self.prepared_cur
+
+        # Prepared statements are not affected by a rollback, so these only need to be prepared once.
+        if template not in self.prepared_statements:
+            cur.execute(f'PREPARE tippers_{len(self.prepared_statements)} AS {template};')
+            self.prepared_statements[template] = f'tippers_{len(self.prepared_statements)}'
+
+        if len(parameters) > 0:
+            cur.execute(f'EXECUTE {self.prepared_statements[template]} ({", ".join(["%s"] * len(parameters))});',
+                        parameters)
+        else:
+            cur.execute(f'EXECUTE {self.prepared_statements[template]};')
+        return cur
 
-        # Keep track of our average transaction time.
-        self.insert_average, self.select_average = 0, 0
-        self.insert_total, self.select_total = 0, 0
+    def _classify_error(self, error: Exception) -> str:
+        return _classify_postgres_error(error)
+
+
+class _AbstractAsyncConsumer(abc.ABC):
+    """ Coroutine equivalent of _AbstractConsumerThread. Many of these share a single event loop. """
+
+    def __init__(self, **kwargs):
+        self.conn = None
+        self.statistics = _ConsumerStatistics()
 
         self.kwargs = kwargs
-        super().__init__(daemon=True)
 
-    def _update_averages(self, new_delta: float, is_select: bool):
-        if is_select:
-            self.select_average = ((self.select_average * self.select_total) + new_delta) / (self.select_total + 1)
-            self.select_total += 1
-        else:
-            self.insert_average = ((self.insert_average * self.insert_total) + new_delta) / (self.insert_total + 1)
-            self.insert_total += 1
+    @abc.abstractmethod
+    async def open_connection(self) -> None:
+        pass
 
-    def run(self) -> None:
-        global _statement_set_queue
+    @abc.abstractmethod
+    async def _begin_transaction(self, cur) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def _commit(self, cur) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def _rollback(self, cur) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _classify_error(self, error: Exception) -> str:
+        """ Map a driver error to one of our ABORT_CLASSES. """
+        pass
+
+    async def run(self, statement_set_queue: asyncio.Queue) -> None:
+        global _live_metrics
+        live_metrics = _live_metrics
+        cur = await self.conn.cursor()
 
         while True:
-            statement_set = _statement_set_queue.get()
-            _statement_set_queue.task_done()
+            start_of_get = time.perf_counter()
+            statement_set = await statement_set_queue.get()
+            self.statistics.idle_time += time.perf_counter() - start_of_get
 
             # We treat the number 0 as our poison pill here.
             if statement_set == 0:
                 break
+            if live_metrics is not None:
+                live_metrics.begin_transaction()
 
             # Begin the transaction.
-            start_of_transaction = datetime.datetime.now()
+            start_of_transaction = time.perf_counter()
             is_select = "select" in statement_set[0]
+            statements = _get_statements(statement_set, is_select, self.kwargs.get('batch_size', 0))
 
+            attempt, is_committed = 0, False
             while True:
-                cur = self.conn.cursor()
+                start_of_attempt = time.perf_counter()
+                await self._begin_transaction(cur)
 
                 try:
-                    for statement in statement_set:
-                        cur.execute(statement)
+                    for statement in statements:
+                        await cur.execute(statement)
                         if is_select:
-                            cur.fetchall()
+                            await cur.fetchall()
+
+                    # We have finished our transaction. Commit our work (this may also abort under SERIALIZABLE).
+                    await self._commit(cur)
+                    is_committed = True
                     break
 
-                except:
-                    # If we have an error, wait before retrying.
-                    self.conn.rollback()
-                    time.sleep(random.random())
+                except Exception as e:
+                    abort_class = self._classify_error(e)
+                    await self._rollback(cur)
+
+                    # If we have an error, wait before retrying. Errors we cannot classify are eventually given up on.
+                    is_abandoned = abort_class == 'other' and attempt >= self.kwargs.get('retry_limit_on_error', 5)
+                    if not is_abandoned:
+                        await asyncio.sleep(_get_backoff(attempt, **self.kwargs))
+                    self.statistics.record_abort(abort_class, time.perf_counter() - start_of_attempt)
+                    if live_metrics is not None:
+                        live_metrics.record_abort(abort_class)
+
+                    if is_abandoned:
+                        print(f'[{datetime.datetime.now()}][simulator.py] Abandoning statement set after '
+                              f'{attempt + 1} attempts: {e}')
+                        self.statistics.abandoned += 1
+                        break
+                    attempt += 1
+
+            if is_committed:
+                end_of_transaction = time.perf_counter()
+                self.statistics.last_commit_time = time.monotonic()
+                self.statistics.useful_time += end_of_transaction - start_of_attempt
+                self.statistics.histograms['select' if is_select else 'insert'] \
+                    .record(end_of_transaction - start_of_transaction)
+            if live_metrics is not None:
+                live_metrics.end_transaction('select' if is_select else 'insert',
+                                             time.perf_counter() - start_of_transaction if is_committed else None)
+
+        self.conn.close()
+
+
+class _MySQLAsyncConsumer(_AbstractAsyncConsumer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    async def open_connection(self) -> None:
+        self.conn = await get_mysql_async_connection(
+            user=self.kwargs['username'],
+            password=self.kwargs['password'],
+            host=self.kwargs['hostname'],
+            database=self.kwargs['database']
+        )
+        async with self.conn.cursor() as cur:
+            await cur.execute(f'SET SESSION TRANSACTION ISOLATION LEVEL {self.kwargs["isolation"]};')
+
+    async def _begin_transaction(self, cur) -> None:
+        await self.conn.begin()
+
+    async def _commit(self, cur) -> None:
+        await self.conn.commit()
 
-            # We have finished our transaction. Commit our work.
-            self.conn.commit()
-            end_of_transaction = datetime.datetime.now()
-            self._update_averages((end_of_transaction - start_of_transaction).total_seconds(), is_select)
+    async def _rollback(self, cur) -> None:
+        await self.conn.rollback()
 
-        print(
-            f'[{datetime.datetime.now()}][simulator.py] '
-            f'INSERT Average Time (s): {self.insert_average}, '
-            f'SELECT Average Time (s): {self.select_average}.'
+    def _classify_error(self, error: Exception) -> str:
+        return _classify_mysql_error(error)
+
+
+class _PostgresAsyncConsumer(_AbstractAsyncConsumer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    async def open_connection(self) -> None:
+        self.conn = await get_postgres_async_connection(
+            user=self.kwargs['username'],
+            password=self.kwargs['password'],
+            host=self.kwargs['hostname'],
+            database=self.kwargs['database']
         )
 
+    async def _begin_transaction(self, cur) -> None:
+        # Asynchronous psycopg2 connections are always in autocommit, so we manage our transactions ourselves.
+        isolation = {1: 'READ COMMITTED', 2: 'REPEATABLE READ', 3: 'SERIALIZABLE'}[self.kwargs['isolation']]
+        await cur.execute(f'BEGIN ISOLATION LEVEL {isolation};')
+
+    async def _commit(self, cur) -> None:
+        await cur.execute('COMMIT;')
+
+    async def _rollback(self, cur) -> None:
+        await cur.execute('ROLLBACK;')
+
+    def _classify_error(self, error: Exception) -> str:
+        return _classify_postgres_error(error)
+
+
+class _AsyncConsumerEngine(threading.Thread):
+    """ Runs every consumer as a coroutine on a single event loop, instead of one thread per connection. """
+
+    def __init__(self, **kwargs):
+        if kwargs.get('prepared_statements', False):
+            print(f'[{datetime.datetime.now()}][simulator.py] Prepared statements are not supported by the asyncio '
+                  f'engine. Statements will be sent as-is.')
+
+        self.consumers = [_MySQLAsyncConsumer(**kwargs) if kwargs['is_mysql'] else _PostgresAsyncConsumer(**kwargs)
+                          for _ in range(kwargs['multiprogramming'])]
+        self.statistics = _ConsumerStatistics()
+
+        self.kwargs = kwargs
+        super().__init__(daemon=True)
+
+    async def _forward_statement_sets(self, statement_set_queue: asyncio.Queue) -> None:
+        """ Move statement sets from our (thread-safe) producer queue to our event loop's queue. """
+        global _statement_set_queue, _statement_set_taken
+        statement_set_taken = _statement_set_taken
+
+        loop, poison_pills = asyncio.get_running_loop(), 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            while poison_pills < len(self.consumers):
+                statement_set = await loop.run_in_executor(executor, _statement_set_queue.get)
+                if statement_set_taken is not None:
+                    with statement_set_taken:
+                        statement_set_taken.notify()
+
+                poison_pills += 1 if statement_set == 0 else 0
+                await statement_set_queue.put(statement_set)
+
+    async def _run_consumers(self) -> None:
+        await asyncio.gather(*[c.open_connection() for c in self.consumers])
+
+        statement_set_queue = asyncio.Queue(self.kwargs['multiprogramming'] + 1)
+        await asyncio.gather(self._forward_statement_sets(statement_set_queue),
+                             *[c.run(statement_set_queue) for c in self.consumers])
+
+    def run(self) -> None:
+        asyncio.run(self._run_consumers())
+
+        # Merge the statistics of each consumer, so we look like a single consumer thread.
+        self.statistics = _ConsumerStatistics.merge_all(c.statistics for c in self.consumers)
+
 
 class _AbstractWorkloadProducer(threading.Thread, abc.ABC):
     def __init__(self, **kwargs):
+        # Keep track of how long we block on our consumers.
+        self.blocked_time = 0.0
+
+        # If our queue is not bounded by MPL + 1, we track what is still in the queue ourselves.
+        self.put_count = 0
+        self.outstanding_sets = collections.deque()  # Of (put index, weight).
+        self.outstanding_weight = 0
+        self.epoch_boundaries = collections.deque()  # Of (workload timestamp, put count at the end of the epoch).
+
+        # If set (i.e. our throughput has converged), we stop replaying our workload at the next epoch.
+        self.stop_event = threading.Event()
+        self.is_stopped_early = False
+
         self.kwargs = kwargs
         super().__init__()
 
-    @staticmethod
-    def _get_table_name(statement: str):
-        statement_split_by_into = statement.split("into")
-        statement_split_by_values = statement_split_by_into[1].split("values")
+    def _wait_for_consumers(self, is_admitted: Callable[[int], bool]) -> None:
+        """ Block until the predicate (given the number of sets our consumers have taken from the queue) holds. """
+        global _statement_set_queue, _statement_set_taken
+
+        # Consumer processes cannot notify us when they take a set, so we poll our queue for these.
+        if _statement_set_taken is None:
+            while not is_admitted(self.put_count - _statement_set_queue.qsize()):
+                time.sleep(0.001)
+            return
 
-        table_name = statement_split_by_values[0]
-        table_name = table_name.replace(' ', "")
+        with _statement_set_taken:
+            _statement_set_taken.wait_for(lambda: is_admitted(self.put_count - _statement_set_queue.qsize()))
 
-        return table_name
+    def _put_statement_set(self, statement_set: List[str], key) -> None:
+        global _statement_set_queue
+        if self.put_count == 0 and self.kwargs.get('run_listener') is not None:
+            self.kwargs['run_listener'].on_first_dispatch()
+        start_of_put = time.perf_counter()
+
+        # Under a memory budget, we wait until the bytes of every set still in the queue (plus ours) fit our budget.
+        if self.kwargs.get('queue_sizing', 'mpl') == 'memory':
+            def _is_admitted(taken_count: int) -> bool:
+                while len(self.outstanding_sets) > 0 and self.outstanding_sets[0][0] < taken_count:
+                    self.outstanding_weight -= self.outstanding_sets.popleft()[1]
+                return self.outstanding_weight == 0 or \
+                    self.outstanding_weight + statement_set_weight <= self.kwargs['queue_memory_budget']
+
+            statement_set_weight = sum(len(statement) for statement in statement_set)
+            self._wait_for_consumers(_is_admitted)
+            self.outstanding_sets.append((self.put_count, statement_set_weight))
+            self.outstanding_weight += statement_set_weight
+
+        if isinstance(_statement_set_queue, _AffinityDispatcher):
+            _statement_set_queue.put(statement_set, key)
+        else:
+            _statement_set_queue.put(statement_set)
+        self.put_count += 1
+        self.blocked_time += time.perf_counter() - start_of_put
+
+    def _wait_for_lookahead(self, timestamp: float) -> None:
+        """ Under a lookahead, we wait until every epoch older than (timestamp - lookahead) has been taken. """
+        start_of_wait = time.perf_counter()
+
+        while len(self.epoch_boundaries) > 0 and \
+                self.epoch_boundaries[0][0] <= timestamp - self.kwargs['queue_lookahead_seconds']:
+            _, epoch_put_count = self.epoch_boundaries.popleft()
+            self._wait_for_consumers(lambda taken_count: taken_count >= epoch_put_count)
+
+        self.blocked_time += time.perf_counter() - start_of_wait
+
+    def _record_schedule_lags(self, start_of_run: datetime.datetime, schedule_lags: List) -> None:
+        """ Log the lag between the intended and actual release time of each epoch to our timing database. """
+        results_conn = get_results_connection(results_file=self.kwargs['timing_db'])
+        results_conn.execute("""
+            CREATE TABLE IF NOT EXISTS ReplayScheduleLag (
+                start_of_run DATETIME NOT NULL,
+                replay_speedup REAL NOT NULL,
+                epoch_timestamp DATETIME NOT NULL,
+                schedule_lag REAL NOT NULL -- Seconds behind the intended release time. --
+            );
+        """)
+        results_conn.executemany("""
+            INSERT INTO ReplayScheduleLag
+            VALUES (?, ?, ?, ?)
+        """, [[start_of_run, self.kwargs['replay_speedup'], datetime.datetime.fromtimestamp(t), lag]
+              for t, lag in schedule_lags])
+        results_conn.commit()
+        results_conn.close()
 
     def run(self) -> None:
         global _statement_set_queue
 
-        file_handle = open(self.kwargs['filename'], 'r')
         local_query_buffer, local_insert_buffer = {}, {}
-        current_timestamp = 0
+
+        # If we are replaying, each epoch is released at (t - t0) / speedup seconds after our first epoch.
+        replay_speedup, schedule_lags = self.kwargs.get('replay_speedup', 0), []
+        first_timestamp, start_of_replay, release_time = None, None, None
+        start_of_run = datetime.datetime.now()
 
         print(f'[{datetime.datetime.now()}][simulator.py] Starting to parse file.')
-        for i, line in enumerate(file_handle):
-            # Parse the query and timestamp.
-            record_values = line.strip().split(';')
-            statement = record_values[0] + ';'
-            timestamp = record_values[1]
-
-            # For our first run, we define a "current" timestamp.
-            if i == 0:
-                current_timestamp = timestamp
-
-            if timestamp != current_timestamp:
-                # If we have reached the next timestamp, this signals to us that we need to flush our buffer.
-                for statement_set_tuple in list(local_query_buffer.items()) + list(local_insert_buffer.items()):
-                    _statement_set_queue.put(statement_set_tuple[1])
-
-                # Reset our parameters.
-                current_timestamp = timestamp
-                local_query_buffer.clear()
-                local_insert_buffer.clear()
-
-            if "insert" in statement:
-                self._aggregate_inserts(statement, local_insert_buffer)
-            else:
-                self._aggregate_selects(statement, local_query_buffer)
-
-        file_handle.close()
-        print(f'[{datetime.datetime.now()}][simulator.py] File is finished being parsed.')
+        if is_compiled_current(self.kwargs['filename']):
+            print(f'[{datetime.datetime.now()}][simulator.py] Using compiled workload.')
+
+        for timestamp, statements in iterate_workload(self.kwargs['filename']):
+            if self.stop_event.is_set():
+                print(f'[{datetime.datetime.now()}][simulator.py] Stopping early, as our throughput has converged.')
+                self.is_stopped_early = True
+                break
+
+            for kind, table_name, statement in statements:
+                if kind == STATEMENT_INSERT:
+                    self._aggregate_inserts(statement, table_name, local_insert_buffer)
+                else:
+                    self._aggregate_selects(statement, local_query_buffer)
 
-        # Flush the remaining items in our buffer.
-        for statement_set_tuple in list(local_query_buffer.items()) + list(local_insert_buffer.items()):
-            _statement_set_queue.put(statement_set_tuple[1])
+            # Wait until this epoch is due.
+            if replay_speedup > 0:
+                if first_timestamp is None:
+                    first_timestamp, start_of_replay = timestamp, time.monotonic()
+                release_time = start_of_replay + (timestamp - first_timestamp) / replay_speedup
+                time.sleep(max(0.0, release_time - time.monotonic()))
+
+            if self.kwargs.get('queue_sizing', 'mpl') == 'lookahead':
+                self._wait_for_lookahead(timestamp)
+
+            # We have reached the end of this timestamp, flush our buffer.
+            for statement_set_tuple in list(local_query_buffer.items()) + list(local_insert_buffer.items()):
+                self._put_statement_set(statement_set_tuple[1], statement_set_tuple[0])
+            if self.kwargs.get('queue_sizing', 'mpl') == 'lookahead':
+                self.epoch_boundaries.append((timestamp, self.put_count))
+
+            # Our lag includes any time spent blocked on a full queue, i.e. our consumers falling behind.
+            if replay_speedup > 0:
+                schedule_lags.append((timestamp, time.monotonic() - release_time))
+
+            # Reset our parameters.
+            local_query_buffer.clear()
+            local_insert_buffer.clear()
+
+        print(f'[{datetime.datetime.now()}][simulator.py] File is finished being parsed.')
+        if replay_speedup > 0 and len(schedule_lags) > 0:
+            print(f'[{datetime.datetime.now()}][simulator.py] '
+                  f'Average Schedule Lag (s): {sum(lag for _, lag in schedule_lags) / len(schedule_lags)}, '
+                  f'Maximum Schedule Lag (s): {max(lag for _, lag in schedule_lags)}.')
 
         # Issue the poison pill '0'.
         print(f'[{datetime.datetime.now()}][simulator.py] Issuing poison pill to consumers.')
         for _ in range(self.kwargs['multiprogramming'] + 1):
             _statement_set_queue.put(0)
 
+        if replay_speedup > 0:
+            self._record_schedule_lags(start_of_run, schedule_lags)
+
         print(f'[{datetime.datetime.now()}][simulator.py] Exiting producer thread.')
         exit(0)
 
     @abc.abstractmethod
-    def _aggregate_inserts(self, statement: str, statement_queue: Dict):
+    def _aggregate_inserts(self, statement: str, table_name: str, statement_queue: Dict):
         pass
 
     @abc.abstractmethod
@@ -228,8 +743,7 @@ class _InsertOnlyWorkloadProducer(_AbstractWorkloadProducer):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    def _aggregate_inserts(self, statement: str, statement_queue: Dict):
-        table_name = self._get_table_name(statement)
+    def _aggregate_inserts(self, statement: str, table_name: str, statement_queue: Dict):
         if table_name in statement_queue:
             statement_queue[table_name].append(statement)
         else:
@@ -243,7 +757,7 @@ class _QueryOnlyWorkloadProducer(_AbstractWorkloadProducer):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    def _aggregate_inserts(self, statement: str, statement_queue: Dict):
+    def _aggregate_inserts(self, statement: str, table_name: str, statement_queue: Dict):
         pass  # We don't consider insert statements.
 
     def _aggregate_selects(self, statement: str, statement_queue: Dict):
@@ -254,8 +768,7 @@ class _CompleteWorkloadProducer(_AbstractWorkloadProducer):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    def _aggregate_inserts(self, statement: str, statement_queue: Dict):
-        table_name = self._get_table_name(statement)
+    def _aggregate_inserts(self, statement: str, table_name: str, statement_queue: Dict):
         if table_name in statement_queue:
             statement_queue[table_name].append(statement)
         else:
@@ -265,69 +778,569 @@ class _CompleteWorkloadProducer(_AbstractWorkloadProducer):
         statement_queue.update({hash(statement): [statement]})
 
 
-def insert_only_workload(**kwargs):
-    # Create our shared queue.
-    global _statement_set_queue
-    _statement_set_queue = queue.Queue(kwargs['multiprogramming'] + 1)
+def get_simulator_options(general_json: Dict) -> Dict:
+    """
+    :param general_json: Contents of the 'general.json' config file.
+    :return: Workload arguments that are shared between all experiments (i.e. not a function of the database).
+    """
+    return {
+        'timing_db': general_json['timing-db'],
+        'batch_size': general_json.get('insert-batch-size', 0),
+        'replay_speedup': general_json.get('replay-speedup', 0),
+        'consumer_engine': general_json.get('consumer-engine', 'thread'),
+        'consumer_processes': general_json.get('consumer-processes', 1),
+        'prepared_statements': general_json.get('prepared-statements', False),
+        'retry_backoff_base': general_json.get('retry-backoff-base', 0.005),
+        'retry_backoff_cap': general_json.get('retry-backoff-cap', 1.0),
+        'retry_limit_on_error': general_json.get('retry-limit-on-error', 5),
+        'queue_sizing': general_json.get('queue-sizing', 'mpl'),
+        'queue_memory_budget': general_json.get('queue-memory-budget', 64 * 1024 * 1024),
+        'queue_lookahead_seconds': general_json.get('queue-lookahead-seconds', 60),
+        'queue_sample_interval': general_json.get('queue-sample-interval', 0.1),
+        'dispatch': general_json.get('dispatch', 'shared'),
+        'resource_sample_interval': general_json.get('resource-sample-interval', 0.1),
+        'client_cpu_threshold': general_json.get('client-cpu-threshold', 0.9),
+        'client_gil_wait_threshold': general_json.get('client-gil-wait-threshold', 0.001),
+        'metrics_port': general_json.get('metrics-port', 0),
+        'metrics_window_seconds': general_json.get('metrics-window-seconds', 10),
+        'steady_state_window': general_json.get('steady-state-window', 5.0),
+        'steady_state_min_windows': general_json.get('steady-state-min-windows', 10),
+        'steady_state_tolerance': general_json.get('steady-state-tolerance', 0.05),
+        'stop_when_converged': general_json.get('stop-when-converged', False),
+    }
 
-    # Spawn our consumer threads. Wait for them to start.
-    consumer_threads = []
-    for _ in range(kwargs['multiprogramming']):
-        consumer_threads.append(_MySQLConsumerThread(**kwargs) if kwargs['is_mysql']
-                                else _PostgresConsumerThread(**kwargs))
-        consumer_threads[-1].start()
-    time.sleep(1)
 
-    # Spawn a producer thread.
-    producer_thread = _InsertOnlyWorkloadProducer(**kwargs)
-    producer_thread.start()
-    producer_thread.join()
-    [c.join() for c in consumer_threads]
-    print(f'[{datetime.datetime.now()}][simulator.py] Exiting simulator.')
+def _record_statistics(start_of_run: datetime.datetime, statistics: _ConsumerStatistics, **kwargs) -> None:
+    """ Report our merged consumer statistics, and log them to our timing database. """
+    for statement_class, histogram in statistics.histograms.items():
+        summary = histogram.get_summary()
+        print(f'[{datetime.datetime.now()}][simulator.py] {statement_class.upper()} Latency (s): ' +
+              ', '.join(f'{k}={v}' for k, v in summary.items()) + '.')
+    print(f'[{datetime.datetime.now()}][simulator.py] Aborts: ' +
+          ', '.join(f'{k}={v}' for k, v in statistics.aborts.items()) + '. '
+          f'Useful Transaction Time (s): {statistics.useful_time}, '
+          f'Wasted Retry Time (s): {sum(statistics.wasted_time.values())}, '
+          f'Abandoned Statement Sets: {statistics.abandoned}.')
+
+    results_conn = get_results_connection(results_file=kwargs['timing_db'])
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS LatencySummary (
+            start_of_run DATETIME NOT NULL,
+            is_mysql INTEGER NOT NULL,
+            multiprogramming INTEGER NOT NULL,
+            statement_class TEXT NOT NULL,
+            transactions INTEGER,
+            mean_latency REAL,
+            p50_latency REAL,
+            p90_latency REAL,
+            p99_latency REAL,
+            p999_latency REAL,
+            max_latency REAL
+        );
+    """)
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS LatencyHistogram (
+            start_of_run DATETIME NOT NULL,
+            statement_class TEXT NOT NULL,
+            bucket_lower_bound REAL NOT NULL, -- Bounds are inclusive, and measured in seconds. --
+            bucket_upper_bound REAL NOT NULL,
+            transactions INTEGER NOT NULL
+        );
+    """)
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS AbortSummary (
+            start_of_run DATETIME NOT NULL,
+            abort_class TEXT NOT NULL,
+            aborts INTEGER NOT NULL,
+            wasted_time REAL NOT NULL -- Time spent on failed attempts and their backoff, in seconds. --
+        );
+    """)
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS TransactionTimeSummary (
+            start_of_run DATETIME NOT NULL,
+            useful_time REAL NOT NULL, -- Time spent on successful attempts, in seconds. --
+            wasted_time REAL NOT NULL,
+            abandoned_statement_sets INTEGER NOT NULL
+        );
+    """)
+    for statement_class, histogram in statistics.histograms.items():
+        summary = histogram.get_summary()
+        results_conn.execute("""
+            INSERT INTO LatencySummary
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [start_of_run, kwargs['is_mysql'], kwargs['multiprogramming'], statement_class, summary['count'],
+              summary['mean'], summary['p50'], summary['p90'], summary['p99'], summary['p999'], summary['max']])
+        results_conn.executemany("""
+            INSERT INTO LatencyHistogram
+            VALUES (?, ?, ?, ?, ?)
+        """, [[start_of_run, statement_class] + list(bucket) for bucket in histogram.get_buckets()])
+    results_conn.executemany("""
+        INSERT INTO AbortSummary
+        VALUES (?, ?, ?, ?)
+    """, [[start_of_run, k, statistics.aborts[k], statistics.wasted_time[k]] for k in ABORT_CLASSES])
+    results_conn.execute("""
+        INSERT INTO TransactionTimeSummary
+        VALUES (?, ?, ?, ?)
+    """, [start_of_run, statistics.useful_time, sum(statistics.wasted_time.values()), statistics.abandoned])
+
+    results_conn.commit()
+    results_conn.close()
+
+
+class _QueueDepthSampler(threading.Thread):
+    """ Periodically samples the depth of our statement set queue, until stopped. """
 
+    def __init__(self, **kwargs):
+        self.samples = []  # Of (seconds since the start of sampling, queue depth).
+        self.stop_event = threading.Event()
 
-def query_only_workload(**kwargs):
-    # Create our shared queue.
-    global _statement_set_queue
-    _statement_set_queue = queue.Queue(kwargs['multiprogramming'] + 1)
+        self.kwargs = kwargs
+        super().__init__(daemon=True)
+
+    def run(self) -> None:
+        global _statement_set_queue
+
+        start_of_sampling = time.monotonic()
+        while not self.stop_event.wait(self.kwargs.get('queue_sample_interval', 0.1)):
+            self.samples.append((time.monotonic() - start_of_sampling, _statement_set_queue.qsize()))
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
+
+
+def _record_queue_statistics(start_of_run: datetime.datetime, producer_blocked_time: float,
+                             consumer_idle_time: float, depth_samples: List, steals: int, **kwargs) -> None:
+    """ Report how long our producer and consumers waited on each other, and log this to our timing database. """
+    depths = [depth for _, depth in depth_samples]
+    mean_depth = sum(depths) / len(depths) if len(depths) > 0 else 0.0
+    print(f'[{datetime.datetime.now()}][simulator.py] Producer Blocked Time (s): {producer_blocked_time}, '
+          f'Consumer Idle Time (s): {consumer_idle_time}, '
+          f'Average Queue Depth: {mean_depth}, Maximum Queue Depth: {max(depths, default=0)}, '
+          f'Statement Sets Stolen: {steals}.')
+
+    results_conn = get_results_connection(results_file=kwargs['timing_db'])
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS QueueSummary (
+            start_of_run DATETIME NOT NULL,
+            queue_sizing TEXT NOT NULL,
+            producer_blocked_time REAL NOT NULL, -- Summed over our producer, in seconds. --
+            consumer_idle_time REAL NOT NULL, -- Summed over all consumers, in seconds. --
+            mean_queue_depth REAL NOT NULL,
+            max_queue_depth INTEGER NOT NULL,
+            dispatch TEXT NOT NULL,
+            steals INTEGER NOT NULL -- Statement sets taken from another consumer's queue (affinity dispatch only). --
+        );
+    """)
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS QueueDepth (
+            start_of_run DATETIME NOT NULL,
+            elapsed_time REAL NOT NULL,
+            queue_depth INTEGER NOT NULL
+        );
+    """)
+    results_conn.execute("""
+        INSERT INTO QueueSummary
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [start_of_run, kwargs.get('queue_sizing', 'mpl'), producer_blocked_time, consumer_idle_time,
+          mean_depth, max(depths, default=0), kwargs.get('dispatch', 'shared'), steals])
+    results_conn.executemany("""
+        INSERT INTO QueueDepth
+        VALUES (?, ?, ?)
+    """, [[start_of_run, elapsed_time, depth] for elapsed_time, depth in depth_samples])
+    results_conn.commit()
+    results_conn.close()
+
+
+def _get_warmup_length(throughputs: List[float]) -> int:
+    """ :return: Windows to trim as warm-up, chosen by MSER (minimizing the squared standard error of the rest). """
+    sum_of_rest, square_sum_of_rest, mser_statistics = 0.0, 0.0, []
+    for i in range(len(throughputs) - 1, -1, -1):
+        sum_of_rest += throughputs[i]
+        square_sum_of_rest += throughputs[i] ** 2
+        rest_length = len(throughputs) - i
+        mser_statistics.append(((square_sum_of_rest - sum_of_rest ** 2 / rest_length) / rest_length ** 2, i))
+
+    # Only our first half may be trimmed, so a short (and quiet) tail is never taken as our steady state.
+    return min((s for s in mser_statistics if s[1] <= len(throughputs) // 2), default=(0.0, 0))[1]
+
+
+def _get_t_quantile(degrees_of_freedom: int) -> float:
+    """ :return: The 0.975 quantile of Student's t, by its Cornish-Fisher expansion about the normal quantile. """
+    z, v = 1.959964, degrees_of_freedom
+    return z + (z ** 3 + z) / (4 * v) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * v ** 2) + \
+        (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * v ** 3)
+
+
+def _get_steady_state(throughputs: List[float]) -> Tuple[int, Optional[float], Optional[float]]:
+    """ :return: Windows trimmed as warm-up, our mean throughput past these, and the half-width of its 95% CI. """
+    warmup_length = _get_warmup_length(throughputs)
+    steady_throughputs = throughputs[warmup_length:]
+    if len(steady_throughputs) < 2:
+        return warmup_length, steady_throughputs[0] if len(steady_throughputs) > 0 else None, None
+
+    mean = sum(steady_throughputs) / len(steady_throughputs)
+    variance = sum((t - mean) ** 2 for t in steady_throughputs) / (len(steady_throughputs) - 1)
+    return warmup_length, mean, _get_t_quantile(len(steady_throughputs) - 1) * \
+        math.sqrt(variance / len(steady_throughputs))
+
+
+class _SteadyStateTracker(threading.Thread):
+    """ Tracks our commits per second over fixed windows, and checks (each window) if our steady state is known. """
+
+    def __init__(self, get_commit_count: Callable[[], int], on_converged: Callable[[], None] = None, **kwargs):
+        """
+        :param get_commit_count: Callable returning the transactions committed (by all consumers) so far.
+        :param on_converged: If specified, called once our steady-state throughput has first converged.
+        """
+        self.get_commit_count = get_commit_count
+        self.on_converged = on_converged
+        self.windows = []  # Of (seconds since the start of tracking, commits per second over the window ending here).
+        self.converged_time = None  # Seconds since the start of tracking at which we first converged.
+        self.stop_event = threading.Event()
+
+        self.kwargs = kwargs
+        super().__init__(daemon=True)
+
+    def is_converged(self) -> bool:
+        """ :return: True if the confidence interval of our steady-state throughput is narrow enough (relatively). """
+        warmup_length, throughput, half_width = _get_steady_state([t for _, t in self.windows])
+        return len(self.windows) - warmup_length >= self.kwargs.get('steady_state_min_windows', 10) and \
+            half_width is not None and throughput > 0 and \
+            half_width <= self.kwargs.get('steady_state_tolerance', 0.05) * throughput
 
-    # Spawn our consumer threads. Wait for them to start.
+    def run(self) -> None:
+        start_of_tracking = time.monotonic()
+        last_time, last_count = start_of_tracking, self.get_commit_count()
+
+        # Our final (partial) window only holds the drain of our queue, so it is never recorded.
+        while not self.stop_event.wait(self.kwargs.get('steady_state_window', 5.0)):
+            current_time, current_count = time.monotonic(), self.get_commit_count()
+            self.windows.append((current_time - start_of_tracking, (current_count - last_count) /
+                                 (current_time - last_time)))
+            last_time, last_count = current_time, current_count
+
+            if self.converged_time is None and self.is_converged():
+                self.converged_time = current_time - start_of_tracking
+                print(f'[{datetime.datetime.now()}][simulator.py] Throughput has converged after '
+                      f'{self.converged_time} seconds.')
+                if self.on_converged is not None:
+                    self.on_converged()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
+
+
+def _get_commit_count(consumers: List[threading.Thread]) -> int:
+    """ :return: Transactions committed so far by our (in-process) consumers. Read without locking, as an estimate. """
+    statistics = []
+    for consumer in consumers:
+        if isinstance(consumer, _AsyncConsumerEngine):
+            statistics += [c.statistics for c in consumer.consumers]
+        else:
+            statistics.append(consumer.statistics)
+    return sum(h.total_count for s in statistics for h in list(s.histograms.values()))
+
+
+def _record_steady_state_statistics(start_of_run: datetime.datetime, steady_state_tracker: _SteadyStateTracker,
+                                    is_stopped_early: bool, **kwargs) -> None:
+    """ Report our throughput past our warm-up (and whether this converged), and log this to our timing database. """
+    throughputs = [t for _, t in steady_state_tracker.windows]
+    warmup_length, throughput, half_width = _get_steady_state(throughputs)
+    warmup_time = steady_state_tracker.windows[warmup_length - 1][0] if warmup_length > 0 else 0.0
+    is_converged = steady_state_tracker.is_converged()
+    print(f'[{datetime.datetime.now()}][simulator.py] Steady-State Throughput (tx/s): {throughput} +/- {half_width}, '
+          f'Warm-Up Trimmed (s): {warmup_time}, Windows: {len(throughputs)}, Converged: {is_converged}, '
+          f'Stopped Early: {is_stopped_early}.')
+
+    results_conn = get_results_connection(results_file=kwargs['timing_db'])
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS SteadyStateSummary (
+            start_of_run DATETIME NOT NULL,
+            is_mysql INTEGER NOT NULL,
+            window_length REAL NOT NULL, -- Measured in seconds. --
+            windows INTEGER NOT NULL,
+            warmup_windows INTEGER NOT NULL, -- Trimmed from the start of our run by MSER. --
+            warmup_time REAL NOT NULL,
+            steady_throughput REAL, -- Mean commits per second past our warm-up. --
+            ci_half_width REAL, -- Of a 95% confidence interval about our steady-state throughput. --
+            is_converged INTEGER NOT NULL,
+            converged_time REAL, -- Seconds into our run at which we first converged. --
+            is_stopped_early INTEGER NOT NULL
+        );
+    """)
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS ThroughputWindow (
+            start_of_run DATETIME NOT NULL,
+            elapsed_time REAL NOT NULL, -- At the end of the window. --
+            commits_per_second REAL NOT NULL,
+            is_warmup INTEGER NOT NULL
+        );
+    """)
+    results_conn.execute("""
+        INSERT INTO SteadyStateSummary
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [start_of_run, kwargs['is_mysql'], kwargs.get('steady_state_window', 5.0), len(throughputs), warmup_length,
+          warmup_time, throughput, half_width, is_converged, steady_state_tracker.converged_time, is_stopped_early])
+    results_conn.executemany("""
+        INSERT INTO ThroughputWindow
+        VALUES (?, ?, ?, ?)
+    """, [[start_of_run, elapsed_time, t, i < warmup_length]
+          for i, (elapsed_time, t) in enumerate(steady_state_tracker.windows)])
+    results_conn.commit()
+    results_conn.close()
+
+
+def _record_resource_statistics(start_of_run: datetime.datetime, resource_sampler: ResourceSampler, **kwargs) -> None:
+    """ Report the resources used by our own process, flag if we (the client) were the bottleneck, and log these. """
+    summary = resource_sampler.get_summary(kwargs.get('client_cpu_threshold', 0.9),
+                                           kwargs.get('client_gil_wait_threshold', 0.001))
+    thread_utilizations = resource_sampler.get_thread_utilizations()
+    print(f'[{datetime.datetime.now()}][simulator.py] Client CPU Utilization (cores): {summary["cpu_utilization"]}, '
+          f'Busiest Thread: {summary["busiest_thread"]} ({summary["busiest_thread_utilization"]} cores), '
+          f'Mean GIL Wait Estimate (s): {summary["mean_gil_wait"]}, Maximum RSS (bytes): {summary["max_rss"]}, '
+          f'Client-Bound: {summary["is_client_bound"]}.')
+
+    results_conn = get_results_connection(results_file=kwargs['timing_db'])
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS ClientResourceSummary (
+            start_of_run DATETIME NOT NULL,
+            cpu_utilization REAL NOT NULL, -- Mean cores used by our process (consumer processes are excluded). --
+            busiest_thread TEXT,
+            busiest_thread_utilization REAL NOT NULL,
+            max_rss INTEGER NOT NULL, -- Measured in bytes. --
+            voluntary_context_switches INTEGER NOT NULL,
+            involuntary_context_switches INTEGER NOT NULL,
+            mean_gil_wait REAL NOT NULL, -- Mean oversleep of a sleeping thread, in seconds. --
+            is_client_bound INTEGER NOT NULL
+        );
+    """)
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS ClientResourceSample (
+            start_of_run DATETIME NOT NULL,
+            elapsed_time REAL NOT NULL,
+            process_cpu_time REAL NOT NULL, -- Cumulative (user + system), in seconds. --
+            rss INTEGER NOT NULL,
+            voluntary_context_switches INTEGER NOT NULL, -- Cumulative. --
+            involuntary_context_switches INTEGER NOT NULL, -- Cumulative. --
+            gil_wait REAL NOT NULL -- Mean since the previous sample, in seconds. --
+        );
+    """)
+    results_conn.execute("""
+        CREATE TABLE IF NOT EXISTS ClientThreadSummary (
+            start_of_run DATETIME NOT NULL,
+            thread_name TEXT NOT NULL,
+            thread_cpu_time REAL NOT NULL, -- Over the samples the thread was alive for, in seconds. --
+            thread_utilization REAL NOT NULL -- Mean cores used by the thread. --
+        );
+    """)
+    results_conn.execute("""
+        INSERT INTO ClientResourceSummary
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [start_of_run, summary['cpu_utilization'], summary['busiest_thread'], summary['busiest_thread_utilization'],
+          summary['max_rss'], summary['voluntary_context_switches'], summary['involuntary_context_switches'],
+          summary['mean_gil_wait'], summary['is_client_bound']])
+    results_conn.executemany("""
+        INSERT INTO ClientResourceSample
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [[start_of_run] + list(s) for s in resource_sampler.samples])
+    results_conn.executemany("""
+        INSERT INTO ClientThreadSummary
+        VALUES (?, ?, ?, ?)
+    """, [[start_of_run, name, t[3] - t[1], thread_utilizations[name]]
+          for name, t in resource_sampler.thread_times.items()])
+    results_conn.commit()
+    results_conn.close()
+
+
+def _start_consumers(**kwargs) -> List[threading.Thread]:
+    """ Spawn our consumer threads (or our single event loop thread). """
     consumer_threads = []
-    for _ in range(kwargs['multiprogramming']):
-        consumer_threads.append(_MySQLConsumerThread(**kwargs) if kwargs['is_mysql']
-                                else _PostgresConsumerThread(**kwargs))
+    if kwargs.get('consumer_engine', 'thread') == 'asyncio':
+        consumer_threads.append(_AsyncConsumerEngine(**kwargs))
         consumer_threads[-1].start()
-    time.sleep(1)
+    else:
+        for i in range(kwargs['multiprogramming']):
+            consumer_threads.append(_MySQLConsumerThread(consumer_index=i, **kwargs) if kwargs['is_mysql']
+                                    else _PostgresConsumerThread(consumer_index=i, **kwargs))
+            consumer_threads[-1].name = f'consumer-{i}'
+            consumer_threads[-1].start()
 
-    # Spawn a producer thread.
-    producer_thread = _QueryOnlyWorkloadProducer(**kwargs)
-    producer_thread.start()
-    producer_thread.join()
+    return consumer_threads
+
+
+def _consumer_process(statement_set_queue: multiprocessing.Queue, statistics_queue: multiprocessing.Queue, **kwargs):
+    """ Entry point for a consumer process, which owns a slice of our consumer connections. """
+    global _statement_set_queue, _live_metrics, _statement_set_taken
+    _statement_set_queue = statement_set_queue
+    _live_metrics = None  # Our parent's live metrics may have been inherited (by fork), but these are not shared.
+    _statement_set_taken = None
+
+    consumer_threads = _start_consumers(**kwargs)
     [c.join() for c in consumer_threads]
-    print(f'[{datetime.datetime.now()}][simulator.py] Exiting simulator.')
+    statistics_queue.put(_ConsumerStatistics.merge_all(c.statistics for c in consumer_threads))
 
 
-def complete_workload(**kwargs):
-    # Create our shared queue.
+def _check_consumer_processes(consumer_processes: List[multiprocessing.Process]) -> None:
+    """ Fail our run if a consumer process has died (e.g. on a lost connection), instead of waiting on it forever. """
     global _statement_set_queue
-    _statement_set_queue = queue.Queue(kwargs['multiprogramming'] + 1)
 
-    # Spawn our consumer threads. Wait for them to start.
-    consumer_threads = []
-    for _ in range(kwargs['multiprogramming']):
-        consumer_threads.append(_MySQLConsumerThread(**kwargs) if kwargs['is_mysql']
-                                else _PostgresConsumerThread(**kwargs))
-        consumer_threads[-1].start()
+    dead_processes = [c for c in consumer_processes if c.exitcode is not None and c.exitcode != 0]
+    if len(dead_processes) > 0:
+        print(f'[{datetime.datetime.now()}][simulator.py] Consumer process(es) have died w/ exit code(s) '
+              f'{[c.exitcode for c in dead_processes]}. Stopping our run.')
+        _statement_set_queue.cancel_join_thread()  # Our queue may never be drained, so we must not wait on it.
+        [c.terminate() for c in consumer_processes if c.is_alive()]
+        exit(1)
+
+
+def _run_workload(producer_class: type, run_listener=None, **kwargs):
+    """
+    :param producer_class: Type of workload producer to run.
+    :param run_listener: If specified, notified at our first dispatch (on_first_dispatch) and after our last commit
+                         (on_last_commit, given the monotonic time of this commit). This is never passed to consumers.
+    """
+    global _statement_set_queue, _live_metrics, _statement_set_taken
+    start_of_run = datetime.datetime.now()
+    consumer_processes = min(kwargs.get('consumer_processes', 1), kwargs['multiprogramming'])
+
+    # If enabled, serve our live metrics (from localhost) for the duration of this run. Consumer processes keep their
+    # statistics to themselves until they exit, so our live metrics can only be served for in-process consumers.
+    metrics_server, _live_metrics = None, None
+    if kwargs.get('metrics_port', 0) > 0 and consumer_processes > 1:
+        print(f'[{datetime.datetime.now()}][simulator.py] Live metrics are not collected across consumer processes. '
+              f'Metrics will not be served.')
+    elif kwargs.get('metrics_port', 0) > 0:
+        _live_metrics = LiveMetrics(ABORT_CLASSES, kwargs.get('metrics_window_seconds', 10), labels={
+            'database': 'mysql' if kwargs['is_mysql'] else 'postgres',
+            'workload': {_InsertOnlyWorkloadProducer: 'i', _QueryOnlyWorkloadProducer: 'q',
+                         _CompleteWorkloadProducer: 'c'}.get(producer_class, producer_class.__name__),
+            'isolation': kwargs['isolation'],
+            'multiprogramming': kwargs['multiprogramming']
+        }, get_queue_depth=lambda: _statement_set_queue.qsize())
+        try:
+            metrics_server = MetricsServer(_live_metrics, kwargs['metrics_port'])
+            metrics_server.start()
+        except OSError as e:
+            print(f'[{datetime.datetime.now()}][simulator.py] Could not serve live metrics on port '
+                  f'{kwargs["metrics_port"]}: {e}')
+            _live_metrics = None
+
+    # Unless we are bounded by MPL + 1, our producer bounds the queue itself (by memory or by lookahead), waking
+    # whenever one of our consumers takes a set.
+    queue_capacity = kwargs['multiprogramming'] + 1 if kwargs.get('queue_sizing', 'mpl') == 'mpl' else 0
+    _statement_set_taken = threading.Condition() if queue_capacity == 0 and consumer_processes <= 1 else None
+
+    # Affinity dispatch is only supported for consumer threads (in our process). Otherwise, we use our shared queue.
+    if kwargs.get('dispatch', 'shared') == 'affinity' and \
+            (consumer_processes > 1 or kwargs.get('consumer_engine', 'thread') != 'thread'):
+        print(f'[{datetime.datetime.now()}][simulator.py] Affinity dispatch requires consumer threads in a single '
+              f'process. Falling back to shared dispatch.')
+        kwargs['dispatch'] = 'shared'
+
+    if consumer_processes > 1:
+        # Create our shared (pipe-backed) queue, and split our consumers as evenly as possible between processes.
+        _statement_set_queue = multiprocessing.Queue(queue_capacity)
+        statistics_queue = multiprocessing.Queue()
+        consumers = []
+        for i in range(consumer_processes):
+            process_kwargs = dict(kwargs, multiprogramming=kwargs['multiprogramming'] // consumer_processes +
+                                  (1 if i < kwargs['multiprogramming'] % consumer_processes else 0))
+            consumers.append(multiprocessing.Process(target=_consumer_process, daemon=True,
+                                                     args=(_statement_set_queue, statistics_queue),
+                                                     kwargs=process_kwargs))
+            consumers[-1].start()
+
+    elif kwargs.get('dispatch', 'shared') == 'affinity':
+        # Give each consumer its own queue, and route statement sets by table (or by statement, for SELECTs).
+        _statement_set_queue = _AffinityDispatcher(kwargs['multiprogramming'], queue_capacity)
+        consumers, statistics_queue = _start_consumers(**kwargs), None
+
+    else:
+        # Create our shared queue.
+        _statement_set_queue = queue.Queue(queue_capacity)
+        consumers, statistics_queue = _start_consumers(**kwargs), None
+
+    # Wait for our consumers to start.
     time.sleep(1)
 
-    # Spawn a producer thread.
-    producer_thread = _CompleteWorkloadProducer(**kwargs)
+    # Spawn a producer thread, and start sampling our queue (and our own resource usage).
+    queue_depth_sampler = _QueueDepthSampler(**kwargs)
+    producer_thread = producer_class(run_listener=run_listener, **kwargs)
+    producer_thread.name = 'producer'
+    producer_thread.daemon = True  # If our consumers die, our producer may be left blocked on a full queue.
+    resource_sampler = None
+    if kwargs.get('resource_sample_interval', 0.1) > 0:
+        resource_sampler = ResourceSampler(kwargs.get('resource_sample_interval', 0.1))
+        resource_sampler.start()
+
+    # Track our throughput (and, if enabled, stop our producer once it has converged). Consumer processes keep their
+    # statistics to themselves until they exit, so our throughput can only be tracked for in-process consumers.
+    steady_state_tracker = None
+    if kwargs.get('steady_state_window', 5.0) > 0 and consumer_processes <= 1:
+        steady_state_tracker = _SteadyStateTracker(lambda: _get_commit_count(consumers),
+                                                   producer_thread.stop_event.set if
+                                                   kwargs.get('stop_when_converged', False) else None, **kwargs)
+        steady_state_tracker.start()
+    elif kwargs.get('steady_state_window', 5.0) > 0:
+        print(f'[{datetime.datetime.now()}][simulator.py] Throughput is not tracked across consumer processes. '
+              f'Steady-state detection is disabled.')
+
+    queue_depth_sampler.start()
     producer_thread.start()
-    producer_thread.join()
-    [c.join() for c in consumer_threads]
+    while producer_thread.is_alive():
+        producer_thread.join(1.0)
+        if consumer_processes > 1:
+            _check_consumer_processes(consumers)
+    if steady_state_tracker is not None:
+        steady_state_tracker.stop()
+
+    # Merge the statistics of each consumer. Process results must be drained before their processes can be joined.
+    if consumer_processes > 1:
+        statistics = []
+        while len(statistics) < len(consumers):
+            try:
+                statistics.append(statistics_queue.get(timeout=1.0))
+            except queue.Empty:
+                _check_consumer_processes(consumers)
+        [c.join() for c in consumers]
+    else:
+        [c.join() for c in consumers]
+        statistics = [c.statistics for c in consumers]
+
+    statistics = _ConsumerStatistics.merge_all(statistics)
+    if run_listener is not None:
+        run_listener.on_last_commit(statistics.last_commit_time or time.monotonic())
+    queue_depth_sampler.stop()
+    if resource_sampler is not None:
+        resource_sampler.stop()
+
+    _record_statistics(start_of_run, statistics, **kwargs)
+    _record_queue_statistics(start_of_run, producer_thread.blocked_time, statistics.idle_time,
+                             queue_depth_sampler.samples, getattr(_statement_set_queue, 'steals', 0), **kwargs)
+    if resource_sampler is not None:
+        _record_resource_statistics(start_of_run, resource_sampler, **kwargs)
+    if steady_state_tracker is not None:
+        _record_steady_state_statistics(start_of_run, steady_state_tracker, producer_thread.is_stopped_early, **kwargs)
+    if metrics_server is not None:
+        metrics_server.stop()
+    _live_metrics, _statement_set_taken = None, None
     print(f'[{datetime.datetime.now()}][simulator.py] Exiting simulator.')
 
 
+def insert_only_workload(run_listener=None, **kwargs):
+    _run_workload(_InsertOnlyWorkloadProducer, run_listener, **kwargs)
+
+
+def query_only_workload(run_listener=None, **kwargs):
+    _run_workload(_QueryOnlyWorkloadProducer, run_listener, **kwargs)
+
+
+def complete_workload(run_listener=None, **kwargs):
+    _run_workload(_CompleteWorkloadProducer, run_listener, **kwargs)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Simulate transactions using the tipper\'s benchmark.')
 
@@ -337,7 +1350,9 @@ if __name__ == '__main__':
         "concurrency": 'Type of concurrency experiment to run.',
         "isolation": "Isolation level to run.",
         "multiprogramming": 'Multiprogramming level to run.',
-        "config_path": 'Location of configuration files.'
+        "config_path": 'Location of configuration files.',
+        "consumer_engine": 'Overrides the consumer engine in general.json. asyncio multiplexes all connections '
+                           'on a single event loop.'
     }
     parser.add_argument('database', type=str, choices=['postgres', 'mysql'], help=help_strings['database'])
     parser.add_argument('workload', type=str, choices=['i', 'q', 'c'], help=help_strings['workload'])
@@ -345,10 +1360,14 @@ if __name__ == '__main__':
     parser.add_argument('isolation', type=str, choices=['ru', 'rc', 'rr', 's'], help=help_strings['isolation'])
     parser.add_argument('multiprogramming', type=int, help=help_strings['multiprogramming'])
     parser.add_argument('--config_path', type=str, default='config', help=help_strings['config_path'])
+    parser.add_argument('--consumer_engine', type=str, choices=['thread', 'asyncio'],
+                        help=help_strings['consumer_engine'])
     c_args = parser.parse_args()
 
     with open(c_args.config_path + '/general.json', 'r') as general_config_file:
         general_json = json.load(general_config_file)
+    if c_args.consumer_engine is not None:
+        general_json['consumer-engine'] = c_args.consumer_engine
 
     # Define our arguments to the workloads.
     if c_args.database == 'mysql':
@@ -369,6 +1388,7 @@ if __name__ == '__main__':
             }[c_args.isolation],
             'multiprogramming': c_args.multiprogramming,
             'is_mysql': True,
+            **get_simulator_options(general_json)
         }
     else:
         with open(c_args.config_path + '/postgres.json', 'r') as postgres_config_file:
@@ -382,7 +1402,8 @@ if __name__ == '__main__':
             'database': postgres_json['database'],
             'isolation': {'ru': 1, 'rc': 1, 'rr': 2, 's': 3}[c_args.isolation],
             'multiprogramming': c_args.multiprogramming,
-            'is_mysql': True,
+            'is_mysql': False,
+            **get_simulator_options(general_json)
         }
 
     # Run the experiments.